@@ -1,4 +1,7 @@
-from typing import Any, Callable, Generic, Literal, TypedDict, TypeVar
+import json
+import os
+import time
+from typing import Any, Callable, Generic, Literal, NotRequired, TypedDict, TypeVar
 
 from app.repositories.models.conversation import (
     ToolResultModel,
@@ -7,6 +10,11 @@ from app.repositories.models.conversation import (
     RelatedDocumentModel,
 )
 from app.repositories.models.custom_bot import BotModel
+from app.repositories.result_cache import (
+    ResultCache,
+    SharedResultCacheTable,
+    compose_cache_key,
+)
 from app.routes.schemas.conversation import type_model_name
 from pydantic import BaseModel, JsonValue
 from pydantic.json_schema import GenerateJsonSchema, JsonSchemaValue
@@ -16,6 +24,11 @@ from mypy_boto3_bedrock_runtime.type_defs import (
 
 T = TypeVar("T", bound=BaseModel)
 
+# Results of a tool kept in process, for the tools opting in to the cache
+TOOL_RESULT_CACHE_MAX_ENTRIES = int(
+    os.environ.get("TOOL_RESULT_CACHE_MAX_ENTRIES", "128")
+)
+
 
 ToolFunctionResult = str | dict | ToolResultModel
 
@@ -24,6 +37,8 @@ class ToolRunResult(TypedDict):
     tool_use_id: str
     status: Literal["success", "error"]
     related_documents: list[RelatedDocumentModel]
+    # Set if the tool uses the cache
+    cache_hit: NotRequired[bool]
 
 
 class InvalidToolError(Exception):
@@ -42,6 +57,80 @@ class RemoveTitle(GenerateJsonSchema):
         return value
 
 
+def _normalize(value: JsonValue) -> JsonValue:
+    if isinstance(value, str):
+        return " ".join(value.split())
+
+    elif isinstance(value, list):
+        return [_normalize(item) for item in value]
+
+    elif isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+
+    else:
+        return value
+
+
+class _CachedResult(TypedDict):
+    # Source ids of the documents are composed of the id of the tool use which ran the tool
+    tool_use_id: str
+    related_documents: list[RelatedDocumentModel]
+
+
+def _dump_cached_result(result: _CachedResult) -> str:
+    return json.dumps(
+        {
+            "tool_use_id": result["tool_use_id"],
+            "related_documents": [
+                document.model_dump(mode="json", by_alias=True)
+                for document in result["related_documents"]
+            ],
+        }
+    )
+
+
+def _load_cached_result(value: str) -> _CachedResult:
+    result = json.loads(value)
+    return _CachedResult(
+        tool_use_id=result["tool_use_id"],
+        related_documents=[
+            RelatedDocumentModel.model_validate(document)
+            for document in result["related_documents"]
+        ],
+    )
+
+
+class ToolResultCache(ResultCache[_CachedResult]):
+    """Cache of the successful results of a tool, enabled by passing it to `AgentTool`.
+    Keyed by the tool name, the validated input with whitespace normalized, and `bot_params`,
+    the parameters of the bot which the results depend on.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int = TOOL_RESULT_CACHE_MAX_ENTRIES,
+        bot_params: Callable[[BotModel | None], JsonValue] = lambda bot: None,
+        shared: SharedResultCacheTable | None = None,
+    ):
+        super().__init__(
+            "ToolResult",
+            ttl=ttl,
+            max_entries=max_entries,
+            dumps=_dump_cached_result,
+            loads=_load_cached_result,
+            shared=shared,
+        )
+        self.bot_params = bot_params
+
+    def compose_key(self, tool_name: str, arg: BaseModel, bot: BotModel | None) -> str:
+        return compose_cache_key(
+            tool_name,
+            _normalize(arg.model_dump(mode="json")),
+            self.bot_params(bot),
+        )
+
+
 class AgentTool(Generic[T]):
     def __init__(
         self,
@@ -52,11 +141,13 @@ class AgentTool(Generic[T]):
             [T, BotModel | None, type_model_name | None],
             ToolFunctionResult | list[ToolFunctionResult],
         ],
+        cache: ToolResultCache | None = None,
     ):
         self.name = name
         self.description = description
         self.args_schema = args_schema
         self.function = function
+        self.cache = cache
 
     def _generate_input_schema(self) -> dict[str, Any]:
         """Converts the Pydantic model to a JSON schema."""
@@ -79,7 +170,26 @@ class AgentTool(Generic[T]):
     ) -> ToolRunResult:
         try:
             arg = self.args_schema.model_validate(input)
+            cache_key: str | None = None
+            if self.cache is not None:
+                cache_key = self.cache.compose_key(self.name, arg, bot)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return ToolRunResult(
+                        tool_use_id=tool_use_id,
+                        status="success",
+                        related_documents=[
+                            _rebase_source_id(
+                                document, cached["tool_use_id"], tool_use_id
+                            )
+                            for document in cached["related_documents"]
+                        ],
+                        cache_hit=True,
+                    )
+
+            started_at = time.perf_counter()
             res = self.function(arg, bot, model)
+            cost = time.perf_counter() - started_at
             if isinstance(res, list):
                 related_documents = [
                     _function_result_to_related_document(
@@ -100,24 +210,53 @@ class AgentTool(Generic[T]):
                     )
                 ]
 
-            return ToolRunResult(
+            run_result = ToolRunResult(
                 tool_use_id=tool_use_id,
                 status="success",
                 related_documents=related_documents,
             )
+            if self.cache is not None and cache_key is not None:
+                self.cache.put(
+                    cache_key,
+                    _CachedResult(
+                        tool_use_id=tool_use_id, related_documents=related_documents
+                    ),
+                    cost=cost,
+                )
+                run_result["cache_hit"] = False
+
+            return run_result
 
         except Exception as e:
-            return ToolRunResult(
-                tool_use_id=tool_use_id,
-                status="error",
-                related_documents=[
-                    _function_result_to_related_document(
-                        tool_name=self.name,
-                        res=str(e),
-                        source_id_base=tool_use_id,
-                    )
-                ],
-            )
+            return self.error_result(tool_use_id=tool_use_id, error=str(e))
+
+    def error_result(self, tool_use_id: str, error: str) -> ToolRunResult:
+        """Result to tell the model that the tool failed."""
+        return ToolRunResult(
+            tool_use_id=tool_use_id,
+            status="error",
+            related_documents=[
+                _function_result_to_related_document(
+                    tool_name=self.name,
+                    res=error,
+                    source_id_base=tool_use_id,
+                )
+            ],
+        )
+
+
+def _rebase_source_id(
+    document: RelatedDocumentModel, cached_tool_use_id: str, tool_use_id: str
+) -> RelatedDocumentModel:
+    """Copy the cached document with its source id composed of the id of the new tool use."""
+    source_id = document.source_id
+    if source_id == cached_tool_use_id:
+        source_id = tool_use_id
+
+    elif source_id.startswith(f"{cached_tool_use_id}@"):
+        source_id = tool_use_id + source_id[len(cached_tool_use_id) :]
+
+    return document.model_copy(update={"source_id": source_id})
 
 
 def _function_result_to_related_document(
@@ -1,10 +1,18 @@
-from app.agents.tools.agent_tool import AgentTool
+import os
+
+from app.agents.tools.agent_tool import AgentTool, ToolResultCache
 from app.repositories.models.custom_bot import BotModel
 from app.routes.schemas.conversation import type_model_name
 from duckduckgo_search import DDGS
 from pydantic import BaseModel, Field, root_validator
 
 
+# The same queries are searched repeatedly, e.g. by the users of a popular bot
+INTERNET_SEARCH_CACHE_TTL_SECONDS = float(
+    os.environ.get("INTERNET_SEARCH_CACHE_TTL_SECONDS", "600")
+)
+
+
 class InternetSearchInput(BaseModel):
     query: str = Field(description="The query to search for on the internet.")
     country: str = Field(
@@ -67,4 +75,5 @@ internet_search_tool = AgentTool(
     description="Search the internet for information.",
     args_schema=InternetSearchInput,
     function=internet_search,
+    cache=ToolResultCache(ttl=INTERNET_SEARCH_CACHE_TTL_SECONDS),
 )
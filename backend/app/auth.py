@@ -1,20 +1,123 @@
+import logging
 import os
+import threading
+import time
 
 import requests
-from jose import jwt
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
 
 REGION = os.environ.get("REGION", "ap-northeast-1")
 USER_POOL_ID = os.environ.get("USER_POOL_ID", "")
 CLIENT_ID = os.environ.get("CLIENT_ID", "")
+JWKS_URL = (
+    f"https://cognito-idp.{REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
+)
+# Cognito rotates the signing keys rarely. A token signed with a new key triggers a refetch anyway.
+JWKS_CACHE_TTL_SECONDS = float(os.environ.get("JWKS_CACHE_TTL_SECONDS", "3600"))
+# Refetch on unknown `kid` at most once per this interval, so that tokens with arbitrary `kid` do not cause a fetch for each
+JWKS_MIN_REFETCH_INTERVAL_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+
+class JwksCache:
+    """Public keys of the JWKS document, parsed once and looked up by `kid`.
+    The document is refetched when the TTL expires or an unknown `kid` is seen.
+    Concurrent fetches are coalesced: threads missing the cache wait for the fetch in progress
+    and use its result instead of fetching again.
+    If the refetch fails, the keys fetched before are still used, and only unknown `kid` is rejected.
+    The fetch is retried after `min_refetch_interval`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl: float = JWKS_CACHE_TTL_SECONDS,
+        min_refetch_interval: float = JWKS_MIN_REFETCH_INTERVAL_SECONDS,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.fetches = 0
+        self._keys: dict[str, Key] = {}
+        self._fetched_at = float("-inf")
+        self._failed_at = float("-inf")
+        self._fetch_lock = threading.Lock()
+
+    def _is_expired(self) -> bool:
+        return time.monotonic() - self._fetched_at > self.ttl
+
+    def _fetch(self, fetches: int, kid: str):
+        with self._fetch_lock:
+            if self.fetches != fetches:
+                # Fetched by another thread while waiting for the lock
+                return
+
+            if time.monotonic() - self._failed_at < self.min_refetch_interval:
+                # Failed right before. Use the keys fetched before, if any.
+                return
+
+            if not self._is_expired() and (
+                kid in self._keys
+                # Unknown `kid` right after the fetch
+                or time.monotonic() - self._fetched_at < self.min_refetch_interval
+            ):
+                return
+
+            try:
+                response = requests.get(self.url)
+                response.raise_for_status()
+                keys = {
+                    key["kid"]: jwk.construct(key, algorithm="RS256")
+                    for key in response.json()["keys"]
+                }
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                if kid not in self._keys:
+                    raise e
+
+                logger.warning(
+                    f"Failed to fetch JWKS, using the keys fetched before: {e}"
+                )
+                return
+
+            # Replace at once, so that readers without the lock see either the old or new keys
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.fetches += 1
+            logger.info(f"Fetched JWKS: {list(keys.keys())}")
+
+    def get_key(self, kid: str) -> Key:
+        fetches = self.fetches
+        key = self._keys.get(kid)
+        if key is None or self._is_expired():
+            self._fetch(fetches, kid)
+            key = self._keys.get(kid)
+
+        if key is None:
+            raise JWTError(f"Unknown key id: {kid}")
+
+        return key
+
+    def clear(self):
+        with self._fetch_lock:
+            self._keys = {}
+            self._fetched_at = float("-inf")
+            self._failed_at = float("-inf")
+            self.fetches = 0
+
+
+_jwks_cache = JwksCache(JWKS_URL)
 
 
 def verify_token(token: str) -> dict:
     # Verify JWT token
-    url = f"https://cognito-idp.{REGION}.amazonaws.com/{USER_POOL_ID}/.well-known/jwks.json"
-    response = requests.get(url)
-    keys = response.json()["keys"]
     header = jwt.get_unverified_header(token)
-    key = [k for k in keys if k["kid"] == header["kid"]][0]
+    if "kid" not in header:
+        raise JWTError("Key id is not found in the header")
+
+    key = _jwks_cache.get_key(header["kid"])
     # The JWT returned from the Identity Provider may contain an at_hash
     # jose jwt.decode verifies id_token with access_token by default if it contains at_hash
     # See : https://github.com/mpdavis/python-jose/blob/4b0701b46a8d00988afcc5168c2b3a1fd60d15d8/jose/jwt.py#L59
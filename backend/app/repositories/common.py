@@ -1,8 +1,14 @@
 import json
+import logging
 import os
-from typing import Dict, List, Optional, Sequence
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Generic, Hashable, List, Optional, Sequence, TypeVar
 
 import boto3
+from app.utils import get_client
 
 DDB_ENDPOINT_URL = os.environ.get("DDB_ENDPOINT_URL")
 TABLE_NAME = os.environ.get("TABLE_NAME", "")
@@ -10,6 +16,25 @@ ACCOUNT = os.environ.get("ACCOUNT", "")
 REGION = os.environ.get("REGION", "ap-northeast-1")
 TABLE_ACCESS_ROLE_ARN = os.environ.get("TABLE_ACCESS_ROLE_ARN", "")
 TRANSACTION_BATCH_SIZE = 25
+# In-process cache of the items read by the repositories, which lives while the container is warm.
+# Set `REPOSITORY_CACHE_ENABLED` to `false` to disable it.
+REPOSITORY_CACHE_ENABLED = os.environ.get("REPOSITORY_CACHE_ENABLED", "true") == "true"
+REPOSITORY_CACHE_MAX_ENTRIES = int(os.environ.get("REPOSITORY_CACHE_MAX_ENTRIES", "16"))
+REPOSITORY_CACHE_TTL_SECONDS = float(
+    os.environ.get("REPOSITORY_CACHE_TTL_SECONDS", "300")
+)
+# Resources with the credentials assumed for each user, to avoid calling STS on every table access.
+SCOPED_RESOURCE_CACHE_MAX_ENTRIES = int(
+    os.environ.get("SCOPED_RESOURCE_CACHE_MAX_ENTRIES", "64")
+)
+# Assume the role again this many seconds before the credentials expire
+SCOPED_RESOURCE_REFRESH_MARGIN_SECONDS = 300
+# Number of locks held while assuming the role, shared by the scopes of the same hash
+SCOPED_RESOURCE_LOCKS = 16
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 
 class RecordNotFoundError(Exception):
@@ -24,6 +49,189 @@ class ResourceConflictError(Exception):
     pass
 
 
+class VersionedCache(Generic[T]):
+    """Bounded LRU cache of the values read from items with `Version` attribute.
+    Writers increment `Version` of the item, so callers read only `Version` of the item
+    and use the cached value if it is the same as the cached version.
+    Entries expire after `ttl` seconds even if the version is not changed.
+    The values are not copied. Callers must not modify the returned values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = REPOSITORY_CACHE_MAX_ENTRIES,
+        ttl: float = REPOSITORY_CACHE_TTL_SECONDS,
+        enabled: bool = REPOSITORY_CACHE_ENABLED,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, int, T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> tuple[int, T] | None:
+        """Return the cached version and value, or None if not cached or expired."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, version, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return version, value
+
+    def put(self, key: Hashable, version: int, value: T):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hit: bool):
+        """Record whether the cached value was used, after validating its version."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            hits, misses = self.hits, self.misses
+
+        logger.info(
+            f"{self.name} cache {'hit' if hit else 'miss'} (hits: {hits}, misses: {misses})"
+        )
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class ScopedResourceCache:
+    """Bounded LRU cache of the resources created with the credentials assumed for each scope,
+    i.e. the pair of service name and user id. The credentials are not shared between users,
+    so the row-level access control of each resource is the same as the one created for the call.
+    Entries expire `refresh_margin` seconds before the credentials expire.
+    Resources are not thread-safe, so callers must not use the cached ones directly but `share` them.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SCOPED_RESOURCE_CACHE_MAX_ENTRIES,
+        refresh_margin: float = SCOPED_RESOURCE_REFRESH_MARGIN_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self.sts_calls = 0
+        self.sts_calls_avoided = 0
+        self._entries: OrderedDict[tuple[str, str | None], tuple[float, Any]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._creation_locks = [threading.Lock() for _ in range(SCOPED_RESOURCE_LOCKS)]
+
+    def creation_lock(self, service_name: str, user_id: str | None) -> threading.Lock:
+        """Lock to hold while creating the resource of the scope, so that concurrent misses assume the role once."""
+        key = (service_name, user_id)
+        return self._creation_locks[hash(key) % len(self._creation_locks)]
+
+    @staticmethod
+    def share(resource: Any) -> Any:
+        """Return a new resource sharing the low-level client of the cached one, which is thread-safe."""
+        return type(resource)(client=resource.meta.client)
+
+    def get(self, service_name: str, user_id: str | None) -> Any | None:
+        key = (service_name, user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+
+            self._entries.move_to_end(key)
+            self.sts_calls_avoided += 1
+            return entry[1]
+
+    def put(
+        self,
+        service_name: str,
+        user_id: str | None,
+        expiration: datetime,
+        resource: Any,
+    ):
+        key = (service_name, user_id)
+        # Credentials expire in wall clock time. Convert it to monotonic clock.
+        expires_in = (expiration - datetime.now(timezone.utc)).total_seconds()
+        with self._lock:
+            self.sts_calls += 1
+            self._entries[key] = (
+                time.monotonic() + expires_in - self.refresh_margin,
+                resource,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            sts_calls, sts_calls_avoided = self.sts_calls, self.sts_calls_avoided
+
+        logger.info(
+            f"Assumed role for {service_name} (STS calls: {sts_calls}, avoided: {sts_calls_avoided})"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.sts_calls = 0
+            self.sts_calls_avoided = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "sts_calls": self.sts_calls,
+                "sts_calls_avoided": self.sts_calls_avoided,
+            }
+
+
+_scoped_resource_cache = ScopedResourceCache()
+
+
+def compose_initial_version() -> int:
+    """`Version` of a new item. Writers increment it by one from there.
+    It is unique over time, so that a value cached for an item deleted before
+    never matches the new item stored with the same key.
+    """
+    return time.time_ns()
+
+
 def compose_conv_id(user_id: str, conversation_id: str):
     # Add user_id prefix for row level security to match with `LeadingKeys` condition
     return f"{user_id}#CONV#{conversation_id}"
@@ -33,6 +241,16 @@ def decompose_conv_id(conv_id: str):
     return conv_id.split("#")[-1]
 
 
+def compose_conv_message_id(user_id: str, conversation_id: str, message_id: str):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    # NOTE: Use a prefix other than `#CONV#` so that conversation list queries do not read messages
+    return f"{user_id}#CONV_MESSAGE#{conversation_id}#{message_id}"
+
+
+def decompose_conv_message_id(composed_id: str):
+    return composed_id.split("#")[-1]
+
+
 def compose_bot_id(user_id: str, bot_id: str):
     # Add user_id prefix for row level security to match with `LeadingKeys` condition
     return f"{user_id}#BOT#{bot_id}"
@@ -80,6 +298,19 @@ def _get_aws_resource(service_name: str, user_id: Optional[str] = None):
         else:
             return boto3.resource(service_name, region_name=REGION)  # type: ignore[call-overload]
 
+    resource = _scoped_resource_cache.get(service_name, user_id)
+    if resource is None:
+        with _scoped_resource_cache.creation_lock(service_name, user_id):
+            # Created by another thread while waiting for the lock
+            resource = _scoped_resource_cache.get(service_name, user_id)
+            if resource is None:
+                resource = _create_scoped_resource(service_name, user_id)
+
+    return _scoped_resource_cache.share(resource)
+
+
+def _create_scoped_resource(service_name: str, user_id: Optional[str]):
+    """Create the resource with the role assumed for the user, and cache it."""
     policy_document: Dict[str, List[Dict]] = {
         "Statement": [
             {
@@ -111,7 +342,7 @@ def _get_aws_resource(service_name: str, user_id: Optional[str] = None):
             "ForAllValues:StringLike": {"dynamodb:LeadingKeys": [f"{user_id}*"]}
         }
 
-    sts_client = boto3.client("sts")
+    sts_client = get_client("sts")
     assumed_role_object = sts_client.assume_role(
         RoleArn=TABLE_ACCESS_ROLE_ARN,
         RoleSessionName="DynamoDBSession",
@@ -123,7 +354,11 @@ def _get_aws_resource(service_name: str, user_id: Optional[str] = None):
         aws_secret_access_key=credentials["SecretAccessKey"],
         aws_session_token=credentials["SessionToken"],
     )
-    return session.resource(service_name, region_name=REGION)  # type: ignore[call-overload]
+    resource = session.resource(service_name, region_name=REGION)  # type: ignore[call-overload]
+    _scoped_resource_cache.put(
+        service_name, user_id, credentials["Expiration"], resource
+    )
+    return resource
 
 
 def _get_dynamodb_client(user_id: Optional[str] = None):
@@ -1,9 +1,12 @@
+import base64
 import json
 import logging
 import os
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from decimal import Decimal as decimal
+from typing import Any, Literal
 
-import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from pydantic import TypeAdapter
@@ -11,9 +14,14 @@ from pydantic import TypeAdapter
 from app.repositories.common import (
     TRANSACTION_BATCH_SIZE,
     RecordNotFoundError,
+    ResourceConflictError,
+    VersionedCache,
     _get_table_client,
+    compose_initial_version,
     compose_conv_id,
+    compose_conv_message_id,
     decompose_conv_id,
+    decompose_conv_message_id,
     compose_related_document_source_id,
     decompose_related_document_source_id,
 )
@@ -25,6 +33,7 @@ from app.repositories.models.conversation import (
     RelatedDocumentModel,
     ToolResultModel,
 )
+from app.utils import get_client
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -33,15 +42,61 @@ THRESHOLD_LARGE_MESSAGE = 300 * 1024  # 300KB
 LARGE_MESSAGE_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
 
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
-s3_client = boto3.client("s3", BEDROCK_REGION)
+s3_client = get_client("s3", BEDROCK_REGION)
 
+type_storage_mode = Literal["message_map", "message_item"]
 
-def store_conversation(
-    user_id: str, conversation: ConversationModel, threshold=THRESHOLD_LARGE_MESSAGE
-):
-    logger.info(f"Storing conversation: {conversation.model_dump_json()}")
-    table = _get_table_client(user_id)
+# Layout of the messages of a conversation.
+# - `message_map`: The whole message tree is serialized into `MessageMap` attribute of the conversation item.
+# - `message_item`: Each message is stored as an individual item, and the conversation item holds metadata only.
+#   A chat turn writes only the new messages, so the cost does not grow with the conversation length.
+# Conversations stored on either layout can be read regardless of this setting.
+CONVERSATION_STORAGE_MODE: type_storage_mode = (
+    "message_item"
+    if os.environ.get("CONVERSATION_STORAGE_MODE") == "message_item"
+    else "message_map"
+)
+# Value of `MessageStorage` attribute of the conversation item stored on `message_item` layout
+MESSAGE_STORAGE_ITEM = "ITEM"
+
+# Version byte prepended to binary `MessageMap`. Plain JSON strings are written for small conversations.
+# - 1: zlib compressed compact JSON
+MESSAGE_MAP_ENCODING_ZLIB_JSON = 1
+# NOTE: Conversation is compressed on every turn before the stream finishes, so prefer speed over ratio.
+# Level 1 is several times faster than the default level 6 and the output is only about 25% larger.
+MESSAGE_MAP_COMPRESSION_LEVEL = 1
+
+# Value of `LargeMessageLayout` attribute of the conversation item whose messages are stored
+# as individual S3 objects under `LargeMessagePath`, indexed by `MessageIndex` attribute.
+# Without the attribute, the whole message map is stored as a single object at `LargeMessagePath`.
+LARGE_MESSAGE_LAYOUT_SEGMENTED = "SEGMENTED"
+# Number of concurrent requests to read or write the message objects
+LARGE_MESSAGE_CONCURRENCY = 16
+# Number of concurrent `BatchWriteItem` and `DeleteObjects` requests to delete items in bulk
+BULK_DELETE_CONCURRENCY = 8
+# `DeleteObjects` accepts up to 1000 keys
+S3_DELETE_BATCH_SIZE = 1000
+
+# Number of attempts to store the whole conversation while others write it
+STORE_CONVERSATION_MAX_ATTEMPTS = 3
 
+# Pages of `CONVERSATION_LIST_PAGE_SIZE` conversations read to list them without pagination
+MAX_QUERY_COUNT = 5
+CONVERSATION_LIST_PAGE_SIZE = 1000
+
+# Conversations read by this container, keyed by (user_id, conversation_id).
+# Conversations whose messages are stored in S3 are not cached.
+_conversation_cache: VersionedCache[ConversationModel] = VersionedCache("Conversation")
+
+# Serialize the whole message map to JSON bytes in one pass, without intermediate dicts
+_message_map_adapter = TypeAdapter(dict[str, MessageModel])
+
+
+def _next_version(version: int) -> int:
+    return version + 1 if version > 0 else compose_initial_version()
+
+
+def _compose_conversation_item(user_id: str, conversation: ConversationModel) -> dict:
     item_params = {
         "PK": user_id,
         "SK": compose_conv_id(user_id, conversation.id),
@@ -52,44 +107,678 @@ def store_conversation(
         "TotalPrice": decimal(str(conversation.total_price)),
         "LastMessageId": conversation.last_message_id,
         "ShouldContinue": conversation.should_continue,
+        # Denormalized for the conversation list, which does not read messages.
+        # NOTE: all message has the same model
+        "Model": (
+            conversation.message_map["system"].model
+            if "system" in conversation.message_map
+            else ""
+        ),
+        # Feedback given after the messages were stored, keyed by message id.
+        # It is merged into the messages on loading, so it is folded into them when the whole conversation is stored.
+        "Feedback": {},
+        # Incremented on every write, to validate the conversations cached by the containers
+        "Version": _next_version(conversation._version),
     }
 
     if conversation.bot_id:
         item_params["BotId"] = conversation.bot_id
 
-    message_map = {
-        k: v.model_dump(by_alias=True) for k, v in conversation.message_map.items()
+    return item_params
+
+
+def _compose_message_item_path(user_id: str, conversation_id: str) -> str:
+    # NOTE: Separate from the path of the segmented layout, whose objects are deleted on migration
+    return f"{user_id}/{conversation_id}/message_items/"
+
+
+def _compose_message_items(
+    user_id: str,
+    conversation_id: str,
+    message_map: dict[str, MessageModel],
+    message_ids: list[str],
+) -> list[dict]:
+    """Compose the items of the messages.
+    Messages exceeding `THRESHOLD_LARGE_MESSAGE`, e.g. with large attachments, do not fit in an item (400KB).
+    They are stored in S3 and their items refer to the objects.
+    """
+    items: list[dict] = []
+    large_message_ids: list[str] = []
+    large_message_path = _compose_message_item_path(user_id, conversation_id)
+    for message_id in message_ids:
+        item: dict[str, Any] = {
+            "PK": user_id,
+            "SK": compose_conv_message_id(user_id, conversation_id, message_id),
+        }
+        # NOTE: `children` is not stored but restored from `parent` on loading,
+        # so that appending a message does not require rewriting its parent.
+        message_json = message_map[message_id].model_dump_json(
+            by_alias=True, exclude={"children"}
+        )
+        if len(message_json.encode("utf-8")) > THRESHOLD_LARGE_MESSAGE:
+            item["IsLargeMessage"] = True
+            item["LargeMessagePath"] = _compose_large_message_key(
+                large_message_path, message_id
+            )
+            large_message_ids.append(message_id)
+        else:
+            item["Message"] = message_json
+
+        items.append(item)
+
+    if large_message_ids:
+        logger.info(f"Storing large messages {large_message_ids} in S3")
+        _put_large_messages(large_message_path, message_map, large_message_ids)
+
+    return items
+
+
+def _message_model_from_json(message_json: str | bytes) -> MessageModel:
+    return MessageModel.model_validate(
+        {
+            **json.loads(message_json),
+            "children": [],
+        }
+    )
+
+
+def _message_model_from_item(item: dict) -> MessageModel:
+    return _message_model_from_json(item["Message"])
+
+
+def _restore_children(message_map: dict[str, MessageModel]):
+    """Restore `children` of the messages from `parent`.
+    Siblings are ordered by creation time, which is the order they were appended in.
+    """
+    for message_id, message in sorted(
+        message_map.items(), key=lambda x: (x[1].create_time, x[0])
+    ):
+        if message.parent is not None and message.parent in message_map:
+            message_map[message.parent].children.append(message_id)
+
+
+def _store_conversation_as_message_items(user_id: str, conversation: ConversationModel):
+    table = _get_table_client(user_id)
+
+    # Store messages first so that the conversation item never refers to missing messages
+    message_items = _compose_message_items(
+        user_id=user_id,
+        conversation_id=conversation.id,
+        message_map=conversation.message_map,
+        message_ids=list(conversation.message_map.keys()),
+    )
+    with table.batch_writer() as writer:
+        for message_item in message_items:
+            writer.put_item(Item=message_item)
+
+    item_params = _compose_conversation_item(user_id, conversation)
+    item_params["MessageStorage"] = MESSAGE_STORAGE_ITEM
+
+    response = _put_conversation_item(table, conversation, item_params)
+
+    # Migrated from `message_map` layout. Remove the messages stored in S3.
+    _delete_large_messages(response.get("Attributes", {}))
+
+    conversation._version = item_params["Version"]
+    conversation._large_message_path = None
+    _cache_conversation(user_id, conversation)
+
+    return response
+
+
+def _put_conversation_item(
+    table, conversation: ConversationModel, item_params: dict
+) -> dict:
+    """Put the conversation item on condition that its `Version` is still the loaded one,
+    so that two writers never store different conversations with the same version.
+    If others wrote it meanwhile, the title and the feedback they updated in place are kept,
+    and the item is put again on their version.
+    """
+    for _ in range(STORE_CONVERSATION_MAX_ATTEMPTS):
+        condition: dict[str, Any] = {
+            "ExpressionAttributeNames": {"#version": "Version"}
+        }
+        if conversation._version > 0:
+            condition["ConditionExpression"] = "#version = :expected"
+            condition["ExpressionAttributeValues"] = {
+                ":expected": conversation._version
+            }
+        else:
+            # New, or stored before `Version` attribute was introduced
+            condition["ConditionExpression"] = "attribute_not_exists(#version)"
+
+        try:
+            return table.put_item(Item=item_params, ReturnValues="ALL_OLD", **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+
+        response = table.get_item(
+            Key={"PK": item_params["PK"], "SK": item_params["SK"]},
+            ProjectionExpression="#version, Title, Feedback",
+            ExpressionAttributeNames={"#version": "Version"},
+            ConsistentRead=True,
+        )
+        current = response.get("Item", {})
+        logger.warning(
+            f"Conversation {conversation.id} was written by others "
+            f"(version {conversation._version} -> {current.get('Version')}). Storing on their version."
+        )
+        conversation._version = int(current.get("Version", 0))
+        if "Title" in current:
+            conversation.title = current["Title"]
+            item_params["Title"] = current["Title"]
+
+        _merge_feedback(conversation.message_map, current)
+        item_params["Feedback"] = {
+            message_id: feedback
+            for message_id, feedback in current.get("Feedback", {}).items()
+            if message_id in conversation.message_map
+        }
+        item_params["Version"] = _next_version(conversation._version)
+
+    raise ResourceConflictError(
+        f"Conversation {conversation.id} is being written by others"
+    )
+
+
+def _serialize_message_map(message_map: dict[str, MessageModel]) -> bytes:
+    return _message_map_adapter.dump_json(message_map, by_alias=True)
+
+
+def _encode_message_map(message_map_json: bytes) -> bytes:
+    return bytes([MESSAGE_MAP_ENCODING_ZLIB_JSON]) + zlib.compress(
+        message_map_json, MESSAGE_MAP_COMPRESSION_LEVEL
+    )
+
+
+def _decode_message_map(value: Any) -> dict[str, Any]:
+    """Decode `MessageMap` attribute, which is either a JSON string or a versioned binary.
+    Note that boto3 returns binary attributes as `boto3.dynamodb.types.Binary`.
+    """
+    if isinstance(value, str):
+        return json.loads(value)
+
+    data = bytes(value)
+    version = data[0]
+    if version == MESSAGE_MAP_ENCODING_ZLIB_JSON:
+        return json.loads(zlib.decompress(data[1:]))
+
+    raise ValueError(f"Unknown message map encoding: {version}")
+
+
+def _compose_large_message_key(large_message_path: str, message_id: str) -> str:
+    return f"{large_message_path}{message_id}.json"
+
+
+def _compose_message_index_entry(message: MessageModel) -> dict[str, Any]:
+    return {
+        "parent": message.parent,
+        "create_time": decimal(str(message.create_time)),
     }
-    message_map_size = len(json.dumps(message_map).encode("utf-8"))
-    logger.info(f"Message map size: {message_map_size}")
-    if message_map_size > threshold:
-        logger.info(
-            f"Message map size {message_map_size} exceeds threshold {threshold}"
-        )
-        item_params["IsLargeMessage"] = True
-        large_message_path = f"{user_id}/{conversation.id}/message_map.json"
-        item_params["LargeMessagePath"] = large_message_path
-        # Store all message in S3
+
+
+def _put_large_messages(
+    large_message_path: str,
+    message_map: dict[str, MessageModel],
+    message_ids: list[str],
+):
+    def put_message(message_id: str):
         s3_client.put_object(
             Bucket=LARGE_MESSAGE_BUCKET,
-            Key=large_message_path,
-            Body=json.dumps(message_map),
+            Key=_compose_large_message_key(large_message_path, message_id),
+            # NOTE: `children` is restored from `MessageIndex` on loading
+            Body=message_map[message_id].model_dump_json(
+                by_alias=True, exclude={"children"}
+            ),
         )
+
+    with ThreadPoolExecutor(max_workers=LARGE_MESSAGE_CONCURRENCY) as executor:
+        # Consume the results to raise errors
+        list(executor.map(put_message, message_ids))
+
+
+def _get_large_messages(
+    large_message_path: str, message_ids: list[str]
+) -> dict[str, MessageModel]:
+    def get_message(message_id: str) -> MessageModel:
+        response = s3_client.get_object(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Key=_compose_large_message_key(large_message_path, message_id),
+        )
+        return _message_model_from_json(response["Body"].read())
+
+    with ThreadPoolExecutor(max_workers=LARGE_MESSAGE_CONCURRENCY) as executor:
+        return dict(zip(message_ids, executor.map(get_message, message_ids)))
+
+
+def _large_message_keys(item: dict, kept_item: dict | None = None) -> list[str]:
+    """Return the keys of the messages of the conversation item stored in S3,
+    except the ones still referred by `kept_item`, which replaced the item.
+    """
+    if not item.get("IsLargeMessage", False):
+        return []
+
+    if item.get("LargeMessageLayout") != LARGE_MESSAGE_LAYOUT_SEGMENTED:
+        return [item["LargeMessagePath"]]
+
+    kept_message_ids = (
+        kept_item.get("MessageIndex", {})
+        if kept_item is not None
+        and kept_item.get("LargeMessagePath") == item["LargeMessagePath"]
+        else {}
+    )
+    return [
+        _compose_large_message_key(item["LargeMessagePath"], message_id)
+        for message_id in item["MessageIndex"].keys()
+        if message_id not in kept_message_ids
+    ]
+
+
+def _delete_objects(keys: list[str]):
+    """Delete the objects from the large message bucket, in a single request."""
+    response = s3_client.delete_objects(
+        Bucket=LARGE_MESSAGE_BUCKET,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+    for error in response.get("Errors", []):
+        logger.error(
+            f"Failed to delete large message {error['Key']}: {error['Message']}"
+        )
+
+
+def _delete_large_messages(item: dict, kept_item: dict | None = None):
+    """Delete the messages of the conversation item stored in S3,
+    except the ones still referred by `kept_item`, which replaced the item.
+    """
+    keys = _large_message_keys(item, kept_item)
+    for i in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        _delete_objects(keys[i : i + S3_DELETE_BATCH_SIZE])
+
+
+def _trace_message_index(message_index: dict, message_id: str) -> list[str]:
+    """Trace `MessageIndex` from the message to the root, and return the ids on the way."""
+    message_ids: list[str] = []
+    current_id: str | None = message_id
+    while current_id is not None and current_id in message_index:
+        message_ids.append(current_id)
+        current_id = message_index[current_id]["parent"]
+
+    return message_ids
+
+
+def _compose_message_map_attributes(
+    user_id: str,
+    conversation_id: str,
+    message_map: dict[str, MessageModel],
+    threshold: int,
+) -> dict[str, Any]:
+    """Compose `MessageMap` related attributes of the conversation item.
+    Small message maps are stored as JSON strings, which are readable by the analytics queries.
+    Larger ones are compressed, and only the ones still exceeding the threshold are stored in S3.
+    """
+    # NOTE: Serialize only once, and reuse the buffer for size check and storing
+    message_map_json = _serialize_message_map(message_map)
+    message_map_size = len(message_map_json)
+    logger.info(f"Message map size: {message_map_size}")
+    if message_map_size <= threshold:
+        return {
+            "IsLargeMessage": False,
+            "MessageMap": message_map_json.decode("utf-8"),
+        }
+
+    encoded_message_map = _encode_message_map(message_map_json)
+    encoded_message_map_size = len(encoded_message_map)
+    logger.info(f"Compressed message map size: {encoded_message_map_size}")
+    if encoded_message_map_size <= threshold:
+        return {
+            "IsLargeMessage": False,
+            "MessageMap": encoded_message_map,
+        }
+
+    logger.info(
+        f"Compressed message map size {encoded_message_map_size} exceeds threshold {threshold}"
+    )
+    # Store each message in S3, so that appending a message does not rewrite the others,
+    # and chat can read only the branch it continues.
+    large_message_path = f"{user_id}/{conversation_id}/messages/"
+    _put_large_messages(large_message_path, message_map, list(message_map.keys()))
+    return {
+        "IsLargeMessage": True,
+        "LargeMessagePath": large_message_path,
+        "LargeMessageLayout": LARGE_MESSAGE_LAYOUT_SEGMENTED,
+        "MessageIndex": {
+            message_id: _compose_message_index_entry(message)
+            for message_id, message in message_map.items()
+        },
         # Store only `system` attribute in DynamoDB
-        item_params["MessageMap"] = json.dumps(
+        "MessageMap": _serialize_message_map(
             {k: v for k, v in message_map.items() if k == "system"}
+        ).decode("utf-8"),
+    }
+
+
+def _cache_conversation(user_id: str, conversation: ConversationModel):
+    if conversation._large_message_path is not None:
+        # Too large to keep in memory, and may hold only a branch
+        _conversation_cache.invalidate((user_id, conversation.id))
+        return
+
+    _conversation_cache.put(
+        (user_id, conversation.id),
+        conversation._version,
+        conversation.model_copy(deep=True),
+    )
+
+
+def _find_cached_conversation(
+    table, user_id: str, conversation_id: str
+) -> ConversationModel | None:
+    """Return the cached conversation if its version is the same as the stored one.
+    Only `Version` attribute is read, so S3 and the messages are not read on hit.
+    """
+    key = (user_id, conversation_id)
+    cached = _conversation_cache.get(key)
+    if cached is None:
+        if _conversation_cache.enabled:
+            _conversation_cache.record(hit=False)
+        return None
+
+    version, conversation = cached
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
+        ProjectionExpression="#version",
+        ExpressionAttributeNames={"#version": "Version"},
+        ConsistentRead=True,
+    )
+    if "Item" not in response:
+        _conversation_cache.invalidate(key)
+        raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
+
+    if int(response["Item"].get("Version", 0)) != version:
+        _conversation_cache.invalidate(key)
+        _conversation_cache.record(hit=False)
+        return None
+
+    _conversation_cache.record(hit=True)
+    return conversation.model_copy(deep=True)
+
+
+def store_conversation(
+    user_id: str,
+    conversation: ConversationModel,
+    threshold=THRESHOLD_LARGE_MESSAGE,
+    storage_mode: type_storage_mode = CONVERSATION_STORAGE_MODE,
+):
+    logger.info(f"Storing conversation: {conversation.id}")
+    if storage_mode == "message_item":
+        return _store_conversation_as_message_items(user_id, conversation)
+
+    table = _get_table_client(user_id)
+    item_params = _compose_conversation_item(user_id, conversation)
+
+    item_params.update(
+        _compose_message_map_attributes(
+            user_id=user_id,
+            conversation_id=conversation.id,
+            message_map=conversation.message_map,
+            threshold=threshold,
+        )
+    )
+
+    response = _put_conversation_item(table, conversation, item_params)
+    old_item = response.get("Attributes", {})
+    # Remove the messages stored in S3 before, which are no longer referred
+    _delete_large_messages(old_item, kept_item=item_params)
+    if old_item.get("MessageStorage") == MESSAGE_STORAGE_ITEM:
+        # Migrated back from `message_item` layout. Remove the message items and their objects in S3.
+        _delete_items_by_sk_prefix(
+            table,
+            user_id=user_id,
+            prefix=compose_conv_message_id(user_id, conversation.id, ""),
         )
-    else:
-        item_params["IsLargeMessage"] = False
-        item_params["MessageMap"] = json.dumps(message_map)
 
-    response = table.put_item(
-        Item=item_params,
+    conversation._version = item_params["Version"]
+    conversation._large_message_path = (
+        item_params["LargeMessagePath"] if item_params["IsLargeMessage"] else None
     )
+    _cache_conversation(user_id, conversation)
     return response
 
 
-def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
+def append_conversation_messages(
+    user_id: str,
+    conversation: ConversationModel,
+    message_ids: list[str],
+    deleted_message_ids: list[str] | None = None,
+    storage_mode: type_storage_mode = CONVERSATION_STORAGE_MODE,
+):
+    """Store the conversation after messages are appended to it.
+    On `message_item` layout, only the given messages and the conversation item are written.
+    If the conversation is new or stored on `message_map` layout, the whole conversation is stored (migrated).
+    """
+    if deleted_message_ids is None:
+        deleted_message_ids = []
+
+    if storage_mode != "message_item":
+        if conversation._large_message_path is not None:
+            return _append_large_messages(
+                user_id, conversation, message_ids, deleted_message_ids
+            )
+
+        return store_conversation(user_id, conversation, storage_mode=storage_mode)
+
+    logger.info(f"Appending messages {message_ids} to conversation: {conversation.id}")
+    table = _get_table_client(user_id)
+    message_items = _compose_message_items(
+        user_id=user_id,
+        conversation_id=conversation.id,
+        message_map=conversation.message_map,
+        message_ids=message_ids,
+    )
+    with table.batch_writer() as writer:
+        for message_item in message_items:
+            writer.put_item(Item=message_item)
+
+        for message_id in deleted_message_ids:
+            writer.delete_item(
+                Key={
+                    "PK": user_id,
+                    "SK": compose_conv_message_id(user_id, conversation.id, message_id),
+                }
+            )
+
+    try:
+        response = table.update_item(
+            Key={
+                "PK": user_id,
+                "SK": compose_conv_id(user_id, conversation.id),
+            },
+            UpdateExpression="set TotalPrice=:p, LastMessageId=:l, ShouldContinue=:c add #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
+            ExpressionAttributeValues={
+                ":p": decimal(str(conversation.total_price)),
+                ":l": conversation.last_message_id,
+                ":c": conversation.should_continue,
+                ":s": MESSAGE_STORAGE_ITEM,
+                ":one": 1,
+            },
+            ConditionExpression="MessageStorage = :s",
+            ReturnValues="UPDATED_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            logger.info(
+                f"Conversation {conversation.id} is not stored as message items. Storing whole conversation."
+            )
+            if conversation._large_message_path is not None:
+                # Only a branch was loaded. Load the other messages before migrating.
+                _load_other_large_messages(table, user_id, conversation)
+            return _store_conversation_as_message_items(user_id, conversation)
+        else:
+            raise e
+
+    if deleted_message_ids:
+        # The deleted messages may have been stored in S3
+        large_message_path = _compose_message_item_path(user_id, conversation.id)
+        _delete_objects(
+            [
+                _compose_large_message_key(large_message_path, message_id)
+                for message_id in deleted_message_ids
+            ]
+        )
+
+    _update_version(user_id, conversation, response)
+    return response
+
+
+def _append_large_messages(
+    user_id: str,
+    conversation: ConversationModel,
+    message_ids: list[str],
+    deleted_message_ids: list[str],
+):
+    """Store only the given messages of the conversation on the segmented S3 layout,
+    and update `MessageIndex` of the conversation item in place.
+    """
+    assert conversation._large_message_path is not None
+    logger.info(
+        f"Appending large messages {message_ids} to conversation: {conversation.id}"
+    )
+    table = _get_table_client(user_id)
+    _put_large_messages(
+        conversation._large_message_path, conversation.message_map, message_ids
+    )
+
+    attribute_names = {"#version": "Version"}
+    attribute_values: dict[str, Any] = {
+        ":p": decimal(str(conversation.total_price)),
+        ":l": conversation.last_message_id,
+        ":c": conversation.should_continue,
+        ":layout": LARGE_MESSAGE_LAYOUT_SEGMENTED,
+        ":one": 1,
+    }
+    set_actions = ["TotalPrice=:p", "LastMessageId=:l", "ShouldContinue=:c"]
+    for i, message_id in enumerate(message_ids):
+        attribute_names[f"#m{i}"] = message_id
+        attribute_values[f":m{i}"] = _compose_message_index_entry(
+            conversation.message_map[message_id]
+        )
+        set_actions.append(f"MessageIndex.#m{i}=:m{i}")
+
+    update_expression = "set " + ", ".join(set_actions)
+    if deleted_message_ids:
+        for i, message_id in enumerate(deleted_message_ids):
+            attribute_names[f"#d{i}"] = message_id
+        update_expression += " remove " + ", ".join(
+            f"MessageIndex.#d{i}" for i in range(len(deleted_message_ids))
+        )
+    update_expression += " add #version :one"
+
+    # NOTE: Fail if the conversation was rewritten in another layout meanwhile,
+    # since `message_map` holds only a branch and cannot be stored as a whole.
+    response = table.update_item(
+        Key={
+            "PK": user_id,
+            "SK": compose_conv_id(user_id, conversation.id),
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeNames=attribute_names,
+        ExpressionAttributeValues=attribute_values,
+        ConditionExpression="LargeMessageLayout = :layout",
+        ReturnValues="UPDATED_NEW",
+    )
+
+    if deleted_message_ids:
+        _delete_objects(
+            [
+                _compose_large_message_key(conversation._large_message_path, message_id)
+                for message_id in deleted_message_ids
+            ]
+        )
+
+    _update_version(user_id, conversation, response)
+    return response
+
+
+def _update_version(user_id: str, conversation: ConversationModel, response: dict):
+    """Apply `Version` returned by `update_item` to the conversation, and cache it
+    if no one else has updated the conversation since it was loaded.
+    """
+    version = int(response["Attributes"]["Version"])
+    if version == conversation._version + 1:
+        conversation._version = version
+        _cache_conversation(user_id, conversation)
+    else:
+        conversation._version = version
+        _conversation_cache.invalidate((user_id, conversation.id))
+
+
+def _model_from_conversation_item(item: dict) -> str:
+    if "Model" in item:
+        return item["Model"]
+
+    # Items stored before `Model` attribute was introduced
+    if "MessageMap" in item:
+        # NOTE: all message has the same model
+        return (
+            _decode_message_map(item["MessageMap"]).get("system", {}).get("model", "")
+        )
+
+    return ""
+
+
+def _find_legacy_model(table, user_id: str, sort_key: str) -> str:
+    """Read the model of a conversation stored before `Model` attribute was introduced from its `MessageMap`,
+    and store it to `Model`, so that it is read with the other metadata from the next time.
+    """
+    response = table.get_item(
+        Key={"PK": user_id, "SK": sort_key},
+        ProjectionExpression="MessageMap",
+    )
+    model = _model_from_conversation_item(response.get("Item", {}))
+
+    try:
+        table.update_item(
+            Key={"PK": user_id, "SK": sort_key},
+            UpdateExpression="SET Model = :model",
+            ExpressionAttributeValues={":model": model},
+            ConditionExpression="attribute_exists(PK) AND attribute_not_exists(Model)",
+        )
+    except ClientError as e:
+        # Stored or deleted since read. Read again next time otherwise.
+        logger.warning(f"Failed to store model of conversation {sort_key}: {e}")
+
+    return model
+
+
+def _decode_next_token(user_id: str, next_token: str) -> dict:
+    """Decode the token returned by `find_conversation_page_by_user_id` to the key to start the query.
+    Raise ValueError if the token is malformed or not of the conversations of the user.
+    """
+    try:
+        key = json.loads(base64.b64decode(next_token, validate=True).decode("utf-8"))
+    except ValueError as e:
+        raise ValueError(f"Invalid next_token: {e}") from e
+
+    if (
+        not isinstance(key, dict)
+        or set(key) != {"PK", "SK"}
+        or key["PK"] != user_id
+        or not isinstance(key["SK"], str)
+        or not key["SK"].startswith(f"{user_id}#CONV#")
+    ):
+        raise ValueError("Invalid next_token")
+
+    return key
+
+
+def find_conversation_page_by_user_id(
+    user_id: str, limit: int = 100, next_token: str | None = None
+) -> tuple[list[ConversationMeta], str | None]:
+    """Find a page of conversations of the user.
+    Only metadata attributes are read, and the messages are not.
+    """
     logger.info(f"Finding conversations for user: {user_id}")
     table = _get_table_client(user_id)
 
@@ -97,8 +786,12 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
         "KeyConditionExpression": Key("PK").eq(user_id)
         # NOTE: Need SK to fetch only conversations
         & Key("SK").begins_with(f"{user_id}#CONV#"),
+        "ProjectionExpression": "SK, Title, CreateTime, Model, BotId",
         "ScanIndexForward": False,
+        "Limit": limit,
     }
+    if next_token:
+        query_params["ExclusiveStartKey"] = _decode_next_token(user_id, next_token)
 
     response = table.query(**query_params)
     conversations = [
@@ -106,60 +799,156 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
             id=decompose_conv_id(item["SK"]),
             create_time=float(item["CreateTime"]),
             title=item["Title"],
-            # NOTE: all message has the same model
-            model=json.loads(item["MessageMap"]).get("system", {}).get("model", ""),
+            model=(
+                item["Model"]
+                if "Model" in item
+                else _find_legacy_model(table, user_id, item["SK"])
+            ),
             bot_id=item["BotId"] if "BotId" in item else None,
         )
         for item in response["Items"]
     ]
 
-    query_count = 1
-    MAX_QUERY_COUNT = 5
-    while "LastEvaluatedKey" in response:
-        model = (
-            json.loads(response["Items"][0]["MessageMap"])
-            .get("system", {})
-            .get("model", "")
-        )
-        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-        # NOTE: max page size is 1MB
-        # See: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Query.Pagination.html
-        response = table.query(
-            **query_params,
-        )
-        conversations.extend(
-            [
-                ConversationMeta(
-                    id=decompose_conv_id(item["SK"]),
-                    create_time=float(item["CreateTime"]),
-                    title=item["Title"],
-                    model=model,
-                    bot_id=item["BotId"] if "BotId" in item else None,
-                )
-                for item in response["Items"]
-            ]
+    next_token = None
+    if "LastEvaluatedKey" in response:
+        next_token = base64.b64encode(
+            json.dumps(response["LastEvaluatedKey"]).encode("utf-8")
+        ).decode("utf-8")
+
+    return conversations, next_token
+
+
+def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
+    """Find the newest conversations of the user, up to `MAX_QUERY_COUNT` pages.
+    Use `find_conversation_page_by_user_id` to read all of them.
+    """
+    conversations: list[ConversationMeta] = []
+
+    next_token = None
+    for _ in range(MAX_QUERY_COUNT):
+        page, next_token = find_conversation_page_by_user_id(
+            user_id, limit=CONVERSATION_LIST_PAGE_SIZE, next_token=next_token
         )
-        query_count += 1
-        if query_count > MAX_QUERY_COUNT:
-            logger.warning(f"Query count exceeded {MAX_QUERY_COUNT}")
+        conversations.extend(page)
+        if next_token is None:
             break
+    else:
+        logger.warning(f"Query count exceeded {MAX_QUERY_COUNT}")
 
-    logger.info(f"Found conversations: {conversations}")
+    logger.info(f"Found {len(conversations)} conversations")
     return conversations
 
 
-def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationModel:
-    logger.info(f"Finding conversation: {conversation_id}")
-    table = _get_table_client(user_id)
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_conv_id(user_id, conversation_id)),
+def _find_conversation_item(table, user_id: str, conversation_id: str) -> dict:
+    # NOTE: Both keys are known, so use a strongly consistent point read instead of `SKIndex`
+    response = table.get_item(
+        Key={
+            "PK": user_id,
+            "SK": compose_conv_id(user_id, conversation_id),
+        },
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
 
-    # NOTE: conversation is unique
-    item = response["Items"][0]
+    return response["Item"]
+
+
+def _find_message_items(
+    table, user_id: str, conversation_id: str
+) -> dict[str, MessageModel]:
+    """Find the messages of the conversation stored on `message_item` layout.
+    Messages stored in S3 are read after all items are found, concurrently.
+    """
+    message_map: dict[str, MessageModel] = {}
+    large_message_ids: list[str] = []
+
+    last_evaluated_key = None
+    while True:
+        response = table.query(
+            KeyConditionExpression=(
+                Key("PK").eq(user_id)
+                & Key("SK").begins_with(
+                    compose_conv_message_id(user_id, conversation_id, "")
+                )
+            ),
+            # NOTE: The conversation item is read consistently, so read the messages it refers to as well
+            ConsistentRead=True,
+            **(
+                {
+                    "ExclusiveStartKey": last_evaluated_key,
+                }
+                if last_evaluated_key is not None
+                else {}
+            ),
+        )
+        for item in response.get("Items") or []:
+            message_id = decompose_conv_message_id(item["SK"])
+            if item.get("IsLargeMessage", False):
+                large_message_ids.append(message_id)
+            else:
+                message_map[message_id] = _message_model_from_item(item)
+
+        last_evaluated_key = response.get("LastEvaluatedKey")
+        if last_evaluated_key is None:
+            break
+
+    if large_message_ids:
+        message_map.update(
+            _get_large_messages(
+                _compose_message_item_path(user_id, conversation_id),
+                large_message_ids,
+            )
+        )
+
+    _restore_children(message_map)
+    return message_map
+
+
+def _merge_feedback(message_map: dict[str, MessageModel], item: dict):
+    for message_id, feedback in item.get("Feedback", {}).items():
+        if message_id in message_map:
+            message_map[message_id].feedback = FeedbackModel.model_validate(feedback)
+
+
+def _message_map_from_conversation_item(
+    table, user_id: str, item: dict, branch_message_id: str | None = None
+) -> dict[str, MessageModel]:
+    message_map = _load_message_map(table, user_id, item, branch_message_id)
+    _merge_feedback(message_map, item)
+    return message_map
+
+
+def _load_message_map(
+    table, user_id: str, item: dict, branch_message_id: str | None = None
+) -> dict[str, MessageModel]:
+    """Load the messages of the conversation item.
+    If `branch_message_id` is given, messages stored on the segmented S3 layout are loaded
+    only from the message to the root. Other layouts are always loaded as a whole.
+    """
+    if item.get("MessageStorage") == MESSAGE_STORAGE_ITEM:
+        return _find_message_items(
+            table, user_id=user_id, conversation_id=decompose_conv_id(item["SK"])
+        )
+
+    if item.get("LargeMessageLayout") == LARGE_MESSAGE_LAYOUT_SEGMENTED:
+        message_index = item["MessageIndex"]
+        message_ids = (
+            _trace_message_index(message_index, branch_message_id)
+            if branch_message_id is not None
+            else list(message_index.keys())
+        )
+        message_map = _get_large_messages(item["LargeMessagePath"], message_ids)
+        # Restore `children` from the index, including the messages not loaded
+        for message_id, entry in sorted(
+            message_index.items(), key=lambda x: (x[1]["create_time"], x[0])
+        ):
+            parent = entry["parent"]
+            if parent is not None and parent in message_map:
+                message_map[parent].children.append(message_id)
+
+        return message_map
+
     if item.get("IsLargeMessage", False):
         large_message_path = item["LargeMessagePath"]
         response = s3_client.get_object(
@@ -167,39 +956,130 @@ def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationM
         )
         message_map = json.loads(response["Body"].read().decode("utf-8"))
     else:
-        message_map = json.loads(item["MessageMap"])
+        message_map = _decode_message_map(item["MessageMap"])
 
+    return {k: MessageModel.model_validate(v) for k, v in message_map.items()}
+
+
+def _load_other_large_messages(table, user_id: str, conversation: ConversationModel):
+    """Load the messages not loaded yet into the conversation loaded as a branch."""
+    assert conversation._large_message_path is not None
+    item = _find_conversation_item(table, user_id, conversation.id)
+    message_ids = [
+        message_id
+        for message_id in item.get("MessageIndex", {}).keys()
+        if message_id not in conversation.message_map
+    ]
+    conversation.message_map.update(
+        _get_large_messages(conversation._large_message_path, message_ids)
+    )
+    _merge_feedback(conversation.message_map, item)
+    conversation._large_message_path = None
+
+
+def _conversation_from_item(
+    table, user_id: str, item: dict, branch_message_id: str | None = None
+) -> ConversationModel:
     conv = ConversationModel(
         id=decompose_conv_id(item["SK"]),
         create_time=float(item["CreateTime"]),
         title=item["Title"],
         total_price=item.get("TotalPrice", 0),
-        message_map={k: MessageModel.model_validate(v) for k, v in message_map.items()},
+        message_map=_message_map_from_conversation_item(
+            table, user_id, item, branch_message_id
+        ),
         last_message_id=item["LastMessageId"],
         bot_id=item["BotId"] if "BotId" in item else None,
         should_continue=item.get("ShouldContinue", False),
     )
-    logger.info(f"Found conversation: {conv}")
+    conv._version = int(item.get("Version", 0))
+    if item.get("LargeMessageLayout") == LARGE_MESSAGE_LAYOUT_SEGMENTED:
+        conv._large_message_path = item["LargeMessagePath"]
+
+    if not item.get("IsLargeMessage", False):
+        _cache_conversation(user_id, conv)
+
+    return conv
+
+
+def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationModel:
+    logger.info(f"Finding conversation: {conversation_id}")
+    table = _get_table_client(user_id)
+    cached = _find_cached_conversation(table, user_id, conversation_id)
+    if cached is not None:
+        return cached
+
+    item = _find_conversation_item(table, user_id, conversation_id)
+    conv = _conversation_from_item(table, user_id, item)
+    logger.info(f"Found conversation: {conv.id}")
     return conv
 
 
+def find_conversation_branch_by_id(
+    user_id: str, conversation_id: str, message_id: str | None = None
+) -> ConversationModel:
+    """Find the conversation to continue from the message.
+    Large conversations are loaded only from the message to the root.
+    If `message_id` is None, the last message is used.
+    Store the result with `append_conversation_messages`, not `store_conversation`.
+    """
+    logger.info(f"Finding conversation branch: {conversation_id} ({message_id})")
+    table = _get_table_client(user_id)
+    # Cached conversations hold all messages
+    cached = _find_cached_conversation(table, user_id, conversation_id)
+    if cached is not None:
+        return cached
+
+    item = _find_conversation_item(table, user_id, conversation_id)
+    branch_message_id = message_id if message_id is not None else item["LastMessageId"]
+    conv = _conversation_from_item(table, user_id, item, branch_message_id)
+    logger.info(
+        f"Found conversation: {conv.id} ({len(conv.message_map)} messages loaded)"
+    )
+    return conv
+
+
+def prefetch_conversation_by_id(user_id: str, conversation_id: str) -> None:
+    """Read the conversation into the cache of this container, to be found by the next chat without reading it.
+    Conversations whose messages are stored in S3 are not cached, so their messages are not read.
+    """
+    if _conversation_cache.get((user_id, conversation_id)) is not None:
+        # Validated by the chat
+        return
+
+    table = _get_table_client(user_id)
+    item = _find_conversation_item(table, user_id, conversation_id)
+    if item.get("IsLargeMessage", False):
+        logger.info(f"Skipped prefetching large conversation: {conversation_id}")
+        return
+
+    _conversation_from_item(table, user_id, item)
+
+
 def delete_conversation_by_id(user_id: str, conversation_id: str):
     logger.info(f"Deleting conversation: {conversation_id}")
     table = _get_table_client(user_id)
+    _conversation_cache.invalidate((user_id, conversation_id))
 
     try:
         # Check if the conversation has a large message map
         response = table.get_item(
             Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
-            ProjectionExpression="IsLargeMessage, LargeMessagePath",
+            ProjectionExpression="IsLargeMessage, LargeMessagePath, LargeMessageLayout, MessageIndex",
         )
 
         item = response.get("Item")
-        if item and item.get("IsLargeMessage", False):
-            # Delete the large message map from S3
-            s3_client.delete_object(
-                Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
-            )
+        if item:
+            # Delete the large messages from S3
+            _delete_large_messages(item)
+
+        # NOTE: Regardless of the current layout, so that the messages left by a conversation
+        # stored on `message_item` layout before are deleted as well
+        _delete_items_by_sk_prefix(
+            table,
+            user_id=user_id,
+            prefix=compose_conv_message_id(user_id, conversation_id, ""),
+        )
 
         # Delete the conversation from DynamoDB
         response = table.delete_item(
@@ -226,48 +1106,12 @@ def delete_conversation_by_user_id(user_id: str):
     logger.info(f"Deleting ALL conversations for user: {user_id}")
     table = _get_table_client(user_id)
 
-    query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
-        # NOTE: Need SK to fetch only conversations
-        & Key("SK").begins_with(f"{user_id}#CONV#"),
-        "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath",
-    }
-
-    def delete_batch(batch):
-        with table.batch_writer() as writer:
-            for item in batch:
-                writer.delete_item(Key={"PK": user_id, "SK": item["SK"]})
-
-    def delete_large_messages(items):
-        for item in items:
-            if item.get("IsLargeMessage", False):
-                s3_client.delete_object(
-                    Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
-                )
-
     try:
-        response = table.query(
-            **query_params,
+        # NOTE: The prefix matches both conversations and their messages stored on `message_item` layout
+        deleted = _delete_items_by_sk_prefix(
+            table, user_id=user_id, prefix=f"{user_id}#CONV"
         )
-
-        while True:
-            items = response.get("Items", [])
-            delete_large_messages(items)
-
-            for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
-                batch = items[i : i + TRANSACTION_BATCH_SIZE]
-                delete_batch(batch)
-
-            # Check if next page exists
-            if "LastEvaluatedKey" not in response:
-                break
-
-            # Load next page
-            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-            response = table.query(
-                **query_params,
-            )
-
+        logger.info(f"Deleted {deleted} conversation items for user: {user_id}")
         delete_related_documents(user_id=user_id)
 
     except ClientError as e:
@@ -285,8 +1129,9 @@ def change_conversation_title(user_id: str, conversation_id: str, new_title: str
                 "PK": user_id,
                 "SK": compose_conv_id(user_id, conversation_id),
             },
-            UpdateExpression="set Title=:t",
-            ExpressionAttributeValues={":t": new_title},
+            UpdateExpression="set Title=:t add #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
+            ExpressionAttributeValues={":t": new_title, ":one": 1},
             ReturnValues="UPDATED_NEW",
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
@@ -298,34 +1143,100 @@ def change_conversation_title(user_id: str, conversation_id: str, new_title: str
         else:
             raise e
 
+    _conversation_cache.invalidate((user_id, conversation_id))
     logger.info(f"Updated conversation title response: {response}")
 
     return response
 
 
+def _find_message_id(table, user_id: str, conversation_id: str, message_id: str):
+    """Raise `RecordNotFoundError` if the conversation does not have the message.
+    Messages stored in S3 or as message items are not read, but their keys are.
+    """
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
+        # NOTE: `MessageMap` holds only `system` message if the messages are stored in S3
+        ProjectionExpression="MessageStorage, IsLargeMessage, LargeMessagePath, LargeMessageLayout, MessageIndex.#m, MessageMap",
+        ExpressionAttributeNames={"#m": message_id},
+        ConsistentRead=True,
+    )
+    item = response.get("Item")
+    if item is None:
+        raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
+
+    if item.get("MessageStorage") == MESSAGE_STORAGE_ITEM:
+        response = table.get_item(
+            Key={
+                "PK": user_id,
+                "SK": compose_conv_message_id(user_id, conversation_id, message_id),
+            },
+            ProjectionExpression="SK",
+            ConsistentRead=True,
+        )
+        found = "Item" in response
+    elif item.get("LargeMessageLayout") == LARGE_MESSAGE_LAYOUT_SEGMENTED:
+        found = message_id in item.get("MessageIndex", {})
+    elif item.get("IsLargeMessage", False):
+        # The whole message map stored as a single object
+        found = message_id in _load_message_map(table, user_id, item)
+    else:
+        found = message_id in _decode_message_map(item["MessageMap"])
+
+    if not found:
+        raise RecordNotFoundError(
+            f"No message found with id: {message_id} in conversation: {conversation_id}"
+        )
+
+
 def update_feedback(
     user_id: str, conversation_id: str, message_id: str, feedback: FeedbackModel
 ):
+    """Set feedback of the message without reading or rewriting the messages.
+    Raise `RecordNotFoundError` if the conversation or the message is not found.
+    """
     logger.info(f"Updating feedback for conversation: {conversation_id}")
     table = _get_table_client(user_id)
-    conv = find_conversation_by_id(user_id, conversation_id)
-    message_map = conv.message_map
-    message_map[message_id].feedback = feedback
+    _find_message_id(table, user_id, conversation_id, message_id)
+    key = {
+        "PK": user_id,
+        "SK": compose_conv_id(user_id, conversation_id),
+    }
 
-    response = table.update_item(
-        Key={
-            "PK": user_id,
-            "SK": compose_conv_id(user_id, conversation_id),
-        },
-        UpdateExpression="set MessageMap = :m",
-        ExpressionAttributeValues={
-            ":m": json.dumps(
-                {k: v.model_dump(by_alias=True) for k, v in message_map.items()}
+    try:
+        response = table.update_item(
+            Key=key,
+            UpdateExpression="set Feedback.#m = :f add #version :one",
+            ExpressionAttributeNames={"#m": message_id, "#version": "Version"},
+            ExpressionAttributeValues={":f": feedback.model_dump(), ":one": 1},
+            ConditionExpression="attribute_exists(Feedback)",
+            ReturnValues="UPDATED_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise e
+
+        # Conversation stored before `Feedback` attribute was introduced, or not found
+        try:
+            response = table.update_item(
+                Key=key,
+                UpdateExpression="set Feedback = :f add #version :one",
+                ExpressionAttributeNames={"#version": "Version"},
+                ExpressionAttributeValues={
+                    ":f": {message_id: feedback.model_dump()},
+                    ":one": 1,
+                },
+                ConditionExpression="attribute_exists(PK) AND attribute_not_exists(Feedback)",
+                ReturnValues="UPDATED_NEW",
             )
-        },
-        ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
-        ReturnValues="UPDATED_NEW",
-    )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise RecordNotFoundError(
+                    f"No conversation found with id: {conversation_id}"
+                )
+            else:
+                raise e
+
+    _conversation_cache.invalidate((user_id, conversation_id))
     logger.info(f"Updated feedback response: {response}")
     return response
 
@@ -400,24 +1311,23 @@ def find_related_document_by_id(
     source_id: str,
 ) -> RelatedDocumentModel:
     table = _get_table_client(user_id)
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=(
-            Key("SK").eq(
-                compose_related_document_source_id(
-                    user_id=user_id,
-                    conversation_id=conversation_id,
-                    source_id=source_id,
-                )
-            )
-        ),
+    response = table.get_item(
+        Key={
+            "PK": user_id,
+            "SK": compose_related_document_source_id(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                source_id=source_id,
+            ),
+        },
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(
             f"No related document found with id: {conversation_id}#{source_id}"
         )
 
-    item = response["Items"][0]
+    item = response["Item"]
     return RelatedDocumentModel(
         content=TypeAdapter(ToolResultModel).validate_python(item["Content"]),
         source_id=source_id,
@@ -426,37 +1336,8 @@ def find_related_document_by_id(
     )
 
 
-def delete_related_documents(user_id: str, conversation_id: str | None = None):
-    table = _get_table_client(user_id)
-    sort_keys: list[str] = []
-
-    last_evaluated_key = None
-    while True:
-        response = table.query(
-            KeyConditionExpression=(
-                Key("PK").eq(user_id)
-                & Key("SK").begins_with(
-                    f"{user_id}#RELATED_DOCUMENT#{conversation_id}#"
-                    if conversation_id
-                    else f"{user_id}#RELATED_DOCUMENT#"
-                )
-            ),
-            ProjectionExpression="SK",
-            ScanIndexForward=False,
-            **(
-                {
-                    "ExclusiveStartKey": last_evaluated_key,
-                }
-                if last_evaluated_key is not None
-                else {}
-            ),
-        )
-        sort_keys.extend(item["SK"] for item in response.get("Items") or [])
-
-        last_evaluated_key = response.get("LastEvaluatedKey")
-        if last_evaluated_key is None:
-            break
-
+def _batch_delete_items(table, user_id: str, sort_keys: list[str]):
+    # NOTE: `batch_writer` resends unprocessed items until all of them are deleted
     with table.batch_writer() as writer:
         for sort_key in sort_keys:
             writer.delete_item(
@@ -465,3 +1346,67 @@ def delete_related_documents(user_id: str, conversation_id: str | None = None):
                     "SK": sort_key,
                 },
             )
+
+
+def _delete_items_by_sk_prefix(table, user_id: str, prefix: str) -> int:
+    """Delete the items whose sort key starts with the prefix, and their large messages in S3.
+    Each page of the query is deleted by concurrent `BatchWriteItem` and `DeleteObjects` requests
+    while the next page is read, so that only two pages are held in memory.
+    Returns the number of deleted items.
+    """
+    query_params: dict[str, Any] = {
+        "KeyConditionExpression": Key("PK").eq(user_id) & Key("SK").begins_with(prefix),
+        "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath, LargeMessageLayout, MessageIndex",
+    }
+
+    deleted = 0
+    pending: list[Future] = []
+    with ThreadPoolExecutor(max_workers=BULK_DELETE_CONCURRENCY) as executor:
+        while True:
+            response = table.query(**query_params)
+            items = response.get("Items") or []
+
+            # Wait for the previous page, and raise the error if any
+            for future in pending:
+                future.result()
+
+            sort_keys = [item["SK"] for item in items]
+            pending = [
+                executor.submit(
+                    _batch_delete_items,
+                    table,
+                    user_id,
+                    sort_keys[i : i + TRANSACTION_BATCH_SIZE],
+                )
+                for i in range(0, len(sort_keys), TRANSACTION_BATCH_SIZE)
+            ]
+            keys = [key for item in items for key in _large_message_keys(item)]
+            pending.extend(
+                executor.submit(_delete_objects, keys[i : i + S3_DELETE_BATCH_SIZE])
+                for i in range(0, len(keys), S3_DELETE_BATCH_SIZE)
+            )
+
+            deleted += len(items)
+            if "LastEvaluatedKey" not in response:
+                break
+
+            logger.info(f"Deleting items with prefix {prefix}: {deleted} so far")
+            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        for future in pending:
+            future.result()
+
+    return deleted
+
+
+def delete_related_documents(user_id: str, conversation_id: str | None = None):
+    table = _get_table_client(user_id)
+    _delete_items_by_sk_prefix(
+        table,
+        user_id=user_id,
+        prefix=(
+            f"{user_id}#RELATED_DOCUMENT#{conversation_id}#"
+            if conversation_id
+            else f"{user_id}#RELATED_DOCUMENT#"
+        ),
+    )
@@ -13,10 +13,12 @@ from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CO
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG
 from app.repositories.common import (
     RecordNotFoundError,
+    VersionedCache,
     _get_table_client,
     _get_table_public_client,
     compose_bot_alias_id,
     compose_bot_id,
+    compose_initial_version,
     decompose_bot_alias_id,
     decompose_bot_id,
 )
@@ -50,6 +52,10 @@ DEFAULT_GENERATION_CONFIG = (
 logger = logging.getLogger(__name__)
 sts_client = boto3.client("sts")
 
+# Private bots read by this container, keyed by (user_id, bot_id).
+# Writers of the bot item increment its `Version` attribute.
+_bot_cache: VersionedCache[BotModel] = VersionedCache("Bot")
+
 
 class BotNotFoundException(Exception):
     """Exception raised when a bot is not found."""
@@ -90,6 +96,8 @@ def store_bot(user_id: str, custom_bot: BotModel):
             starter.model_dump() for starter in custom_bot.conversation_quick_starters
         ],
         "ActiveModels": custom_bot.active_models.model_dump(),  # type: ignore[attr-defined]
+        # The bot may replace a deleted one with the same id, whose cached versions must not match
+        "Version": compose_initial_version(),
     }
     if custom_bot.bedrock_knowledge_base:
         item["BedrockKnowledgeBase"] = custom_bot.bedrock_knowledge_base.model_dump()
@@ -97,6 +105,7 @@ def store_bot(user_id: str, custom_bot: BotModel):
         item["GuardrailsParams"] = custom_bot.bedrock_guardrails.model_dump()
 
     response = table.put_item(Item=item)
+    _bot_cache.invalidate((user_id, custom_bot.id))
     return response
 
 
@@ -167,8 +176,9 @@ def update_bot(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
+            UpdateExpression=update_expression + " ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
+            ExpressionAttributeValues={**expression_attribute_values, ":one": 1},
             ReturnValues="ALL_NEW",
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
@@ -214,15 +224,33 @@ def update_bot_last_used_time(user_id: str, bot_id: str):
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET LastBotUsed = :val",
-            ExpressionAttributeValues={":val": decimal(get_current_time())},
+            UpdateExpression="SET LastBotUsed = :val ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
+            ExpressionAttributeValues={":val": decimal(get_current_time()), ":one": 1},
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+            ReturnValues="UPDATED_NEW",
         )
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
             raise RecordNotFoundError(f"Bot with id {bot_id} not found")
         else:
             raise e
+
+    # Updated on every chat. Keep the cached bot current unless it was updated by others.
+    key = (user_id, bot_id)
+    cached = _bot_cache.get(key)
+    version = int(response["Attributes"]["Version"])
+    if cached is not None and cached[0] == version - 1:
+        _bot_cache.put(
+            key,
+            version,
+            cached[1].model_copy(
+                update={"last_used_time": float(response["Attributes"]["LastBotUsed"])}
+            ),
+        )
+    else:
+        _bot_cache.invalidate(key)
+
     return response
 
 
@@ -252,8 +280,9 @@ def update_bot_pin_status(user_id: str, bot_id: str, pinned: bool):
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET IsPinned = :val",
-            ExpressionAttributeValues={":val": pinned},
+            UpdateExpression="SET IsPinned = :val ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
+            ExpressionAttributeValues={":val": pinned, ":one": 1},
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
     except ClientError as e:
@@ -292,10 +321,12 @@ def update_knowledge_base_id(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET BedrockKnowledgeBase.knowledge_base_id = :kb_id, BedrockKnowledgeBase.data_source_ids = :ds_ids",
+            UpdateExpression="SET BedrockKnowledgeBase.knowledge_base_id = :kb_id, BedrockKnowledgeBase.data_source_ids = :ds_ids ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
             ExpressionAttributeValues={
                 ":kb_id": knowledge_base_id,
                 ":ds_ids": data_source_ids,
+                ":one": 1,
             },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             ReturnValues="ALL_NEW",
@@ -319,10 +350,12 @@ def update_guardrails_params(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET GuardrailsParams.guardrail_arn = :guardrail_arn, GuardrailsParams.guardrail_version = :guardrail_version",
+            UpdateExpression="SET GuardrailsParams.guardrail_arn = :guardrail_arn, GuardrailsParams.guardrail_version = :guardrail_version ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
             ExpressionAttributeValues={
                 ":guardrail_arn": guardrail_arn,
                 ":guardrail_version": guardrail_version,
+                ":one": 1,
             },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             ReturnValues="ALL_NEW",
@@ -421,13 +454,33 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
     """Find private bot."""
     table = _get_table_client(user_id)
     logger.info(f"Finding bot with id: {bot_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
+
+    key = (user_id, bot_id)
+    cached = _bot_cache.get(key)
+    if cached is not None:
+        # Read only `Version` to validate the cached bot
+        response = table.get_item(
+            Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
+            ProjectionExpression="#version",
+            ExpressionAttributeNames={"#version": "Version"},
+            ConsistentRead=True,
+        )
+        if "Item" in response and int(response["Item"].get("Version", 0)) == cached[0]:
+            _bot_cache.record(hit=True)
+            return cached[1].model_copy(deep=True)
+
+        _bot_cache.invalidate(key)
+
+    if _bot_cache.enabled:
+        _bot_cache.record(hit=False)
+
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     if "OriginalBotId" in item:
         raise RecordNotFoundError(f"Bot with id {bot_id} is alias")
@@ -493,6 +546,7 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
         active_models=ActiveModelsModel.model_validate(item.get("ActiveModels", {})),
     )
 
+    _bot_cache.put(key, int(item.get("Version", 0)), bot.model_copy(deep=True))
     logger.info(f"Found bot: {bot}")
     return bot
 
@@ -578,13 +632,13 @@ def find_alias_by_id(user_id: str, alias_id: str) -> BotAliasModel:
     """Find alias bot by id."""
     table = _get_table_client(user_id)
     logger.info(f"Finding alias bot with id: {alias_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_alias_id(user_id, alias_id)),
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_alias_id(user_id, alias_id)},
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Alias bot with id {alias_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     bot = BotAliasModel(
         id=decompose_bot_alias_id(item["SK"]),
@@ -610,29 +664,26 @@ def update_bot_visibility(user_id: str, bot_id: str, visible: bool):
     table = _get_table_client(user_id)
     logger.info(f"Making bot public: {bot_id}")
 
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
-    )
-    if len(response["Items"]) == 0:
-        raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-
+    # NOTE: Existence is checked by the condition expressions
     try:
         if visible:
             # To visible (open to public)
             response = table.update_item(
                 Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-                UpdateExpression="SET PublicBotId = :val",
-                ExpressionAttributeValues={":val": bot_id},
+                UpdateExpression="SET PublicBotId = :val ADD #version :one",
+                ExpressionAttributeNames={"#version": "Version"},
+                ExpressionAttributeValues={":val": bot_id, ":one": 1},
                 ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             )
         else:
             # To hide (close to private)
             response = table.update_item(
                 Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-                UpdateExpression="REMOVE PublicBotId",
+                UpdateExpression="REMOVE PublicBotId ADD #version :one",
+                ExpressionAttributeNames={"#version": "Version"},
                 ReturnValues="ALL_NEW",
                 ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+                ExpressionAttributeValues={":one": 1},
             )
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
@@ -652,13 +703,15 @@ def update_bot_publication(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id",
+            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
             # NOTE: Stack naming rule: ApiPublishmentStack{published_api_id}.
             # See bedrock-chat-stack.ts > `ApiPublishmentStack`
             ExpressionAttributeValues={
                 ":val": f"ApiPublishmentStack{published_api_id}",
                 ":time": current_time,
                 ":build_id": build_id,
+                ":one": 1,
             },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
@@ -677,8 +730,10 @@ def delete_bot_publication(user_id: str, bot_id: str):
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId",
+            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId ADD #version :one",
+            ExpressionAttributeNames={"#version": "Version"},
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+            ExpressionAttributeValues={":one": 1},
         )
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
@@ -692,6 +747,7 @@ def delete_bot_publication(user_id: str, bot_id: str):
 def delete_bot_by_id(user_id: str, bot_id: str):
     table = _get_table_client(user_id)
     logger.info(f"Deleting bot with id: {bot_id}")
+    _bot_cache.invalidate((user_id, bot_id))
 
     try:
         response = table.delete_item(
@@ -35,7 +35,14 @@ from mypy_boto3_bedrock_runtime.type_defs import (
     ToolUseBlockOutputTypeDef,
     ToolUseBlockTypeDef,
 )
-from pydantic import BaseModel, Discriminator, Field, JsonValue, field_validator
+from pydantic import (
+    BaseModel,
+    Discriminator,
+    Field,
+    JsonValue,
+    PrivateAttr,
+    field_validator,
+)
 
 if TYPE_CHECKING:
     from app.agents.tools.agent_tool import ToolRunResult
@@ -656,6 +663,12 @@ class ConversationModel(BaseModel):
     bot_id: str | None
     should_continue: bool
 
+    # Set by the repository if the messages are stored as individual S3 objects under this path.
+    # Then `message_map` may hold only a branch of the messages, and only appended messages are stored.
+    _large_message_path: str | None = PrivateAttr(default=None)
+    # `Version` attribute of the conversation item when loaded or stored last
+    _version: int = PrivateAttr(default=0)
+
 
 class ConversationMeta(BaseModel):
     id: str
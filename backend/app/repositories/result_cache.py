@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, TypeVar
+
+from app.utils import get_client
+
+# Cache of the results of slow calls to the other services, e.g. searches, reused until they expire.
+# Set `RESULT_CACHE_ENABLED` to `false` to disable it.
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true") == "true"
+# DynamoDB table shared by the containers, with the partition key `CacheKey` and the TTL attribute `expire`.
+# Only the in-process tier is used if not set.
+RESULT_CACHE_TABLE_NAME = os.environ.get("RESULT_CACHE_TABLE_NAME", "")
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def compose_cache_key(*parts: Any) -> str:
+    """Digest of the parts serialized to JSON, to be used as the key of any length of the parts."""
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class SharedResultCacheTable:
+    """Tier of `ResultCache` on the DynamoDB table shared by the containers.
+    Values are stored as JSON strings. DynamoDB deletes expired items lazily, so `expire` is checked on read.
+    Errors are logged and treated as misses, so that the cache never fails the call.
+    NOTE: Called from the worker threads of the tools. Use the low-level client, which is thread-safe unlike resources.
+    """
+
+    def __init__(self, table_name: str = RESULT_CACHE_TABLE_NAME, client: Any = None):
+        self.table_name = table_name
+        self.client = client
+
+    def _get_client(self):
+        return self.client if self.client is not None else get_client("dynamodb")
+
+    def get(self, key: str) -> tuple[str, float] | None:
+        """Return the stored value and the seconds taken to get the result, or None if not stored or expired."""
+        try:
+            response = self._get_client().get_item(
+                TableName=self.table_name, Key={"CacheKey": {"S": key}}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to read result cache {key}: {e}")
+            return None
+
+        item = response.get("Item")
+        if item is None or int(item["expire"]["N"]) < int(time.time()):
+            return None
+
+        return item["Value"]["S"], float(item["Cost"]["N"]) if "Cost" in item else 0.0
+
+    def put(self, key: str, value: str, ttl: float, cost: float):
+        try:
+            self._get_client().put_item(
+                TableName=self.table_name,
+                Item={
+                    "CacheKey": {"S": key},
+                    "Value": {"S": value},
+                    "Cost": {"N": f"{cost:.6f}"},
+                    "expire": {"N": str(int(time.time() + ttl))},
+                },
+            )
+        except Exception as e:
+            logger.warning(f"Failed to write result cache {key}: {e}")
+
+
+def _default_shared_table() -> SharedResultCacheTable | None:
+    return SharedResultCacheTable() if RESULT_CACHE_TABLE_NAME else None
+
+
+class ResultCache(Generic[T]):
+    """Bounded LRU cache of the results, in process, backed by the optional shared table.
+    Entries expire `ttl` seconds after stored. Results found in the shared table are kept in process
+    until they expire in the table.
+    Hits are counted with the seconds saved, i.e. the seconds taken to get the results given to `put`
+    less the seconds taken to find them in the cache.
+    `dumps` and `loads` convert the results to and from the strings stored in the shared table.
+    The values are not copied. Callers must not modify the returned values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int,
+        dumps: Callable[[T], str] = json.dumps,
+        loads: Callable[[str], T] = json.loads,
+        shared: SharedResultCacheTable | None = None,
+        enabled: bool = RESULT_CACHE_ENABLED,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dumps = dumps
+        self.loads = loads
+        self.shared = shared if shared is not None else _default_shared_table()
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries: OrderedDict[str, tuple[float, float, T]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_local(self, key: str) -> tuple[T, float] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, cost, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value, cost
+
+    def _put_local(self, key: str, value: T, ttl: float, cost: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, cost, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.name}#{key}"
+
+    def get(self, key: str) -> T | None:
+        """Return the cached result, or None if not cached or expired."""
+        if not self.enabled:
+            return None
+
+        started_at = time.perf_counter()
+        entry = self._get_local(key)
+        if entry is None and self.shared is not None:
+            stored = self.shared.get(self._shared_key(key))
+            if stored is not None:
+                serialized, cost = stored
+                entry = self.loads(serialized), cost
+                # Expires in the table in `ttl` at most
+                self._put_local(key, entry[0], self.ttl, cost)
+
+        if entry is None:
+            self._record(None)
+            return None
+
+        value, cost = entry
+        self._record(max(cost - (time.perf_counter() - started_at), 0.0))
+        return value
+
+    def put(self, key: str, value: T, cost: float = 0.0):
+        """Store the result taken `cost` seconds to get."""
+        if not self.enabled:
+            return
+
+        self._put_local(key, value, self.ttl, cost)
+        if self.shared is not None:
+            self.shared.put(self._shared_key(key), self.dumps(value), self.ttl, cost)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.saved_seconds = 0.0
+
+    def _record(self, saved_seconds: float | None):
+        """Record a hit saving `saved_seconds`, or a miss if None."""
+        with self._lock:
+            if saved_seconds is not None:
+                self.hits += 1
+                self.saved_seconds += saved_seconds
+            else:
+                self.misses += 1
+
+            hits, misses = self.hits, self.misses
+            total_saved_seconds = self.saved_seconds
+
+        logger.info(
+            f"{self.name} cache {'hit' if saved_seconds is not None else 'miss'} "
+            f"(hits: {hits}, misses: {misses}, saved: {total_saved_seconds:.3f}s)"
+        )
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    self.hits / (self.hits + self.misses)
+                    if self.hits + self.misses > 0
+                    else 0.0
+                ),
+                "saved_seconds": self.saved_seconds,
+            }
@@ -3,6 +3,7 @@ from app.repositories.conversation import (
     delete_conversation_by_id,
     delete_conversation_by_user_id,
     find_conversation_by_user_id,
+    find_conversation_page_by_user_id,
     find_related_documents_by_conversation_id,
     find_related_document_by_id,
     update_feedback,
@@ -13,6 +14,7 @@ from app.routes.schemas.conversation import (
     ChatOutput,
     Conversation,
     ConversationMetaOutput,
+    ConversationMetaOutputsWithNextToken,
     FeedbackInput,
     FeedbackOutput,
     NewTitleInput,
@@ -26,7 +28,7 @@ from app.usecases.chat import (
     propose_conversation_title,
 )
 from app.user import User
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Query, Request
 
 router = APIRouter(tags=["conversation"])
 
@@ -120,6 +122,35 @@ def get_all_conversations(
     return output
 
 
+@router.get(
+    "/conversations/paginated", response_model=ConversationMetaOutputsWithNextToken
+)
+def get_conversations_paginated(
+    request: Request,
+    next_token: str | None = None,
+    limit: int = Query(100, ge=1, le=100),
+):
+    """Get conversation metadata page by page"""
+    current_user: User = request.state.current_user
+
+    conversations, next_token = find_conversation_page_by_user_id(
+        current_user.id, limit=limit, next_token=next_token
+    )
+    output = [
+        ConversationMetaOutput(
+            id=conversation.id,
+            title=conversation.title,
+            create_time=conversation.create_time,
+            model=conversation.model,
+            bot_id=conversation.bot_id,
+        )
+        for conversation in conversations
+    ]
+    return ConversationMetaOutputsWithNextToken(
+        conversations=output, next_token=next_token
+    )
+
+
 @router.delete("/conversations")
 def remove_all_conversations(
     request: Request,
@@ -48,14 +48,77 @@ class OnThinking(TypedDict):
     input: dict[str, JsonValue]
 
 
+class ToolInputParser:
+    """Accumulate the JSON deltas of a tool input, and parse the input completed so far.
+    The deltas are scanned once as they arrive, to find where each top-level member ends.
+    """
+
+    def __init__(self, input: str = ""):
+        self._deltas: list[str] = []
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Length of the input until the last complete top-level member, excluding the comma
+        self._members_end = 0
+        self._members = 0
+        self._parsed_members = 0
+        if input:
+            self.feed(input)
+
+    def feed(self, delta: str):
+        for offset, char in enumerate(delta):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._members_end = self._length + offset
+                self._members += 1
+
+        self._deltas.append(delta)
+        self._length += len(delta)
+
+    def text(self) -> str:
+        return "".join(self._deltas)
+
+    def parse(self) -> dict[str, JsonValue]:
+        return json.loads(self.text() or "{}")
+
+    def parse_partial(self) -> dict[str, JsonValue] | None:
+        """Return the top-level members completed since the last call, along with the preceding ones.
+        Returns None if no member is completed since then.
+        """
+        if self._members == self._parsed_members:
+            return None
+
+        self._parsed_members = self._members
+        try:
+            return json.loads(self.text()[: self._members_end] + "}")
+        except json.JSONDecodeError:
+            # Not an object
+            return None
+
+
 class _PartialTextContent(TypedDict):
-    text: str
+    # Deltas are joined at the end, as concatenating each of them takes quadratic time
+    text: list[str]
 
 
 class _PartialToolUseContentBody(TypedDict):
     tool_use_id: str
     name: str
-    input: str
+    input: ToolInputParser
 
 
 class _PartialToolUseContent(TypedDict):
@@ -85,7 +148,7 @@ def _content_model_from_partial_content(
     if _is_text_content(content=content):
         return TextContentModel(
             content_type="text",
-            body=content["text"].rstrip(),
+            body="".join(content["text"]).rstrip(),
         )
 
     elif _is_tool_use_content(content=content):
@@ -94,7 +157,7 @@ def _content_model_from_partial_content(
             body=ToolUseContentModelBody(
                 tool_use_id=content["tool_use"]["tool_use_id"],
                 name=content["tool_use"]["name"],
-                input=json.loads(content["tool_use"]["input"] or "{}"),
+                input=content["tool_use"]["input"].parse(),
             ),
         )
 
@@ -107,7 +170,7 @@ def _content_model_to_partial_content(
 ) -> _PartialTextContent | _PartialToolUseContent:
     if isinstance(content, TextContentModel):
         return {
-            "text": content.body,
+            "text": [content.body],
         }
 
     elif isinstance(content, ToolUseContentModel):
@@ -115,7 +178,7 @@ def _content_model_to_partial_content(
             "tool_use": {
                 "tool_use_id": content.body.tool_use_id,
                 "name": content.body.name,
-                "input": json.dumps(content.body.input),
+                "input": ToolInputParser(json.dumps(content.body.input)),
             },
         }
 
@@ -190,8 +253,11 @@ class ConverseApiStreamHandler:
             stop_reason: StopReasonType = "end_turn"
             input_token_count = 0
             output_token_count = 0
+            # Avoid formatting each event when not logged
+            debug = logger.isEnabledFor(logging.DEBUG)
             for event in response["stream"]:
-                logger.debug(f"event: {event}")
+                if debug:
+                    logger.debug(f"event: {event}")
                 if "messageStart" in event:
                     message_start = event["messageStart"]
                     current_message["role"] = message_start["role"]
@@ -209,7 +275,7 @@ class ConverseApiStreamHandler:
                             "tool_use": {
                                 "tool_use_id": tool_use_id,
                                 "name": tool_name,
-                                "input": "",
+                                "input": ToolInputParser(),
                             }
                         }
                         current_message["contents"][index] = tool_use_content
@@ -223,18 +289,32 @@ class ConverseApiStreamHandler:
                         if index in current_message["contents"]:
                             content = current_message["contents"][index]
                             if _is_tool_use_content(content=content):
-                                content["tool_use"]["input"] += input
+                                tool_input = content["tool_use"]["input"]
+                                tool_input.feed(input)
+                                if self.on_thinking:
+                                    # Notify the arguments completed so far, before the whole input is generated
+                                    partial_input = tool_input.parse_partial()
+                                    if partial_input is not None:
+                                        self.on_thinking(
+                                            {
+                                                "tool_use_id": content["tool_use"][
+                                                    "tool_use_id"
+                                                ],
+                                                "name": content["tool_use"]["name"],
+                                                "input": partial_input,
+                                            }
+                                        )
 
                     elif "text" in delta:
                         text = delta["text"]
                         if index in current_message["contents"]:
                             content = current_message["contents"][index]
                             if _is_text_content(content=content):
-                                content["text"] += text
+                                content["text"].append(text)
 
                         else:
                             text_content: _PartialTextContent = {
-                                "text": text,
+                                "text": [text],
                             }
                             current_message["contents"][index] = text_content
 
@@ -249,7 +329,7 @@ class ConverseApiStreamHandler:
                         tool_use = content["tool_use"]
                         tool_use_id = tool_use["tool_use_id"]
                         tool_name = tool_use["name"]
-                        input = json.loads(tool_use["input"] or "{}")
+                        input = tool_use["input"].parse()
 
                         if self.on_thinking:
                             self.on_thinking(
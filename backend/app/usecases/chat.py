@@ -1,7 +1,14 @@
 import logging
-from typing import Callable
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from threading import Event
+from typing import Callable, Iterator
 
 from app.agents.tools.agent_tool import (
+    AgentTool,
     ToolRunResult,
 )
 from app.agents.tools.knowledge import create_knowledge_tool
@@ -10,8 +17,10 @@ from app.bedrock import call_converse_api, compose_args_for_converse_api
 from app.prompt import build_rag_prompt, get_prompt_to_cite_tool_results
 from app.repositories.conversation import (
     RecordNotFoundError,
+    append_conversation_messages,
+    find_conversation_branch_by_id,
     find_conversation_by_id,
-    store_conversation,
+    prefetch_conversation_by_id,
     store_related_documents,
 )
 from app.repositories.custom_bot import find_alias_by_id, store_alias
@@ -36,11 +45,12 @@ from app.routes.schemas.conversation import (
     Conversation,
     FeedbackOutput,
     MessageOutput,
+    TextContent,
     type_model_name,
 )
 from app.stream import ConverseApiStreamHandler, OnStopInput, OnThinking
 from app.usecases.bot import fetch_bot, modify_bot_last_used_time
-from app.utils import get_current_time
+from app.utils import get_bedrock_runtime_client, get_current_time
 from app.vector_search import (
     SearchResult,
     search_related_docs,
@@ -52,17 +62,159 @@ from ulid import ULID
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Tools used by the model in a turn run concurrently on this many threads
+AGENT_TOOL_MAX_WORKERS = int(os.environ.get("AGENT_TOOL_MAX_WORKERS", "4"))
+# A tool running longer than this is reported to the model as failed
+AGENT_TOOL_TIMEOUT_SECONDS = float(os.environ.get("AGENT_TOOL_TIMEOUT_SECONDS", "60"))
+# Deadline of all tools in a turn, including the time waiting for a thread
+AGENT_TOOLS_DEADLINE_SECONDS = float(
+    os.environ.get("AGENT_TOOLS_DEADLINE_SECONDS", "120")
+)
+
+
+class ChatTimings:
+    """Start and end of the phases of `chat` in seconds, relative to the start of `chat`.
+    Phases run in other threads are recorded as well, to see how they overlap.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: dict[str, tuple[float, float]] = {}
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        start = time.perf_counter() - self.started_at
+        try:
+            yield
+        finally:
+            self.phases[name] = (start, time.perf_counter() - self.started_at)
+
+    def duration(self, name: str) -> float:
+        start, end = self.phases[name]
+        return end - start
+
+    def __str__(self) -> str:
+        return ", ".join(
+            f"{name} {start * 1000:.0f}-{end * 1000:.0f}ms"
+            for name, (start, end) in sorted(
+                self.phases.items(), key=lambda phase: phase[1]
+            )
+        )
+
+
+class KnowledgeRetrieval:
+    """Retrieve the documents related to the new message speculatively, while the conversation is loaded.
+    Started before the bot is fetched, and retrieves nothing if the bot turns out to use agent mode or
+    to have no knowledge, or if cancelled before the bot is fetched.
+    """
+
+    def __init__(
+        self,
+        executor: ThreadPoolExecutor,
+        bot_future: Future[tuple[bool, BotModel]],
+        query: str,
+        timings: ChatTimings,
+    ):
+        self.query = query
+        self.cancelled = Event()
+        self.future = executor.submit(self._run, bot_future, timings)
+
+    def _run(
+        self, bot_future: Future[tuple[bool, BotModel]], timings: ChatTimings
+    ) -> list[SearchResult] | None:
+        _, bot = bot_future.result()
+        if self.cancelled.is_set() or bot.is_agent_enabled() or not bot.has_knowledge():
+            return None
+
+        with timings.measure("retrieval"):
+            return search_related_docs(bot=bot, query=self.query)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.future.cancel()
+
+    def result(self) -> list[SearchResult] | None:
+        return self.future.result()
+
+
+def _fetch_bot(
+    user_id: str,
+    bot_id: str,
+    bot_future: Future[tuple[bool, BotModel]] | None,
+) -> tuple[bool, BotModel]:
+    if bot_future is not None:
+        return bot_future.result()
+
+    return fetch_bot(user_id, bot_id)
+
+
+def _store_alias_if_not_exists(
+    user_id: str, bot_id: str, bot: BotModel, current_time: float
+):
+    try:
+        # Check alias is already created
+        find_alias_by_id(user_id, bot_id)
+    except RecordNotFoundError:
+        logger.info("Bot is not owned by the user. Creating alias to shared bot.")
+        # Create alias item
+        store_alias(
+            user_id,
+            BotAliasModel(
+                id=bot.id,
+                title=bot.title,
+                description=bot.description,
+                original_bot_id=bot_id,
+                create_time=current_time,
+                last_used_time=current_time,
+                is_pinned=False,
+                sync_status=bot.sync_status,
+                has_knowledge=bot.has_knowledge(),
+                has_agent=bot.is_agent_enabled(),
+                conversation_quick_starters=(
+                    []
+                    if bot.conversation_quick_starters is None
+                    else [
+                        ConversationQuickStarterModel(
+                            title=starter.title,
+                            example=starter.example,
+                        )
+                        for starter in bot.conversation_quick_starters
+                    ]
+                ),
+                active_models=bot.active_models,
+            ),
+        )
+
 
 def prepare_conversation(
     user_id: str,
     chat_input: ChatInput,
+    bot_future: Future[tuple[bool, BotModel]] | None = None,
+    deferred: list[Callable[[], None]] | None = None,
+    timings: ChatTimings | None = None,
 ) -> tuple[str, ConversationModel, BotModel | None]:
+    """Load the conversation and append the new message.
+    If `bot_future` is given, the bot is taken from it instead of fetched.
+    If `deferred` is given, the writes not needed to call the model, i.e. the alias to the shared bot,
+    are appended to it instead of run.
+    """
     current_time = get_current_time()
     bot = None
+    if timings is None:
+        timings = ChatTimings()
 
     try:
-        # Fetch existing conversation
-        conversation = find_conversation_by_id(user_id, chat_input.conversation_id)
+        # Fetch existing conversation. Only the branch to continue is needed.
+        if chat_input.continue_generate:
+            branch_message_id = None
+        elif chat_input.message.parent_message_id == "system" and chat_input.bot_id:
+            branch_message_id = "instruction"
+        else:
+            branch_message_id = chat_input.message.parent_message_id
+        with timings.measure("find_conversation"):
+            conversation = find_conversation_branch_by_id(
+                user_id, chat_input.conversation_id, branch_message_id
+            )
         logger.info(f"Found conversation: {conversation}")
         parent_id = chat_input.message.parent_message_id
         if chat_input.message.parent_message_id == "system" and chat_input.bot_id:
@@ -72,7 +224,7 @@ def prepare_conversation(
             parent_id = conversation.last_message_id
         if chat_input.bot_id:
             logger.info("Bot id is provided. Fetching bot.")
-            owned, bot = fetch_bot(user_id, chat_input.bot_id)
+            owned, bot = _fetch_bot(user_id, chat_input.bot_id, bot_future)
     except RecordNotFoundError:
         # The case for new conversation. Note that editing first user message is not considered as new conversation.
         logger.info(
@@ -103,7 +255,7 @@ def prepare_conversation(
             logger.info("Bot id is provided. Fetching bot.")
             parent_id = "instruction"
             # Fetch bot and append instruction
-            owned, bot = fetch_bot(user_id, chat_input.bot_id)
+            owned, bot = _fetch_bot(user_id, chat_input.bot_id, bot_future)
             initial_message_map["instruction"] = MessageModel(
                 role="instruction",
                 content=[
@@ -123,41 +275,17 @@ def prepare_conversation(
             initial_message_map["system"].children.append("instruction")
 
             if not owned:
-                try:
-                    # Check alias is already created
-                    find_alias_by_id(user_id, chat_input.bot_id)
-                except RecordNotFoundError:
-                    logger.info(
-                        "Bot is not owned by the user. Creating alias to shared bot."
-                    )
-                    # Create alias item
-                    store_alias(
-                        user_id,
-                        BotAliasModel(
-                            id=bot.id,
-                            title=bot.title,
-                            description=bot.description,
-                            original_bot_id=chat_input.bot_id,
-                            create_time=current_time,
-                            last_used_time=current_time,
-                            is_pinned=False,
-                            sync_status=bot.sync_status,
-                            has_knowledge=bot.has_knowledge(),
-                            has_agent=bot.is_agent_enabled(),
-                            conversation_quick_starters=(
-                                []
-                                if bot.conversation_quick_starters is None
-                                else [
-                                    ConversationQuickStarterModel(
-                                        title=starter.title,
-                                        example=starter.example,
-                                    )
-                                    for starter in bot.conversation_quick_starters
-                                ]
-                            ),
-                            active_models=bot.active_models,
-                        ),
-                    )
+                create_alias = partial(
+                    _store_alias_if_not_exists,
+                    user_id,
+                    chat_input.bot_id,
+                    bot,
+                    current_time,
+                )
+                if deferred is not None:
+                    deferred.append(create_alias)
+                else:
+                    create_alias()
 
         # Create new conversation
         conversation = ConversationModel(
@@ -195,34 +323,223 @@ def prepare_conversation(
     return (message_id, conversation, bot)
 
 
+def prefetch_conversation(
+    user_id: str, conversation_id: str | None, bot_id: str | None
+) -> None:
+    """Read what `prepare_conversation` reads, to warm up the caches of this container before the chat input arrives.
+    The conversation and the private bot are cached, and so are the table clients with the credentials scoped to the user.
+    """
+    get_bedrock_runtime_client()
+
+    if conversation_id:
+        try:
+            prefetch_conversation_by_id(user_id, conversation_id)
+        except RecordNotFoundError:
+            # New conversation
+            pass
+
+    if bot_id:
+        fetch_bot(user_id, bot_id)
+
+
+def _has_tool_content(message: SimpleMessageModel) -> bool:
+    return any(
+        isinstance(content, ToolUseContentModel)
+        or isinstance(content, ToolResultContentModel)
+        for content in message.content
+    )
+
+
+class ConversationTree:
+    """Index of a message map to trace messages from a leaf to the root.
+    Each message is converted to `SimpleMessageModel` once, and the path of every traced leaf is memoized,
+    so that tracing a sibling or a descendant only walks up to the nearest memoized ancestor.
+    The message map is shared, not copied. Messages must not be added to it while tracing.
+    """
+
+    def __init__(self, message_map: dict[str, MessageModel]):
+        self.message_map = message_map
+        # Messages sent to the model for each message: tool use / result in its thinking log and itself
+        self._segments: dict[str, list[SimpleMessageModel]] = {}
+        # Path from the root, including the message itself
+        self._paths: dict[str, list[SimpleMessageModel]] = {}
+
+    def _segment(self, node_id: str) -> list[SimpleMessageModel]:
+        segment = self._segments.get(node_id)
+        if segment is None:
+            node = self.message_map[node_id]
+            segment = [log for log in node.thinking_log or [] if _has_tool_content(log)]
+            segment.append(SimpleMessageModel.from_message_model(message=node))
+            self._segments[node_id] = segment
+
+        return segment
+
+    def _path(self, node_id: str) -> list[SimpleMessageModel]:
+        path = self._paths.get(node_id)
+        if path is not None:
+            return path
+
+        # Walk up to the nearest memoized ancestor, or to the root
+        pending: list[str] = []
+        base: list[SimpleMessageModel] = []
+        current_id: str | None = node_id
+        while current_id is not None and current_id in self.message_map:
+            memoized = self._paths.get(current_id)
+            if memoized is not None:
+                base = memoized
+                break
+
+            pending.append(current_id)
+            current_id = self.message_map[current_id].parent
+
+        path = list(base)
+        for pending_id in reversed(pending):
+            path.extend(self._segment(pending_id))
+
+        if pending:
+            self._paths[node_id] = path
+
+        return path
+
+    def trace_to_root(self, node_id: str | None) -> list[SimpleMessageModel]:
+        """Trace message map from leaf node to root node.
+        The returned list is a copy, so the caller may append messages to it.
+        """
+        if not node_id or node_id == "system":
+            node_id = "instruction" if "instruction" in self.message_map else "system"
+
+        return list(self._path(node_id))
+
+
 def trace_to_root(
     node_id: str | None, message_map: dict[str, MessageModel]
 ) -> list[SimpleMessageModel]:
     """Trace message map from leaf node to root node."""
-    result: list[SimpleMessageModel] = []
-    if not node_id or node_id == "system":
-        node_id = "instruction" if "instruction" in message_map else "system"
-
-    current_node = message_map.get(node_id)
-    while current_node:
-        result.append(SimpleMessageModel.from_message_model(message=current_node))
-        if current_node.thinking_log:
-            result.extend(
-                log
-                for log in reversed(current_node.thinking_log)
-                if any(
-                    isinstance(content, ToolUseContentModel)
-                    or isinstance(content, ToolResultContentModel)
-                    for content in log.content
-                )
+    return ConversationTree(message_map).trace_to_root(node_id)
+
+
+def run_tools(
+    tool_use_contents: list[ToolUseContentModel],
+    tools: dict[str, AgentTool],
+    model: type_model_name,
+    bot: BotModel | None,
+    on_tool_result: Callable[[ToolRunResult], None] | None = None,
+    max_workers: int = AGENT_TOOL_MAX_WORKERS,
+    timeout: float = AGENT_TOOL_TIMEOUT_SECONDS,
+    deadline: float = AGENT_TOOLS_DEADLINE_SECONDS,
+) -> list[ToolRunResult]:
+    """Run the tools used by the model concurrently.
+    `on_tool_result` is called as each tool finishes, and the results are returned in the order of `tool_use_contents`.
+    Tools running longer than `timeout` seconds, or not finished within `deadline` seconds from the start, result in errors.
+    Their threads are left to finish in background, as threads cannot be stopped.
+    """
+    # `time.monotonic()` when each tool starts running
+    started_at: dict[str, float] = {}
+
+    def run(content: ToolUseContentModel) -> ToolRunResult:
+        started_at[content.body.tool_use_id] = time.monotonic()
+        return tools[content.body.name].run(
+            tool_use_id=content.body.tool_use_id,
+            input=content.body.input,
+            model=model,
+            bot=bot,
+        )
+
+    results: dict[str, ToolRunResult] = {}
+
+    def finish(content: ToolUseContentModel, run_result: ToolRunResult):
+        results[content.body.tool_use_id] = run_result
+        if on_tool_result:
+            on_tool_result(run_result)
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(max_workers, len(tool_use_contents)) or 1
+    )
+    try:
+        futures: dict[Future[ToolRunResult], ToolUseContentModel] = {
+            executor.submit(run, content): content for content in tool_use_contents
+        }
+        deadline_at = time.monotonic() + deadline
+        pending = set(futures.keys())
+        while pending:
+            timeout_at = min(
+                [deadline_at]
+                + [
+                    started_at[futures[future].body.tool_use_id] + timeout
+                    for future in pending
+                    if futures[future].body.tool_use_id in started_at
+                ]
+            )
+            done, pending = wait(
+                pending,
+                timeout=max(timeout_at - time.monotonic(), 0),
+                return_when=FIRST_COMPLETED,
             )
+            for future in done:
+                finish(futures[future], future.result())
+
+            now = time.monotonic()
+            for future in list(pending):
+                content = futures[future]
+                tool_use_id = content.body.tool_use_id
+                if now >= deadline_at or (
+                    tool_use_id in started_at
+                    and now >= started_at[tool_use_id] + timeout
+                ):
+                    logger.warning(
+                        f"Tool {content.body.name} ({tool_use_id}) timed out"
+                    )
+                    future.cancel()
+                    pending.remove(future)
+                    finish(
+                        content,
+                        tools[content.body.name].error_result(
+                            tool_use_id=tool_use_id,
+                            error="The tool timed out.",
+                        ),
+                    )
 
-        parent_id = current_node.parent
-        if parent_id is None:
-            break
-        current_node = message_map.get(parent_id)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
-    return result[::-1]
+    return [results[content.body.tool_use_id] for content in tool_use_contents]
+
+
+def store_chat(
+    user_id: str,
+    conversation: ConversationModel,
+    message_ids: list[str],
+    deleted_message_ids: list[str],
+    related_documents: list[RelatedDocumentModel],
+):
+    """Store the messages appended in a turn and the documents related to them, concurrently.
+    Both are written before returning, so that front-end can read them after the end of the stream.
+    If the process dies in between, the related documents stored are not referred by any message,
+    and the conversation stored refers to the documents not found, which are shown without the sources.
+    """
+    if not related_documents:
+        append_conversation_messages(
+            user_id,
+            conversation,
+            message_ids=message_ids,
+            deleted_message_ids=deleted_message_ids,
+        )
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        related_documents_future = executor.submit(
+            store_related_documents,
+            user_id=user_id,
+            conversation_id=conversation.id,
+            related_documents=related_documents,
+        )
+        append_conversation_messages(
+            user_id,
+            conversation,
+            message_ids=message_ids,
+            deleted_message_ids=deleted_message_ids,
+        )
+        related_documents_future.result()
 
 
 def chat(
@@ -232,8 +549,57 @@ def chat(
     on_stop: Callable[[OnStopInput], None] | None = None,
     on_thinking: Callable[[OnThinking], None] | None = None,
     on_tool_result: Callable[[ToolRunResult], None] | None = None,
+    timings: ChatTimings | None = None,
 ) -> tuple[ConversationModel, MessageModel]:
-    user_msg_id, conversation, bot = prepare_conversation(user_id, chat_input)
+    if timings is None:
+        timings = ChatTimings()
+
+    retrieval: KnowledgeRetrieval | None = None
+    bot_future: Future[tuple[bool, BotModel]] | None = None
+    if chat_input.bot_id:
+        # Fetch the bot and retrieve from its knowledge base while loading the conversation
+        executor = ThreadPoolExecutor(max_workers=2)
+        bot_id = chat_input.bot_id
+
+        def fetch() -> tuple[bool, BotModel]:
+            with timings.measure("fetch_bot"):
+                return fetch_bot(user_id, bot_id)
+
+        bot_future = executor.submit(fetch)
+        # The query is the new message, the same as the one used after loading the conversation
+        query = chat_input.message.content[-1]
+        if not chat_input.continue_generate and isinstance(query, TextContent):
+            retrieval = KnowledgeRetrieval(executor, bot_future, query.body, timings)
+        # Submitted tasks still run
+        executor.shutdown(wait=False)
+
+    deferred: list[Callable[[], None]] = []
+    try:
+        with timings.measure("prepare_conversation"):
+            user_msg_id, conversation, bot = prepare_conversation(
+                user_id,
+                chat_input,
+                bot_future=bot_future,
+                deferred=deferred,
+                timings=timings,
+            )
+    except Exception:
+        if retrieval is not None:
+            retrieval.cancel()
+        raise
+
+    # The bookkeeping not needed to respond runs in order on this thread, while calling the model
+    # and notifying the end of the stream
+    bookkeeping = ThreadPoolExecutor(max_workers=1)
+    bookkeeping_futures: list[Future[None]] = []
+    if deferred:
+
+        def run_deferred():
+            with timings.measure("deferred"):
+                for task in deferred:
+                    task()
+
+        bookkeeping_futures.append(bookkeeping.submit(run_deferred))
 
     tools = (
         {t.name: get_tool_by_name(t.name) for t in bot.agent.tools}
@@ -287,7 +653,17 @@ def chat(
                         }
                     )
 
-                search_results = search_related_docs(bot=bot, query=content.body)
+                with timings.measure("wait_retrieval"):
+                    speculative_results = (
+                        retrieval.result() if retrieval is not None else None
+                    )
+                if speculative_results is not None:
+                    search_results = speculative_results
+                else:
+                    with timings.measure("retrieval"):
+                        search_results = search_related_docs(
+                            bot=bot, query=content.body
+                        )
                 logger.info(f"Search results from vector store: {search_results}")
 
                 if on_tool_result:
@@ -324,10 +700,7 @@ def chat(
     if node_id is None:
         raise ValueError("parent_message_id or parent is None")
 
-    messages = trace_to_root(
-        node_id=node_id,
-        message_map=message_map,
-    )
+    messages = ConversationTree(message_map).trace_to_root(node_id=node_id)
 
     continue_generate = chat_input.continue_generate
 
@@ -360,6 +733,12 @@ def chat(
         on_thinking=on_thinking,
     )
 
+    # Messages written or removed by this turn, to avoid rewriting the whole conversation
+    appended_message_ids: list[str] = (
+        [] if chat_input.continue_generate else [user_msg_id]
+    )
+    deleted_message_ids: list[str] = []
+
     thinking_log: list[SimpleMessageModel] = []
     while True:
         result = stream_handler.run(
@@ -385,6 +764,7 @@ def chat(
                 if len(thinking_log) == 0:
                     assistant_msg_id = conversation.last_message_id
                     conversation.message_map[assistant_msg_id] = message
+                    appended_message_ids.append(assistant_msg_id)
                     break
 
                 else:
@@ -393,10 +773,12 @@ def chat(
                         old_assistant_msg_id
                     )
                     del conversation.message_map[old_assistant_msg_id]
+                    deleted_message_ids.append(old_assistant_msg_id)
 
             # Issue id for new assistant message
             assistant_msg_id = str(ULID())
             conversation.message_map[assistant_msg_id] = message
+            appended_message_ids.append(assistant_msg_id)
 
             # Append children to parent
             conversation.message_map[user_msg_id].children.append(assistant_msg_id)
@@ -430,23 +812,17 @@ def chat(
             if isinstance(content, ToolUseContentModel)
         ]
 
-        run_results: list[ToolRunResult] = []
-        for content in tool_use_contents:
-            tool = tools[content.body.name]
-            run_result = tool.run(
-                tool_use_id=content.body.tool_use_id,
-                input=content.body.input,
-                model=chat_input.message.model,
-                bot=bot,
-            )
-            run_results.append(run_result)
-
+        run_results = run_tools(
+            tool_use_contents=tool_use_contents,
+            tools=tools,
+            model=chat_input.message.model,
+            bot=bot,
+            on_tool_result=on_tool_result,
+        )
+        for run_result in run_results:
             if run_result["status"] == "success":
                 related_documents.extend(run_result["related_documents"])
 
-            if on_tool_result:
-                on_tool_result(run_result)
-
         tool_result_message = SimpleMessageModel(
             role="user",
             content=[
@@ -462,22 +838,37 @@ def chat(
         thinking_log.append(tool_result_message)
 
     # Store conversation before finish streaming so that front-end can avoid 404 issue
-    store_conversation(user_id, conversation)
-    store_related_documents(
-        user_id=user_id,
-        conversation_id=conversation.id,
-        related_documents=related_documents,
-    )
+    with timings.measure("store"):
+        store_chat(
+            user_id,
+            conversation,
+            message_ids=appended_message_ids,
+            deleted_message_ids=deleted_message_ids,
+            related_documents=related_documents,
+        )
+
+    # Update bot last used time, after the alias is created by the deferred task
+    if chat_input.bot_id:
+        logger.info("Bot id is provided. Updating bot last used time.")
+        bot_id = chat_input.bot_id
+
+        def update_last_used_time():
+            with timings.measure("last_used_time"):
+                modify_bot_last_used_time(user_id, bot_id)
+
+        bookkeeping_futures.append(bookkeeping.submit(update_last_used_time))
+
+    bookkeeping.shutdown(wait=False)
 
     if on_stop:
         on_stop(result)
 
-    # Update bot last used time
-    if chat_input.bot_id:
-        logger.info("Bot id is provided. Updating bot last used time.")
-        # Update bot last used time
-        modify_bot_last_used_time(user_id, chat_input.bot_id)
+    # Wait for the bookkeeping before returning, as Lambda freezes the threads left running after
+    # the invocation. If the process dies before, the last used time is updated again on the next chat.
+    for future in bookkeeping_futures:
+        future.result()
 
+    logger.info(f"Chat timings: {timings}")
     return conversation, message
 
 
@@ -534,9 +925,8 @@ def propose_conversation_title(
     # Fetch existing conversation
     conversation = find_conversation_by_id(user_id, conversation_id)
 
-    messages = trace_to_root(
+    messages = ConversationTree(conversation.message_map).trace_to_root(
         node_id=conversation.last_message_id,
-        message_map=conversation.message_map,
     )
 
     # Append message to generate title
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import threading
 from datetime import datetime
 from typing import Any, Literal
 
@@ -16,6 +17,13 @@ BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
 PUBLISH_API_CODEBUILD_PROJECT_NAME = os.environ.get(
     "PUBLISH_API_CODEBUILD_PROJECT_NAME", ""
 )
+# Connections per client, shared by the worker threads of the container.
+# The default of botocore (10) is less than the concurrency of the repositories.
+BOTO3_MAX_POOL_CONNECTIONS = int(os.environ.get("BOTO3_MAX_POOL_CONNECTIONS", "50"))
+BOTO3_MAX_ATTEMPTS = int(os.environ.get("BOTO3_MAX_ATTEMPTS", "4"))
+
+_clients: dict[tuple[str, str | None, str | None, str], Any] = {}
+_clients_lock = threading.Lock()
 
 
 def snake_to_camel(snake_str):
@@ -27,18 +35,55 @@ def is_running_on_lambda():
     return "AWS_EXECUTION_ENV" in os.environ
 
 
+def get_client(
+    service_name: str,
+    region_name: str | None = None,
+    endpoint_url: str | None = None,
+    **config: Any,
+) -> Any:
+    """Get a boto3 client, which is created once per container and reused.
+    Creating a client loads the service model and sets up a connection pool, which takes tens of milliseconds,
+    and the connections to the endpoint are kept alive only while the client is reused.
+    Clients are thread-safe, so the same client is shared by the threads.
+    `config` is passed to `botocore.client.Config` in addition to the default pool and retry settings.
+    """
+    key = (service_name, region_name, endpoint_url, json.dumps(config, sort_keys=True))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    # Create in the lock, as the default session of boto3 is not thread-safe
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = boto3.client(
+                service_name,  # type: ignore[call-overload]
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=BOTO3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={"max_attempts": BOTO3_MAX_ATTEMPTS, "mode": "standard"},
+                    **config,
+                ),
+            )
+            _clients[key] = client
+
+    return client
+
+
 def get_bedrock_client(region=BEDROCK_REGION):
-    client = boto3.client("bedrock", region_name=region)
+    client = get_client("bedrock", region_name=region)
     return client
 
 
 def get_bedrock_runtime_client(region=BEDROCK_REGION):
-    client = boto3.client("bedrock-runtime", region_name=region)
+    client = get_client("bedrock-runtime", region_name=region)
     return client
 
 
 def get_bedrock_agent_client(region=BEDROCK_REGION):
-    client = boto3.client("bedrock-agent-runtime", region_name=region)
+    client = get_client("bedrock-agent-runtime", region_name=region)
     return client
 
 
@@ -53,12 +98,15 @@ def generate_presigned_url(
     content_type: str | None = None,
     expiration=3600,
     client_method: Literal["put_object", "get_object"] = "put_object",
+    region: str = BEDROCK_REGION,
 ) -> str:
     # See: https://github.com/boto/boto3/issues/421#issuecomment-1849066655
-    client = boto3.client(
+    # NOTE: `region` must be the region of the bucket, as it is a part of the signature.
+    client = get_client(
         "s3",
-        region_name=BEDROCK_REGION,
-        config=Config(signature_version="v4", s3={"addressing_style": "path"}),
+        region_name=region,
+        signature_version="v4",
+        s3={"addressing_style": "path"},
     )
     params = {"Bucket": bucket, "Key": key}
     if content_type:
@@ -93,7 +141,7 @@ def compose_upload_document_s3_path(user_id: str, bot_id: str, filename: str) ->
 
 
 def delete_file_from_s3(bucket: str, key: str):
-    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    client = get_client("s3", region_name=BEDROCK_REGION)
 
     # Check if the file exists
     try:
@@ -110,7 +158,7 @@ def delete_file_from_s3(bucket: str, key: str):
 
 def delete_files_with_prefix_from_s3(bucket: str, prefix: str):
     """Delete all objects with the given prefix from the given bucket."""
-    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    client = get_client("s3", region_name=BEDROCK_REGION)
     response = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
 
     if "Contents" not in response:
@@ -121,7 +169,7 @@ def delete_files_with_prefix_from_s3(bucket: str, prefix: str):
 
 
 def check_if_file_exists_in_s3(bucket: str, key: str):
-    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    client = get_client("s3", region_name=BEDROCK_REGION)
 
     # Check if the file exists
     try:
@@ -136,7 +184,7 @@ def check_if_file_exists_in_s3(bucket: str, key: str):
 
 
 def move_file_in_s3(bucket: str, key: str, new_key: str):
-    client = boto3.client("s3", region_name=BEDROCK_REGION)
+    client = get_client("s3", region_name=BEDROCK_REGION)
 
     # Check if the file exists
     try:
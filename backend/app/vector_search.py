@@ -1,4 +1,6 @@
 import logging
+import os
+import time
 from typing import TypedDict
 from urllib.parse import urlparse
 
@@ -7,6 +9,7 @@ from app.repositories.models.conversation import (
     TextToolResultModel,
 )
 from app.repositories.models.custom_bot import BotModel
+from app.repositories.result_cache import ResultCache, compose_cache_key
 from app.utils import get_bedrock_agent_client
 
 from botocore.exceptions import ClientError
@@ -17,6 +20,13 @@ from mypy_boto3_bedrock_agent_runtime.type_defs import (
     KnowledgeBaseRetrievalResultTypeDef,
 )
 
+# Results of the same query on the same knowledge base are reused, e.g. for the quick starters of a bot.
+# Entries of the knowledge base synced after they are stored are not used, and nothing is cached during a sync.
+RETRIEVAL_CACHE_TTL_SECONDS = float(
+    os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", "300")
+)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+
 logger = logging.getLogger(__name__)
 agent_client = get_bedrock_agent_client()
 
@@ -59,6 +69,13 @@ def to_guardrails_grounding_source(
     )
 
 
+_retrieval_cache: ResultCache[list[SearchResult]] = ResultCache(
+    "Retrieval",
+    ttl=RETRIEVAL_CACHE_TTL_SECONDS,
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+)
+
+
 def _bedrock_knowledge_base_search(bot: BotModel, query: str) -> list[SearchResult]:
     assert (
         bot.bedrock_knowledge_base is not None
@@ -80,7 +97,32 @@ def _bedrock_knowledge_base_search(bot: BotModel, query: str) -> list[SearchResu
         else bot.bedrock_knowledge_base.knowledge_base_id
     )
 
+    # The documents may change until the sync succeeds
+    cacheable = bot.sync_status == "SUCCEEDED"
+    cache_key = compose_cache_key(
+        knowledge_base_id,
+        # The execution of the embedding state machine, which is new for each sync
+        bot.sync_last_exec_id,
+        " ".join(query.split()),
+        search_type,
+        limit,
+    )
+    cached = _retrieval_cache.get(cache_key) if cacheable else None
+    if cached is not None:
+        # The knowledge base can be shared by the bots
+        return [
+            SearchResult(
+                rank=result["rank"],
+                bot_id=bot.id,
+                content=result["content"],
+                source_name=result["source_name"],
+                source_link=result["source_link"],
+            )
+            for result in cached
+        ]
+
     try:
+        started_at = time.perf_counter()
         response = agent_client.retrieve(
             knowledgeBaseId=knowledge_base_id,
             retrievalQuery={"text": query},
@@ -126,6 +168,10 @@ def _bedrock_knowledge_base_search(bot: BotModel, query: str) -> list[SearchResu
                     )
                 )
 
+        if cacheable:
+            _retrieval_cache.put(
+                cache_key, search_results, cost=time.perf_counter() - started_at
+            )
         return search_results
 
     except ClientError as e:
@@ -1,12 +1,15 @@
 import json
 import logging
 import os
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from decimal import Decimal as decimal
-from queue import SimpleQueue
-from threading import Thread
-from typing import BinaryIO, Literal, TypedDict
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Literal, TypedDict
 
 import boto3
 from app.auth import verify_token
@@ -18,10 +21,22 @@ from app.routes.schemas.conversation import ChatInput
 from app.stream import OnStopInput, OnThinking
 from app.usecases.chat import (
     chat,
+    prefetch_conversation,
 )
+from app.utils import generate_presigned_url, get_client
 from boto3.dynamodb.conditions import Attr, Key
 
 WEBSOCKET_SESSION_TABLE_NAME = os.environ["WEBSOCKET_SESSION_TABLE_NAME"]
+REGION = os.environ.get("REGION", "us-east-1")
+# Bucket to upload the chat input at once, instead of sending it in parts
+LARGE_PAYLOAD_SUPPORT_BUCKET = os.environ.get("LARGE_PAYLOAD_SUPPORT_BUCKET", "")
+CHAT_INPUT_UPLOAD_URL_EXPIRATION = 60 * 2  # Same as the session
+# `START` waits for the prefetch at most this long, because Lambda freezes the threads left running after returning.
+CHAT_PREFETCH_TIMEOUT_SECONDS = float(
+    os.environ.get("CHAT_PREFETCH_TIMEOUT_SECONDS", "1")
+)
+# Number of connections to remember whether prefetched, to report time to first token with it
+CHAT_PREFETCH_MAX_CONNECTIONS = 64
 
 dynamodb_client = boto3.resource("dynamodb")
 table = dynamodb_client.Table(WEBSOCKET_SESSION_TABLE_NAME)
@@ -29,66 +44,252 @@ table = dynamodb_client.Table(WEBSOCKET_SESSION_TABLE_NAME)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Text deltas of the model queued within this window are sent as a single `STREAMING` frame.
+# Set `0` to send a frame for each delta.
+NOTIFICATION_COALESCE_WINDOW_MS = int(
+    os.environ.get("NOTIFICATION_COALESCE_WINDOW_MS", "40")
+)
+# Number of `STREAMING` frames posted concurrently. The client reorders frames by `seq`.
+NOTIFICATION_SENDER_WORKERS = int(os.environ.get("NOTIFICATION_SENDER_WORKERS", "1"))
+# Retries of a frame failed other than by the closed connection
+NOTIFICATION_MAX_RETRIES = 2
+# API Gateway (websocket) has hard limit of 32KB per frame
+NOTIFICATION_MAX_FRAME_BYTES = 30 * 1024
+# Producers wait for the sender when the queue is full
+NOTIFICATION_QUEUE_SIZE = 1024
+
 
 class _NotifyCommand(TypedDict):
     type: Literal["notify"]
-    payload: bytes | BinaryIO
+    payload: dict
+
+
+class _StreamCommand(TypedDict):
+    type: Literal["stream"]
+    token: str
 
 
 class _FinishCommand(TypedDict):
     type: Literal["finish"]
 
 
-_Command = _NotifyCommand | _FinishCommand
+_Command = _NotifyCommand | _StreamCommand | _FinishCommand
 
 
 class NotificationSender:
-    def __init__(self, endpoint_url: str, connection_id: str) -> None:
-        self.commands = SimpleQueue[_Command]()
+    """Send notifications to the websocket client in a thread, in the order they are queued.
+    Each frame has `seq`, the number of frames sent before it. With `workers` > 1, `STREAMING` frames
+    are posted concurrently and may arrive out of order, so the client reorders them by `seq`.
+    Other frames are posted after all preceding frames are done, so that the client can stop
+    waiting for a frame failed to send once it receives any frame other than `STREAMING`.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        connection_id: str,
+        coalesce_window_ms: int = NOTIFICATION_COALESCE_WINDOW_MS,
+        max_frame_bytes: int = NOTIFICATION_MAX_FRAME_BYTES,
+        queue_size: int = NOTIFICATION_QUEUE_SIZE,
+        workers: int = NOTIFICATION_SENDER_WORKERS,
+        max_retries: int = NOTIFICATION_MAX_RETRIES,
+    ) -> None:
+        self.commands = Queue[_Command](maxsize=queue_size)
         self.endpoint_url = endpoint_url
         self.connection_id = connection_id
+        self.coalesce_window = coalesce_window_ms / 1000
+        self.max_frame_bytes = max_frame_bytes
+        self.workers = workers
+        self.max_retries = max_retries
+        self.closed = False
+        self.gone = False
+        self.seq = 0
+        self.tokens_received = 0
+        self.stream_frames_sent = 0
+        self.frames_sent = 0
+        self.retries = 0
+        # `time.time()` when the first text delta is received
+        self.first_token_at: float | None = None
+        self._stats_lock = Lock()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "tokens_received": self.tokens_received,
+                "stream_frames_sent": self.stream_frames_sent,
+                "frames_sent": self.frames_sent,
+                "retries": self.retries,
+                # Number of text deltas per `STREAMING` frame
+                "coalescing_ratio": (
+                    self.tokens_received / self.stream_frames_sent
+                    if self.stream_frames_sent > 0
+                    else 0.0
+                ),
+            }
 
-    def run(self):
-        import boto3
+    def _encode(self, payload: dict) -> bytes:
+        frame = json.dumps(dict(payload, seq=self.seq)).encode("utf-8")
+        self.seq += 1
+        return frame
 
-        gatewayapi = boto3.client(
-            "apigatewaymanagementapi",
-            endpoint_url=self.endpoint_url,
-        )
+    def _post(self, gatewayapi, frame: bytes, is_stream: bool = False):
+        """Send a frame, retrying only this frame on failure.
+        Sets `gone` if the connection is no longer available.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.gone:
+                return
 
+            try:
+                gatewayapi.post_to_connection(
+                    ConnectionId=self.connection_id,
+                    Data=frame,
+                )
+                with self._stats_lock:
+                    self.frames_sent += 1
+                    if is_stream:
+                        self.stream_frames_sent += 1
+                return
+
+            except (
+                gatewayapi.exceptions.GoneException,
+                gatewayapi.exceptions.ForbiddenException,
+            ) as e:
+                logger.exception(
+                    f"Shutdown the notification sender due to an exception: {e}"
+                )
+                self.gone = True
+                return
+
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.exception(f"Failed to send notification: {e}")
+                    return
+
+                logger.warning(f"Retrying to send notification: {e}")
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(0.05 * 2**attempt)
+
+    def _coalesce(
+        self, token: str, deadline: float
+    ) -> tuple[list[str], _Command | None]:
+        """Collect text deltas queued until the deadline or the frame size limit.
+        Returns the deltas and the command which stopped collecting, to be handled next.
+        """
+        tokens = [token]
+        # Size of the frame when JSON encoded, as deltas may be escaped
+        size = len(json.dumps(dict(status="STREAMING", completion=token, seq=self.seq)))
         while True:
-            command = self.commands.get()
-            if command["type"] == "notify":
-                try:
-                    gatewayapi.post_to_connection(
-                        ConnectionId=self.connection_id,
-                        Data=command["payload"],
-                    )
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    command = self.commands.get(timeout=timeout)
+                else:
+                    # Merge the deltas already queued while the previous frame was sent
+                    command = self.commands.get_nowait()
+            except Empty:
+                return tokens, None
+
+            if command["type"] != "stream":
+                return tokens, command
+
+            token_size = len(json.dumps(command["token"])) - 2
+            if size + token_size > self.max_frame_bytes:
+                return tokens, command
 
-                except (
-                    gatewayapi.exceptions.GoneException,
-                    gatewayapi.exceptions.ForbiddenException,
-                ) as e:
-                    logger.exception(
-                        f"Shutdown the notification sender due to an exception: {e}"
+            tokens.append(command["token"])
+            size += token_size
+
+    def run(self):
+        executor: ThreadPoolExecutor | None = None
+        try:
+            gatewayapi = get_client(
+                "apigatewaymanagementapi",
+                endpoint_url=self.endpoint_url,
+            )
+            executor = (
+                ThreadPoolExecutor(max_workers=self.workers)
+                if self.workers > 1
+                else None
+            )
+            in_flight: set[Future] = set()
+
+            next_command: _Command | None = None
+            # Send immediately when idle, otherwise at most one `STREAMING` frame per window
+            last_stream_sent_at = float("-inf")
+            while not self.gone:
+                command = next_command or self.commands.get()
+                next_command = None
+                if command["type"] == "stream":
+                    tokens = [command["token"]]
+                    if self.coalesce_window > 0:
+                        tokens, next_command = self._coalesce(
+                            command["token"],
+                            deadline=last_stream_sent_at + self.coalesce_window,
+                        )
+
+                    # Send completion
+                    frame = self._encode(
+                        dict(
+                            status="STREAMING",
+                            completion="".join(tokens),
+                        )
                     )
+                    if executor is None:
+                        self._post(gatewayapi, frame, is_stream=True)
+                    else:
+                        if len(in_flight) >= self.workers:
+                            _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        in_flight.add(
+                            executor.submit(
+                                self._post, gatewayapi, frame, is_stream=True
+                            )
+                        )
+
+                    last_stream_sent_at = time.monotonic()
+
+                elif command["type"] == "notify":
+                    wait(in_flight)
+                    in_flight.clear()
+                    self._post(gatewayapi, self._encode(command["payload"]))
+
+                elif command["type"] == "finish":
                     break
 
-                except Exception as e:
-                    logger.exception(f"Failed to send notification: {e}")
+        except Exception as e:
+            logger.exception(f"Notification sender failed: {e}")
+
+        finally:
+            # NOTE: On every exit, so that producers never block on the bounded queue
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+            self.closed = True
+            # Release producers waiting for the queue
+            while True:
+                try:
+                    self.commands.get_nowait()
+                except Empty:
+                    break
 
-            elif command["type"] == "finish":
-                break
+            logger.info(f"Notification sender finished: {self.stats()}")
+
+    def _put(self, command: _Command):
+        if self.closed:
+            return
+
+        self.commands.put(command)
 
     def finish(self):
-        self.commands.put(
+        self._put(
             {
                 "type": "finish",
             }
         )
 
-    def notify(self, payload: bytes | BinaryIO):
-        self.commands.put(
+    def notify(self, payload: dict):
+        self._put(
             {
                 "type": "notify",
                 "payload": payload,
@@ -96,30 +297,29 @@ class NotificationSender:
         )
 
     def on_stream(self, token: str):
-        # Send completion
-        payload = json.dumps(
-            dict(
-                status="STREAMING",
-                completion=token,
-            )
-        ).encode("utf-8")
-
-        self.notify(payload=payload)
+        with self._stats_lock:
+            if self.first_token_at is None:
+                self.first_token_at = time.time()
+            self.tokens_received += 1
+        self._put(
+            {
+                "type": "stream",
+                "token": token,
+            }
+        )
 
     def on_stop(self, arg: OnStopInput):
-        payload = json.dumps(
-            dict(
+        self.notify(
+            payload=dict(
                 status="STREAMING_END",
                 completion="",
                 stop_reason=arg["stop_reason"],
             )
-        ).encode("utf-8")
-
-        self.notify(payload=payload)
+        )
 
     def on_agent_thinking(self, tool_use: OnThinking):
-        payload = json.dumps(
-            dict(
+        self.notify(
+            payload=dict(
                 status="AGENT_THINKING",
                 log={
                     tool_use["tool_use_id"]: {
@@ -128,46 +328,76 @@ class NotificationSender:
                     },
                 },
             )
-        ).encode("utf-8")
-
-        self.notify(payload=payload)
+        )
 
     def on_agent_tool_result(self, run_result: ToolRunResult):
         self.notify(
-            payload=json.dumps(
-                dict(
-                    status="AGENT_TOOL_RESULT",
-                    result={
-                        "toolUseId": run_result["tool_use_id"],
-                        "status": run_result["status"],
-                    },
-                )
-            ).encode("utf-8")
+            payload=dict(
+                status="AGENT_TOOL_RESULT",
+                result={
+                    "toolUseId": run_result["tool_use_id"],
+                    "status": run_result["status"],
+                },
+            )
         )
 
         for related_document in run_result["related_documents"]:
             self.notify(
-                payload=json.dumps(
-                    dict(
-                        status="AGENT_RELATED_DOCUMENT",
-                        result={
-                            "toolUseId": run_result["tool_use_id"],
-                            "relatedDocument": related_document.to_schema().model_dump(
-                                by_alias=True
-                            ),
-                        },
-                    )
-                ).encode("utf-8")
+                payload=dict(
+                    status="AGENT_RELATED_DOCUMENT",
+                    result={
+                        "toolUseId": run_result["tool_use_id"],
+                        "relatedDocument": related_document.to_schema().model_dump(
+                            by_alias=True
+                        ),
+                    },
+                )
             )
 
 
+_prefetched_connections: OrderedDict[str, float] = OrderedDict()
+_prefetched_connections_lock = Lock()
+
+
+def prefetch_chat(
+    user_id: str,
+    connection_id: str,
+    conversation_id: str | None,
+    bot_id: str | None,
+):
+    """Warm up this container with the hints sent on `START`, while the client sends the message.
+    `END` of the connection is likely handled by this container, as the client waits for the response of `START`.
+    Failures are only logged, and the same reads are retried on `END`.
+    """
+    start = time.perf_counter()
+    try:
+        prefetch_conversation(user_id, conversation_id, bot_id)
+    except Exception as e:
+        logger.warning(f"Failed to prefetch conversation: {e}")
+        return
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Prefetched conversation {conversation_id} and bot {bot_id} in {elapsed * 1000:.0f}ms"
+    )
+    with _prefetched_connections_lock:
+        _prefetched_connections[connection_id] = elapsed
+        while len(_prefetched_connections) > CHAT_PREFETCH_MAX_CONNECTIONS:
+            _prefetched_connections.popitem(last=False)
+
+
 def process_chat_input(
     user_id: str,
     chat_input: ChatInput,
     notificator: NotificationSender,
+    started_at: float | None = None,
 ) -> dict:
-    """Process chat input and send the message to the client."""
+    """Process chat input and send the message to the client.
+    `started_at` is `time.time()` when `START` of the session is received, to log the time to first token from it.
+    """
     logger.info(f"Received chat input: {chat_input}")
+    if started_at is None:
+        started_at = time.time()
 
     try:
         chat(
@@ -187,6 +417,15 @@ def process_chat_input(
             ),
         )
 
+        if notificator.first_token_at is not None:
+            with _prefetched_connections_lock:
+                prefetched = notificator.connection_id in _prefetched_connections
+                _prefetched_connections.pop(notificator.connection_id, None)
+            logger.info(
+                f"Time to first token: {(notificator.first_token_at - started_at) * 1000:.0f}ms "
+                f"(prefetched: {prefetched})"
+            )
+
         return {"statusCode": 200, "body": "Message sent."}
 
     except RecordNotFoundError:
@@ -224,6 +463,20 @@ def process_chat_input(
         }
 
 
+def compose_chat_input_upload_key(user_id: str, connection_id: str) -> str:
+    return f"{user_id}/chat_inputs/{connection_id}.json"
+
+
+def load_uploaded_chat_input(key: str) -> ChatInput:
+    """Load the chat input uploaded to S3 and delete the object."""
+    s3_client = get_client("s3", region_name=REGION)
+    response = s3_client.get_object(Bucket=LARGE_PAYLOAD_SUPPORT_BUCKET, Key=key)
+    # Validate the JSON bytes directly, without building intermediate Python objects
+    chat_input = ChatInput.model_validate_json(response["Body"].read())
+    s3_client.delete_object(Bucket=LARGE_PAYLOAD_SUPPORT_BUCKET, Key=key)
+    return chat_input
+
+
 def handler(event, context):
     logger.info(f"Received event: {event}")
     route_key = event["requestContext"]["routeKey"]
@@ -263,7 +516,13 @@ def handler(event, context):
         # 4. This handler receives the message parts and appends them to the item in DynamoDB with index.
         # 5. Client sends `END` message to the WebSocket API.
         # 6. This handler receives the `END` message, concatenates the parts and sends the message to Bedrock.
+        # If the client sends `START` with `upload`, steps 3 and 4 are replaced with a single upload to S3:
+        # 2. This handler returns a presigned URL to upload the message to.
+        # 3. Client uploads the full message to the URL, and sends `END` message with its `objectKey`.
+        # If the upload fails, the client can still send the message in parts.
+        # The client may send `conversationId` and `botId` with `START`, to prefetch them while sending the message.
         if step == "START":
+            started_at = time.time()
             token = body["token"]
             try:
                 # Verify JWT token
@@ -281,17 +540,59 @@ def handler(event, context):
                 }
 
             user_id = decoded["sub"]
+            conversation_id = body.get("conversationId")
+            bot_id = body.get("botId")
+            prefetch_thread = None
+            if conversation_id or bot_id:
+                # Run while storing the session
+                prefetch_thread = Thread(
+                    target=prefetch_chat,
+                    args=(user_id, connection_id, conversation_id, bot_id),
+                    name=f"prefetch-{connection_id}",
+                    daemon=True,
+                )
+                prefetch_thread.start()
+
+            upload_key = (
+                compose_chat_input_upload_key(user_id, connection_id)
+                if body.get("upload") and LARGE_PAYLOAD_SUPPORT_BUCKET
+                else None
+            )
 
             # Store user id
-            response = table.put_item(
-                Item={
-                    "ConnectionId": connection_id,
-                    # Store as zero
-                    "MessagePartId": decimal(0),
-                    "UserId": user_id,
-                    "expire": expire,
+            item = {
+                "ConnectionId": connection_id,
+                # Store as zero
+                "MessagePartId": decimal(0),
+                "UserId": user_id,
+                # To log the time to first token from `START`, which includes sending the message
+                "StartedAt": decimal(str(started_at)),
+                "expire": expire,
+            }
+            if upload_key:
+                item["UploadKey"] = upload_key
+            response = table.put_item(Item=item)
+            if prefetch_thread is not None:
+                # If it times out, the rest of the prefetch continues when the container is invoked next.
+                prefetch_thread.join(timeout=CHAT_PREFETCH_TIMEOUT_SECONDS)
+
+            if upload_key:
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(
+                        dict(
+                            status="UPLOAD",
+                            url=generate_presigned_url(
+                                LARGE_PAYLOAD_SUPPORT_BUCKET,
+                                upload_key,
+                                content_type="application/json",
+                                expiration=CHAT_INPUT_UPLOAD_URL_EXPIRATION,
+                                region=REGION,
+                            ),
+                            objectKey=upload_key,
+                        )
+                    ),
                 }
-            )
             return {"statusCode": 200, "body": "Session started."}
         elif step == "END":
             # Retrieve user id
@@ -299,7 +600,31 @@ def handler(event, context):
                 KeyConditionExpression=Key("ConnectionId").eq(connection_id),
                 FilterExpression=Attr("UserId").exists(),
             )
-            user_id = response["Items"][0]["UserId"]
+            session = response["Items"][0]
+            user_id = session["UserId"]
+            # Sessions stored before `StartedAt` was introduced
+            started_at = float(session["StartedAt"]) if "StartedAt" in session else None
+
+            object_key = body.get("objectKey")
+            if object_key is not None:
+                # Accept only the key issued for this session
+                if object_key != session.get("UploadKey"):
+                    return {
+                        "statusCode": 403,
+                        "body": json.dumps(
+                            dict(
+                                status="ERROR",
+                                reason="Invalid object key.",
+                            )
+                        ),
+                    }
+
+                return process_chat_input(
+                    user_id=user_id,
+                    chat_input=load_uploaded_chat_input(object_key),
+                    notificator=notificator,
+                    started_at=started_at,
+                )
 
             # Concatenate the message parts
             message_parts = []
@@ -336,6 +661,7 @@ def handler(event, context):
                 user_id=user_id,
                 chat_input=chat_input,
                 notificator=notificator,
+                started_at=started_at,
             )
 
         else:
@@ -4,13 +4,14 @@ sys.path.append(".")
 import unittest
 from pprint import pprint
 
-from app.agents.tools.agent_tool import AgentTool
+from app.agents.tools.agent_tool import AgentTool, ToolResultCache
 from app.repositories.models.conversation import (
     RelatedDocumentModel,
     TextToolResultModel,
 )
 from app.repositories.models.custom_bot import BotModel
 from app.routes.schemas.conversation import type_model_name
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
 
 from pydantic import BaseModel, Field
 
@@ -109,5 +110,82 @@ class TestAgentTool(unittest.TestCase):
         self.assertEqual(result["status"], "success")
 
 
+class SearchArg(BaseModel):
+    query: str
+
+
+class TestToolResultCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.queries: list[str] = []
+
+        def search(
+            arg: SearchArg,
+            bot: BotModel | None,
+            model: type_model_name | None,
+        ) -> list:
+            self.queries.append(arg.query)
+            if arg.query == "error":
+                raise Exception("Search failed")
+
+            return [f"Result 1 of {arg.query}", f"Result 2 of {arg.query}"]
+
+        self.cache = ToolResultCache(ttl=60, max_entries=2)
+        self.cache.shared = None
+        self.tool = AgentTool(
+            name="search",
+            description="search",
+            args_schema=SearchArg,
+            function=search,
+            cache=self.cache,
+        )
+
+    def _run(self, tool_use_id: str, query: str):
+        return self.tool.run(
+            tool_use_id=tool_use_id,
+            input={"query": query},
+            model="claude-v3.5-sonnet-v2",
+        )
+
+    def test_hit(self):
+        result = self._run("tool-use-1", "Amazon Bedrock")
+        self.assertFalse(result["cache_hit"])
+
+        # The same query with different whitespace
+        result = self._run("tool-use-2", " Amazon  Bedrock")
+        self.assertTrue(result["cache_hit"])
+        self.assertEqual(result["tool_use_id"], "tool-use-2")
+        self.assertEqual(
+            [document.source_id for document in result["related_documents"]],
+            ["tool-use-2@0", "tool-use-2@1"],
+        )
+        self.assertEqual(
+            result["related_documents"][0].content,
+            TextToolResultModel(text="Result 1 of Amazon Bedrock"),
+        )
+        self.assertEqual(self.queries, ["Amazon Bedrock"])
+
+    def test_error_not_cached(self):
+        self.assertEqual(self._run("tool-use-1", "error")["status"], "error")
+        self.assertEqual(self._run("tool-use-2", "error")["status"], "error")
+        self.assertEqual(self.queries, ["error", "error"])
+
+    def test_bot_params(self):
+        self.cache.bot_params = lambda bot: bot.id if bot is not None else None
+        self._run("tool-use-1", "Amazon Bedrock")
+        result = self.tool.run(
+            tool_use_id="tool-use-2",
+            input={"query": "Amazon Bedrock"},
+            model="claude-v3.5-sonnet-v2",
+            bot=create_test_private_bot("bot", False, "user"),
+        )
+        self.assertFalse(result["cache_hit"])
+        self.assertEqual(len(self.queries), 2)
+
+    def test_not_cached(self):
+        self.tool.cache = None
+        result = self._run("tool-use-1", "Amazon Bedrock")
+        self.assertNotIn("cache_hit", result)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,193 @@
+import logging
+import sys
+
+sys.path.append(".")
+
+import base64
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+import rsa
+from app.auth import JwksCache, verify_token
+from jose import JWTError, jwt
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ID = "client"
+
+
+def _b64(value: int) -> str:
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class LocalJwks:
+    """Stand-in for the JWKS endpoint of Cognito, with the signing keys generated locally."""
+
+    def __init__(self, kids: list[str], latency: float = 0):
+        self.latency = latency
+        self.requests = 0
+        self.available = True
+        self.private_keys: dict[str, bytes] = {}
+        self.public_keys: dict[str, dict] = {}
+        for kid in kids:
+            self.add_key(kid)
+
+    def add_key(self, kid: str):
+        public_key, private_key = rsa.newkeys(1024)
+        self.private_keys[kid] = private_key.save_pkcs1()
+        self.public_keys[kid] = {
+            "kid": kid,
+            "alg": "RS256",
+            "kty": "RSA",
+            "use": "sig",
+            "n": _b64(public_key.n),
+            "e": _b64(public_key.e),
+        }
+
+    def get(self, url: str):
+        self.requests += 1
+        time.sleep(self.latency)
+        response = MagicMock()
+        if not self.available:
+            response.raise_for_status.side_effect = requests.HTTPError("503")
+        response.json.return_value = {"keys": list(self.public_keys.values())}
+        return response
+
+    def create_token(self, kid: str, sub: str = "user") -> str:
+        return jwt.encode(
+            {"sub": sub, "aud": CLIENT_ID, "exp": int(time.time()) + 3600},
+            self.private_keys[kid],
+            algorithm="RS256",
+            headers={"kid": kid},
+        )
+
+
+class TestVerifyToken(unittest.TestCase):
+    def setUp(self):
+        self.jwks = LocalJwks(["key1", "key2"], latency=0.01)
+        self.cache = JwksCache("https://example.com/jwks.json")
+        self.patchers = [
+            patch("app.auth.requests.get", self.jwks.get),
+            patch("app.auth._jwks_cache", self.cache),
+            patch("app.auth.CLIENT_ID", CLIENT_ID),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_cached(self):
+        for kid in ("key1", "key2", "key1"):
+            self.assertEqual(verify_token(self.jwks.create_token(kid))["sub"], "user")
+        self.assertEqual(self.jwks.requests, 1)
+
+    def test_expired(self):
+        self.cache.ttl = 0
+        verify_token(self.jwks.create_token("key1"))
+        verify_token(self.jwks.create_token("key1"))
+        self.assertEqual(self.jwks.requests, 2)
+
+    def test_rotation(self):
+        verify_token(self.jwks.create_token("key1"))
+        self.jwks.add_key("key3")
+        self.cache.min_refetch_interval = 0
+
+        self.assertEqual(verify_token(self.jwks.create_token("key3"))["sub"], "user")
+        self.assertEqual(self.jwks.requests, 2)
+
+    def test_unknown_kid(self):
+        verify_token(self.jwks.create_token("key1"))
+        unknown = LocalJwks(["unknown"])
+        for _ in range(3):
+            with self.assertRaises(JWTError):
+                verify_token(unknown.create_token("unknown"))
+        # Not refetched right after the fetch
+        self.assertEqual(self.jwks.requests, 1)
+
+    def test_fetch_failed(self):
+        verify_token(self.jwks.create_token("key1"))
+        self.jwks.add_key("key3")
+        self.jwks.available = False
+        self.cache.ttl = 0
+
+        # The keys fetched before are still used
+        self.assertEqual(verify_token(self.jwks.create_token("key1"))["sub"], "user")
+        # Unknown to the keys fetched before
+        with self.assertRaises(JWTError):
+            verify_token(self.jwks.create_token("key3"))
+        # Not refetched right after the failure
+        self.assertEqual(self.jwks.requests, 2)
+
+        self.jwks.available = True
+        self.cache.min_refetch_interval = 0
+        self.assertEqual(verify_token(self.jwks.create_token("key3"))["sub"], "user")
+        self.assertEqual(self.jwks.requests, 3)
+
+    def test_first_fetch_failed(self):
+        self.jwks.available = False
+        with self.assertRaises(requests.HTTPError):
+            verify_token(self.jwks.create_token("key1"))
+
+    def test_invalid_signature(self):
+        # Signed with another key with the same `kid`
+        forged = LocalJwks(["key1"]).create_token("key1")
+        with self.assertRaises(JWTError):
+            verify_token(forged)
+
+    def test_concurrent_misses(self):
+        tokens = [self.jwks.create_token("key1", sub=f"user{i}") for i in range(8)]
+        results: list[str] = []
+
+        def verify(token: str):
+            results.append(verify_token(token)["sub"])
+
+        threads = [threading.Thread(target=verify, args=(t,)) for t in tokens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), sorted(f"user{i}" for i in range(8)))
+        self.assertEqual(self.jwks.requests, 1)
+
+
+class TestVerifyTokenBenchmark(unittest.TestCase):
+    """Compare verify throughput with and without the JWKS cache, when the fetch takes time as on AWS."""
+
+    LATENCY = 0.02
+    ROUNDS = 50
+
+    def test_benchmark(self):
+        jwks = LocalJwks(["key1", "key2"], latency=self.LATENCY)
+        tokens = [jwks.create_token(f"key{i % 2 + 1}") for i in range(self.ROUNDS)]
+
+        with patch("app.auth.requests.get", jwks.get), patch(
+            "app.auth.CLIENT_ID", CLIENT_ID
+        ):
+            for name, ttl in (("no cache", 0.0), ("cache", 3600.0)):
+                with patch(
+                    "app.auth._jwks_cache",
+                    JwksCache("https://example.com/jwks.json", ttl=ttl),
+                ):
+                    jwks.requests = 0
+                    start = time.perf_counter()
+                    for token in tokens:
+                        verify_token(token)
+                    elapsed = time.perf_counter() - start
+
+                logger.info(
+                    f"{name}: {self.ROUNDS / elapsed:.0f} verifies/s, "
+                    f"{jwks.requests} fetches ({self.LATENCY * 1000:.0f}ms each)"
+                )
+
+        self.assertEqual(jwks.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -275,6 +275,12 @@ class TestConversationRepository(unittest.TestCase):
 
         self.mock_table.query.side_effect = mock_query_side_effect
 
+        def mock_get_item_side_effect(**kwargs):
+            items = mock_query_side_effect(IndexName="SKIndex")["Items"]
+            return {"Item": items[0]} if items else {}
+
+        self.mock_table.get_item.side_effect = mock_get_item_side_effect
+
         # Test storing conversation
         response = store_conversation("user", conversation)
         self.assertIsNotNone(response)
@@ -462,6 +468,12 @@ class TestConversationRepository(unittest.TestCase):
 
         self.mock_table.query.side_effect = mock_query_side_effect
 
+        def mock_get_item_side_effect(**kwargs):
+            items = mock_query_side_effect(IndexName="SKIndex")["Items"]
+            return {"Item": items[0]} if items else {}
+
+        self.mock_table.get_item.side_effect = mock_get_item_side_effect
+
         message_map_json = json.dumps(
             {
                 k: {
@@ -530,6 +542,9 @@ class TestConversationBotRepository(unittest.TestCase):
 
         self.mock_table = MagicMock()
         self.mock_boto3_resource.return_value.Table.return_value = self.mock_table
+        self.mock_table.put_item.return_value = {
+            "ResponseMetadata": {"HTTPStatusCode": 200}
+        }
 
         # Set up environment variables
         os.environ["CONVERSATION_TABLE_NAME"] = "test-table"
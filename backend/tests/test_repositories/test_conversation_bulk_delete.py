@@ -0,0 +1,129 @@
+import logging
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories.common import compose_bot_id, compose_related_document_source_id
+from app.repositories.conversation import (
+    S3_DELETE_BATCH_SIZE,
+    delete_conversation_by_user_id,
+    store_conversation,
+)
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+logger = logging.getLogger(__name__)
+
+
+class TestBulkDelete(InMemoryRepositoryTestCase):
+
+    def _store_conversations(self, user_id: str, count: int):
+        for index in range(count):
+            conversation = create_test_conversation(
+                id=f"{index:03}", turns=5, seed=index
+            )
+            store_conversation(
+                user_id,
+                conversation,
+                # Every third conversation is stored in S3
+                threshold=1024 if index % 3 == 0 else 400 * 1024,
+                storage_mode="message_item" if index % 3 == 1 else "message_map",
+            )
+            self.table.put_item(
+                Item={
+                    "PK": user_id,
+                    "SK": compose_related_document_source_id(
+                        user_id, conversation.id, "source"
+                    ),
+                }
+            )
+
+        self.table.put_item(Item={"PK": user_id, "SK": compose_bot_id(user_id, "bot")})
+
+    def test_delete_all(self):
+        self._store_conversations("user", 90)
+        self._store_conversations("other", 3)
+        # Read in many pages
+        self.table.PAGE_SIZE = 64 * 1024
+        objects = len(self.s3.objects)
+        self.s3.reset_metrics()
+
+        delete_conversation_by_user_id("user")
+
+        self.assertEqual(
+            [key for key in self.table.items.keys() if key[0] == "user"],
+            [("user", "user#BOT#bot")],
+        )
+        self.assertTrue(all(key[1].startswith("other/") for key in self.s3.objects))
+        # Objects are deleted in batches, not one by one
+        self.assertEqual(self.s3.calls["delete_object"], 0)
+        self.assertLess(self.s3.calls["delete_objects"], objects / 10)
+        self.assertGreater(self.table.calls["query"], 2)
+
+    def test_batch_size(self):
+        # A conversation with more messages than a `DeleteObjects` request accepts
+        conversation = create_test_conversation(turns=600, answer_words=10)
+        store_conversation(
+            "user", conversation, threshold=1024, storage_mode="message_map"
+        )
+        self.assertGreater(len(self.s3.objects), S3_DELETE_BATCH_SIZE)
+
+        delete_conversation_by_user_id("user")
+        self.assertEqual(len(self.s3.objects), 0)
+        self.assertEqual(self.s3.calls["delete_objects"], 2)
+
+    def test_nothing_to_delete(self):
+        delete_conversation_by_user_id("user")
+        self.assertEqual(self.table.calls["batch_write_item"], 0)
+        self.assertEqual(self.s3.calls["delete_objects"], 0)
+
+
+class TestBulkDeleteBenchmark(InMemoryRepositoryTestCase):
+    """Measure deleting all conversations when each request takes time, as on AWS."""
+
+    LATENCY = 0.005
+
+    def test_benchmark(self):
+        for index in range(200):
+            store_conversation(
+                "user",
+                create_test_conversation(id=f"{index:03}", turns=5, seed=index),
+                threshold=1024 if index % 2 == 0 else 400 * 1024,
+                storage_mode="message_map",
+            )
+
+        flush = type(self.table.batch_writer()).flush
+        delete_objects = self.s3.delete_objects
+
+        def slow_flush(writer):
+            if writer.requests:
+                time.sleep(self.LATENCY)
+            flush(writer)
+
+        def slow_delete_objects(**kwargs):
+            time.sleep(self.LATENCY)
+            return delete_objects(**kwargs)
+
+        with patch.object(
+            type(self.table.batch_writer()), "flush", slow_flush
+        ), patch.object(self.s3, "delete_objects", slow_delete_objects):
+            start = time.perf_counter()
+            delete_conversation_by_user_id("user")
+            elapsed = time.perf_counter() - start
+
+        logger.info(
+            f"Deleted 200 conversations in {elapsed * 1000:.0f}ms "
+            f"({self.table.calls['batch_write_item']} BatchWriteItem, "
+            f"{self.s3.calls['delete_objects']} DeleteObjects, {self.LATENCY * 1000:.0f}ms each)"
+        )
+        self.assertEqual(len(self.table.items), 0)
+        self.assertEqual(len(self.s3.objects), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
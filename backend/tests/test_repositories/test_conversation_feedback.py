@@ -0,0 +1,114 @@
+import json
+import sys
+import unittest
+from decimal import Decimal as decimal
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    RecordNotFoundError,
+    find_conversation_by_id,
+    store_conversation,
+    update_feedback,
+)
+from app.repositories.models.conversation import FeedbackModel
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+
+class TestConversationFeedback(InMemoryRepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.feedback = FeedbackModel(
+            thumbs_up=True, category="Good", comment="The response is pretty good."
+        )
+
+    def test_update_feedback_of_large_conversation(self):
+        conversation = create_test_conversation(turns=3)
+        store_conversation(
+            "user", conversation, threshold=100, storage_mode="message_map"
+        )
+        self.table.reset_metrics()
+        self.s3.reset_metrics()
+
+        update_feedback("user", "1", "assistant-0001", self.feedback)
+        # Neither the messages in S3 nor the message map is read or rewritten.
+        # Only the message ids are read to validate the message.
+        self.assertEqual(self.table.calls, {"get_item": 1, "update_item": 1})
+        self.assertEqual(self.s3.calls, {})
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["assistant-0001"].feedback, self.feedback)
+        self.assertIsNone(found.message_map["assistant-0000"].feedback)
+
+        # Feedback is folded into the messages when the whole conversation is stored
+        store_conversation("user", found, storage_mode="message_map")
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertEqual(item["Feedback"], {})
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["assistant-0001"].feedback, self.feedback)
+
+    def test_update_feedback_of_legacy_conversation(self):
+        conversation = create_test_conversation(turns=1)
+        # Stored before `Feedback` attribute was introduced
+        self.table.put_item(
+            Item={
+                "PK": "user",
+                "SK": "user#CONV#1",
+                "Title": "Legacy",
+                "CreateTime": decimal("1627984879.9"),
+                "TotalPrice": decimal("0"),
+                "LastMessageId": "assistant-0000",
+                "ShouldContinue": False,
+                "IsLargeMessage": False,
+                "MessageMap": json.dumps(
+                    {
+                        k: v.model_dump(by_alias=True)
+                        for k, v in conversation.message_map.items()
+                    }
+                ),
+            }
+        )
+
+        update_feedback("user", "1", "assistant-0000", self.feedback)
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["assistant-0000"].feedback, self.feedback)
+
+    def test_message_not_found(self):
+        for conversation_id, storage_mode, threshold in (
+            ("map", "message_map", 300 * 1024),
+            ("segmented", "message_map", 100),
+            ("item", "message_item", 300 * 1024),
+        ):
+            conversation = create_test_conversation(turns=1)
+            conversation.id = conversation_id
+            store_conversation(
+                "user",
+                conversation,
+                threshold=threshold,
+                storage_mode=storage_mode,  # type: ignore[arg-type]
+            )
+            with self.assertRaises(RecordNotFoundError):
+                update_feedback("user", conversation_id, "unknown", self.feedback)
+
+            item = self.table.items[("user", f"user#CONV#{conversation_id}")]
+            self.assertEqual(item["Feedback"], {})
+
+            update_feedback("user", conversation_id, "assistant-0000", self.feedback)
+            found = find_conversation_by_id("user", conversation_id)
+            self.assertEqual(
+                found.message_map["assistant-0000"].feedback, self.feedback
+            )
+
+    def test_conversation_not_found(self):
+        with self.assertRaises(RecordNotFoundError):
+            update_feedback("user", "1", "assistant-0000", self.feedback)
+
+        self.assertEqual(len(self.table.items), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import json
+import logging
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    LARGE_MESSAGE_LAYOUT_SEGMENTED,
+    append_conversation_messages,
+    delete_conversation_by_id,
+    delete_conversation_by_user_id,
+    find_conversation_branch_by_id,
+    find_conversation_by_id,
+    store_conversation,
+)
+from app.repositories.models.conversation import MessageModel, TextContentModel
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import (
+    LARGE_MESSAGE_BUCKET,
+    InMemoryRepositoryTestCase,
+)
+
+logger = logging.getLogger(__name__)
+
+# Small enough that the conversations below are stored on the segmented S3 layout
+THRESHOLD = 1024
+
+
+def _create_message(parent: str, create_time: float, body: str) -> MessageModel:
+    return MessageModel(
+        role="user",
+        content=[TextContentModel(content_type="text", body=body)],
+        model="claude-v3.5-sonnet",
+        children=[],
+        parent=parent,
+        create_time=create_time,
+        feedback=None,
+        used_chunks=None,
+        thinking_log=None,
+    )
+
+
+class TestLargeConversation(InMemoryRepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.conversation = create_test_conversation(turns=20)
+        store_conversation(
+            "user", self.conversation, threshold=THRESHOLD, storage_mode="message_map"
+        )
+
+    def test_stored_as_segments(self):
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertTrue(item["IsLargeMessage"])
+        self.assertEqual(item["LargeMessageLayout"], LARGE_MESSAGE_LAYOUT_SEGMENTED)
+        self.assertEqual(item["LargeMessagePath"], "user/1/messages/")
+        self.assertEqual(
+            set(item["MessageIndex"].keys()), set(self.conversation.message_map.keys())
+        )
+        self.assertEqual(len(self.s3.objects), len(self.conversation.message_map))
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map, self.conversation.message_map)
+
+    def test_find_branch(self):
+        # Fork the conversation at `user-0005`
+        self.conversation.message_map["user-0005"].children.append("fork")
+        self.conversation.message_map["fork"] = _create_message(
+            "user-0005", 1627984879.9 + 1000, "Fork"
+        )
+        store_conversation(
+            "user", self.conversation, threshold=THRESHOLD, storage_mode="message_map"
+        )
+        self.s3.reset_metrics()
+
+        found = find_conversation_branch_by_id("user", "1", "fork")
+        self.assertEqual(
+            list(found.message_map.keys()),
+            ["fork", "user-0005"]
+            + [
+                f"{role}-{index:04}"
+                for index in range(4, -1, -1)
+                for role in ("assistant", "user")
+            ]
+            + ["system"],
+        )
+        self.assertEqual(self.s3.calls["get_object"], len(found.message_map))
+        # Children include the messages not loaded
+        self.assertEqual(
+            found.message_map["user-0005"].children, ["assistant-0005", "fork"]
+        )
+
+        # Last message by default
+        found = find_conversation_branch_by_id("user", "1")
+        self.assertIn("assistant-0019", found.message_map)
+        self.assertNotIn("fork", found.message_map)
+
+    def test_append(self):
+        conversation = find_conversation_branch_by_id("user", "1", "assistant-0019")
+        conversation.message_map["assistant-0019"].children.append("user-0020")
+        conversation.message_map["user-0020"] = _create_message(
+            "assistant-0019", 1627984879.9 + 1000, "Question"
+        )
+        conversation.last_message_id = "user-0020"
+        self.s3.reset_metrics()
+        self.table.reset_metrics()
+
+        append_conversation_messages(
+            "user",
+            conversation,
+            message_ids=["user-0020"],
+            deleted_message_ids=["assistant-0019"],
+            storage_mode="message_map",
+        )
+        self.assertEqual(self.s3.calls["put_object"], 1)
+        self.assertEqual(self.table.calls, {"update_item": 1})
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.last_message_id, "user-0020")
+        self.assertNotIn("assistant-0019", found.message_map)
+        self.assertEqual(found.message_map["user-0019"].children, [])
+        self.assertEqual(found.message_map["user-0020"].content[0].body, "Question")
+        self.assertEqual(len(self.s3.objects), len(found.message_map))
+
+    def test_append_as_message_items(self):
+        # Migrating from the segmented layout loads the messages of the other branches
+        conversation = find_conversation_branch_by_id("user", "1", "user-0003")
+        conversation.message_map["user-0003"].children.append("fork")
+        conversation.message_map["fork"] = _create_message(
+            "user-0003", 1627984879.9 + 1000, "Fork"
+        )
+        append_conversation_messages(
+            "user", conversation, message_ids=["fork"], storage_mode="message_item"
+        )
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(len(found.message_map), len(self.conversation.message_map) + 1)
+        self.assertEqual(len(self.s3.objects), 0)
+
+    def test_store_removes_stale_objects(self):
+        del self.conversation.message_map["assistant-0019"]
+        self.conversation.message_map["user-0019"].children = []
+        store_conversation(
+            "user", self.conversation, threshold=THRESHOLD, storage_mode="message_map"
+        )
+        self.assertEqual(len(self.s3.objects), len(self.conversation.message_map))
+
+    def test_legacy_layout(self):
+        # The message map stored as a single object before the segmented layout
+        message_map = {
+            k: v.model_dump(by_alias=True)
+            for k, v in self.conversation.message_map.items()
+        }
+        self.s3.objects.clear()
+        self.s3.put_object(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Key="user/1/message_map.json",
+            Body=json.dumps(message_map),
+        )
+        item = self.table.items[("user", "user#CONV#1")]
+        item["LargeMessagePath"] = "user/1/message_map.json"
+        del item["LargeMessageLayout"]
+        del item["MessageIndex"]
+
+        found = find_conversation_branch_by_id("user", "1", "user-0003")
+        self.assertEqual(found.message_map, self.conversation.message_map)
+
+        store_conversation(
+            "user", found, threshold=THRESHOLD, storage_mode="message_map"
+        )
+        self.assertNotIn(
+            (LARGE_MESSAGE_BUCKET, "user/1/message_map.json"), self.s3.objects
+        )
+        self.assertEqual(len(self.s3.objects), len(self.conversation.message_map))
+
+    def test_delete(self):
+        delete_conversation_by_id("user", "1")
+        self.assertEqual(len(self.s3.objects), 0)
+
+        store_conversation(
+            "user", self.conversation, threshold=THRESHOLD, storage_mode="message_map"
+        )
+        delete_conversation_by_user_id("user")
+        self.assertEqual(len(self.s3.objects), 0)
+
+
+class TestLargeConversationBenchmark(InMemoryRepositoryTestCase):
+    """Compare S3 reads to continue the conversation from its last message."""
+
+    def test_benchmark(self):
+        for turns in (10, 100, 500):
+            conversation = create_test_conversation(id=str(turns), turns=turns)
+            # Fork at every turn, so that the branch is a fraction of the conversation
+            for index in range(turns):
+                fork_id = f"fork-{index:04}"
+                conversation.message_map[fork_id] = _create_message(
+                    f"user-{index:04}", 1627984879.9 + 10000 + index, "Retried"
+                )
+                conversation.message_map[f"user-{index:04}"].children.append(fork_id)
+
+            store_conversation(
+                "user", conversation, threshold=THRESHOLD, storage_mode="message_map"
+            )
+
+            results = {}
+            for name, find in (
+                ("full", lambda: find_conversation_by_id("user", str(turns))),
+                (
+                    "branch",
+                    lambda: find_conversation_branch_by_id(
+                        "user", str(turns), "fork-0000"
+                    ),
+                ),
+            ):
+                self.s3.reset_metrics()
+                start = time.perf_counter()
+                found = find()
+                results[name] = (
+                    len(found.message_map),
+                    self.s3.calls["get_object"],
+                    self.s3.read_bytes,
+                    (time.perf_counter() - start) * 1000,
+                )
+
+            logger.info(
+                f"{len(conversation.message_map)} messages: "
+                + ", ".join(
+                    f"{name} {loaded} messages, {gets} GETs, "
+                    f"{read_bytes / 1024:.1f}KB in {elapsed:.1f}ms"
+                    for name, (loaded, gets, read_bytes, elapsed) in results.items()
+                )
+            )
+            # The first turn is read regardless of the length of the conversation
+            self.assertEqual(results["branch"][1], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import base64
+import json
+import sys
+import unittest
+from decimal import Decimal as decimal
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    find_conversation_by_user_id,
+    find_conversation_page_by_user_id,
+    store_conversation,
+)
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+
+class TestConversationList(InMemoryRepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+
+        for index in range(5):
+            store_conversation(
+                "user",
+                create_test_conversation(id=f"{index:02}", turns=2),
+                storage_mode="message_map",
+            )
+
+    def test_metadata_attributes(self):
+        item = self.table.items[("user", "user#CONV#00")]
+        self.assertEqual(item["Model"], "claude-v3.5-sonnet")
+        self.assertEqual(item["Title"], "Test Conversation")
+
+    def test_pagination(self):
+        conversations, next_token = find_conversation_page_by_user_id("user", limit=2)
+        self.assertEqual([c.id for c in conversations], ["04", "03"])
+        self.assertIsNotNone(next_token)
+
+        conversations, next_token = find_conversation_page_by_user_id(
+            "user", limit=2, next_token=next_token
+        )
+        self.assertEqual([c.id for c in conversations], ["02", "01"])
+
+        conversations, next_token = find_conversation_page_by_user_id(
+            "user", limit=2, next_token=next_token
+        )
+        self.assertEqual([c.id for c in conversations], ["00"])
+        self.assertIsNone(next_token)
+
+    def test_invalid_next_token(self):
+        _, next_token = find_conversation_page_by_user_id("user", limit=2)
+        assert next_token is not None
+        other_user_token = base64.b64encode(
+            json.dumps({"PK": "other", "SK": "other#CONV#00"}).encode("utf-8")
+        ).decode("utf-8")
+        for token in ["not a token", next_token[:-4], other_user_token]:
+            with self.subTest(token=token):
+                with self.assertRaises(ValueError):
+                    find_conversation_page_by_user_id("user", limit=2, next_token=token)
+
+    def test_all_pages(self):
+        with patch(
+            "app.repositories.conversation.find_conversation_page_by_user_id"
+        ) as find_page:
+            find_page.side_effect = [
+                (["a"], "token"),
+                (["b"], None),
+            ]
+            self.assertEqual(find_conversation_by_user_id("user"), ["a", "b"])
+
+        self.assertEqual(len(find_conversation_by_user_id("user")), 5)
+
+    def test_max_query_count(self):
+        with patch(
+            "app.repositories.conversation.CONVERSATION_LIST_PAGE_SIZE", 1
+        ), patch("app.repositories.conversation.MAX_QUERY_COUNT", 3):
+            conversations = find_conversation_by_user_id("user")
+
+        # The newest ones
+        self.assertEqual([c.id for c in conversations], ["04", "03", "02"])
+        self.assertEqual(self.table.calls["query"], 3)
+
+    def test_item_without_model(self):
+        # Items stored before `Model` attribute was introduced
+        self.table.put_item(
+            Item={
+                "PK": "user",
+                "SK": "user#CONV#legacy",
+                "Title": "Legacy",
+                "CreateTime": decimal("1627984879.9"),
+                "TotalPrice": decimal("0"),
+                "LastMessageId": "",
+                "ShouldContinue": False,
+                "IsLargeMessage": False,
+                "MessageMap": json.dumps({"system": {"model": "claude-v3-haiku"}}),
+            }
+        )
+
+        for _ in range(2):
+            self.table.reset_metrics()
+            conversations = find_conversation_by_user_id("user")
+            legacy = next(c for c in conversations if c.id == "legacy")
+            self.assertEqual(legacy.model, "claude-v3-haiku")
+
+        # Stored to `Model` on the first read
+        self.assertEqual(
+            self.table.items[("user", "user#CONV#legacy")]["Model"], "claude-v3-haiku"
+        )
+        self.assertEqual(dict(self.table.calls), {"query": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+import logging
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    RecordNotFoundError,
+    append_conversation_messages,
+    delete_conversation_by_id,
+    delete_conversation_by_user_id,
+    find_conversation_by_id,
+    find_conversation_by_user_id,
+    store_conversation,
+    update_feedback,
+)
+from app.repositories.models.conversation import (
+    ConversationModel,
+    FeedbackModel,
+    MessageModel,
+    TextContentModel,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+logger = logging.getLogger(__name__)
+
+
+def _create_message(
+    role: str, body: str, parent: str | None, create_time: float
+) -> MessageModel:
+    return MessageModel(
+        role=role,
+        content=[TextContentModel(content_type="text", body=body)],
+        model="claude-v3.5-sonnet",
+        children=[],
+        parent=parent,
+        create_time=create_time,
+        feedback=None,
+        used_chunks=None,
+        thinking_log=None,
+    )
+
+
+def _create_conversation() -> ConversationModel:
+    return ConversationModel(
+        id="1",
+        create_time=1627984879.9,
+        title="Test Conversation",
+        total_price=0,
+        message_map={
+            "system": _create_message("system", "", None, 1627984879.9),
+        },
+        last_message_id="system",
+        bot_id=None,
+        should_continue=False,
+    )
+
+
+def _append_turn(conversation: ConversationModel, index: int) -> list[str]:
+    """Append a pair of user / assistant messages like `chat` does."""
+    user_msg_id = f"user-{index:04}"
+    assistant_msg_id = f"assistant-{index:04}"
+    create_time = 1627984880.0 + index
+
+    conversation.message_map[user_msg_id] = _create_message(
+        "user", f"Question {index} " * 100, conversation.last_message_id, create_time
+    )
+    conversation.message_map[conversation.last_message_id].children.append(user_msg_id)
+    conversation.message_map[assistant_msg_id] = _create_message(
+        "assistant", f"Answer {index} " * 200, user_msg_id, create_time
+    )
+    conversation.message_map[user_msg_id].children.append(assistant_msg_id)
+    conversation.last_message_id = assistant_msg_id
+    conversation.total_price += 0.01
+
+    return [user_msg_id, assistant_msg_id]
+
+
+class TestConversationMessageItem(InMemoryRepositoryTestCase):
+
+    def test_append_and_find(self):
+        conversation = _create_conversation()
+        for index in range(3):
+            message_ids = _append_turn(conversation, index)
+            append_conversation_messages(
+                "user", conversation, message_ids, storage_mode="message_item"
+            )
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.last_message_id, "assistant-0002")
+        self.assertAlmostEqual(found.total_price, 0.03)
+        self.assertEqual(
+            set(found.message_map.keys()), set(conversation.message_map.keys())
+        )
+        for message_id, message in conversation.message_map.items():
+            self.assertEqual(found.message_map[message_id], message)
+
+        # Messages are not listed as conversations
+        conversations = find_conversation_by_user_id("user")
+        self.assertEqual(len(conversations), 1)
+        self.assertEqual(conversations[0].model, "claude-v3.5-sonnet")
+
+    def test_messages_are_read_consistently(self):
+        conversation = _create_conversation()
+        for index in range(3):
+            message_ids = _append_turn(conversation, index)
+            append_conversation_messages(
+                "user", conversation, message_ids, storage_mode="message_item"
+            )
+        self.conversation_cache.clear()
+        self.table.reset_metrics()
+
+        # Read the messages in pages
+        with patch.object(self.table, "PAGE_SIZE", 1024):
+            find_conversation_by_id("user", "1")
+
+        self.assertGreater(self.table.calls["query"], 1)
+        self.assertEqual(self.table.consistent_calls, self.table.calls)
+
+    def test_siblings_are_restored_in_creation_order(self):
+        conversation = _create_conversation()
+        message_ids = _append_turn(conversation, 0)
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_item"
+        )
+
+        # Regenerate the answer
+        conversation.message_map["assistant-retry"] = _create_message(
+            "assistant", "Retry", "user-0000", 1627984890.0
+        )
+        conversation.message_map["user-0000"].children.append("assistant-retry")
+        conversation.last_message_id = "assistant-retry"
+        append_conversation_messages(
+            "user", conversation, ["assistant-retry"], storage_mode="message_item"
+        )
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(
+            found.message_map["user-0000"].children,
+            ["assistant-0000", "assistant-retry"],
+        )
+        self.assertEqual(found.last_message_id, "assistant-retry")
+
+    def test_deleted_messages(self):
+        conversation = _create_conversation()
+        message_ids = _append_turn(conversation, 0)
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_item"
+        )
+
+        # Replace the answer like continuing generation with agent does
+        conversation.message_map["user-0000"].children.remove("assistant-0000")
+        del conversation.message_map["assistant-0000"]
+        conversation.message_map["assistant-new"] = _create_message(
+            "assistant", "New", "user-0000", 1627984890.0
+        )
+        conversation.message_map["user-0000"].children.append("assistant-new")
+        conversation.last_message_id = "assistant-new"
+        append_conversation_messages(
+            "user",
+            conversation,
+            ["assistant-new"],
+            deleted_message_ids=["assistant-0000"],
+            storage_mode="message_item",
+        )
+
+        found = find_conversation_by_id("user", "1")
+        self.assertNotIn("assistant-0000", found.message_map)
+        self.assertEqual(found.message_map["user-0000"].children, ["assistant-new"])
+
+    def test_large_message(self):
+        conversation = _create_conversation()
+        message_ids = _append_turn(conversation, 0)
+        # e.g. a large attachment, which does not fit in an item
+        conversation.message_map["user-0000"].content[0].body = "x" * 500 * 1024
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_item"
+        )
+
+        item = self.table.items[("user", "user#CONV_MESSAGE#1#user-0000")]
+        self.assertNotIn("Message", item)
+        self.assertEqual(len(self.s3.objects), 1)
+
+        self.conversation_cache.clear()
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(
+            found.message_map["user-0000"], conversation.message_map["user-0000"]
+        )
+        self.assertEqual(found.message_map["user-0000"].children, ["assistant-0000"])
+
+        # Replace the large message
+        conversation.message_map["system"].children.remove("user-0000")
+        del conversation.message_map["user-0000"]
+        del conversation.message_map["assistant-0000"]
+        conversation.last_message_id = "system"
+        message_ids = _append_turn(conversation, 1)
+        append_conversation_messages(
+            "user",
+            conversation,
+            message_ids,
+            deleted_message_ids=["user-0000", "assistant-0000"],
+            storage_mode="message_item",
+        )
+        self.assertEqual(len(self.s3.objects), 0)
+
+    def test_large_message_is_deleted(self):
+        conversation = _create_conversation()
+        _append_turn(conversation, 0)
+        conversation.message_map["user-0000"].content[0].body = "x" * 500 * 1024
+        store_conversation("user", conversation, storage_mode="message_item")
+        self.assertEqual(len(self.s3.objects), 1)
+
+        delete_conversation_by_id("user", "1")
+        self.assertEqual(len(self.s3.objects), 0)
+        self.assertEqual(len(self.table.items), 0)
+
+    def test_migrate_from_message_map(self):
+        conversation = _create_conversation()
+        _append_turn(conversation, 0)
+        store_conversation(
+            "user", conversation, storage_mode="message_map", threshold=1
+        )
+        self.assertEqual(len(self.s3.objects), len(conversation.message_map))
+
+        message_ids = _append_turn(conversation, 1)
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_item"
+        )
+
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertEqual(item["MessageStorage"], "ITEM")
+        self.assertNotIn("MessageMap", item)
+        # The messages stored in S3 are removed
+        self.assertEqual(len(self.s3.objects), 0)
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(len(found.message_map), 5)
+        self.assertEqual(found.message_map["user-0001"].parent, "assistant-0000")
+
+    def test_migrate_to_message_map(self):
+        conversation = _create_conversation()
+        _append_turn(conversation, 0)
+        conversation.message_map["user-0000"].content[0].body = "x" * 500 * 1024
+        store_conversation("user", conversation, storage_mode="message_item")
+        self.assertEqual(len(self.s3.objects), 1)
+
+        # The mode is switched back
+        message_ids = _append_turn(conversation, 1)
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_map"
+        )
+
+        # The message items and their objects in S3 are removed
+        self.assertEqual(list(self.table.items), [("user", "user#CONV#1")])
+        self.assertEqual(len(self.s3.objects), 0)
+
+        self.conversation_cache.clear()
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(len(found.message_map), 5)
+        self.assertEqual(
+            found.message_map["user-0000"], conversation.message_map["user-0000"]
+        )
+
+    def test_update_feedback(self):
+        conversation = _create_conversation()
+        message_ids = _append_turn(conversation, 0)
+        append_conversation_messages(
+            "user", conversation, message_ids, storage_mode="message_item"
+        )
+        self.table.reset_metrics()
+
+        update_feedback(
+            "user",
+            "1",
+            "assistant-0000",
+            FeedbackModel(thumbs_up=True, category="Good", comment="Nice"),
+        )
+        # Messages are neither read nor rewritten, but the key of the message is read
+        self.assertEqual(self.table.calls, {"get_item": 2, "update_item": 1})
+
+        found = find_conversation_by_id("user", "1")
+        feedback = found.message_map["assistant-0000"].feedback
+        assert feedback is not None
+        self.assertTrue(feedback.thumbs_up)
+        self.assertEqual(feedback.comment, "Nice")
+
+    def test_delete(self):
+        for conversation_id in ["1", "2"]:
+            conversation = _create_conversation()
+            conversation.id = conversation_id
+            message_ids = _append_turn(conversation, 0)
+            append_conversation_messages(
+                "user", conversation, message_ids, storage_mode="message_item"
+            )
+
+        delete_conversation_by_id("user", "1")
+        with self.assertRaises(RecordNotFoundError):
+            find_conversation_by_id("user", "1")
+        self.assertFalse(
+            any("#CONV_MESSAGE#1#" in sort_key for _, sort_key in self.table.items)
+        )
+        self.assertEqual(len(find_conversation_by_id("user", "2").message_map), 3)
+
+        # Messages left by the conversation stored on `message_item` layout before
+        self.table.items[("user", "user#CONV_MESSAGE#3#system")] = {
+            "PK": "user",
+            "SK": "user#CONV_MESSAGE#3#system",
+        }
+        conversation = _create_conversation()
+        conversation.id = "3"
+        store_conversation("user", conversation, storage_mode="message_map")
+        delete_conversation_by_id("user", "3")
+        self.assertNotIn(("user", "user#CONV_MESSAGE#3#system"), self.table.items)
+
+        delete_conversation_by_user_id("user")
+        self.assertEqual(len(self.table.items), 0)
+
+
+class TestConversationWriteCost(InMemoryRepositoryTestCase):
+    """Measure bytes written to DynamoDB / S3 per chat turn on each layout."""
+
+    TURNS = 30
+
+    def _measure(self, storage_mode) -> list[int]:
+        self.table.items.clear()
+        self.conversation_cache.clear()
+        written_bytes = []
+        conversation = _create_conversation()
+        for index in range(self.TURNS):
+            message_ids = _append_turn(conversation, index)
+            self.table.reset_metrics()
+            self.s3.reset_metrics()
+            append_conversation_messages(
+                "user", conversation, message_ids, storage_mode=storage_mode
+            )
+            written_bytes.append(self.table.written_bytes + self.s3.written_bytes)
+
+        return written_bytes
+
+    def test_write_cost_per_turn(self):
+        message_map = self._measure("message_map")
+        message_item = self._measure("message_item")
+        logger.info(
+            f"\nBytes written per turn (turn 2 -> turn {self.TURNS}): "
+            f"message_map {message_map[1]} -> {message_map[-1]}, "
+            f"message_item {message_item[1]} -> {message_item[-1]}"
+        )
+
+        # Whole conversation is rewritten on `message_map` layout
+        self.assertGreater(message_map[-1], message_map[1] * 10)
+        # Only new messages are written on `message_item` layout
+        self.assertLess(message_item[-1], message_item[1] * 1.1)
+        self.assertLess(message_item[-1], message_map[-1] / 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
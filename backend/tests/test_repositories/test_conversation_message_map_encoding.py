@@ -0,0 +1,196 @@
+import json
+import logging
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    THRESHOLD_LARGE_MESSAGE,
+    _decode_message_map,
+    _encode_message_map,
+    _serialize_message_map,
+    find_conversation_by_id,
+    find_conversation_by_user_id,
+    store_conversation,
+    update_feedback,
+)
+from app.repositories.models.conversation import FeedbackModel
+from boto3.dynamodb.types import Binary
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+logger = logging.getLogger(__name__)
+
+
+class TestMessageMapEncoding(InMemoryRepositoryTestCase):
+
+    def test_encode_and_decode(self):
+        conversation = create_test_conversation(turns=3, tool_calls=1)
+        message_map = {
+            k: v.model_dump(by_alias=True) for k, v in conversation.message_map.items()
+        }
+        encoded = _encode_message_map(_serialize_message_map(conversation.message_map))
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(encoded[0], 1)
+        self.assertEqual(_decode_message_map(encoded), message_map)
+        # boto3 returns binary attributes as `Binary`
+        self.assertEqual(_decode_message_map(Binary(encoded)), message_map)
+        # Backward compatibility with plain JSON items
+        self.assertEqual(_decode_message_map(json.dumps(message_map)), message_map)
+
+        with self.assertRaises(ValueError):
+            _decode_message_map(b"\xff" + encoded[1:])
+
+    def test_small_conversation_is_stored_as_json(self):
+        conversation = create_test_conversation(turns=2)
+        store_conversation("user", conversation, storage_mode="message_map")
+
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertIsInstance(item["MessageMap"], str)
+        self.assertFalse(item["IsLargeMessage"])
+
+    def test_large_conversation_is_compressed(self):
+        conversation = create_test_conversation(turns=60, tool_calls=2)
+        store_conversation("user", conversation, storage_mode="message_map")
+
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertIsInstance(item["MessageMap"], bytes)
+        self.assertLessEqual(len(item["MessageMap"]), THRESHOLD_LARGE_MESSAGE)
+        self.assertFalse(item["IsLargeMessage"])
+        # Not offloaded to S3
+        self.assertEqual(self.s3.calls["put_object"], 0)
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map, conversation.message_map)
+        self.assertEqual(self.s3.calls["get_object"], 0)
+
+        conversations = find_conversation_by_user_id("user")
+        self.assertEqual(conversations[0].model, "claude-v3.5-sonnet")
+
+        update_feedback(
+            "user",
+            "1",
+            "assistant-0001",
+            FeedbackModel(thumbs_up=False, category="Other", comment="Bad"),
+        )
+        found = find_conversation_by_id("user", "1")
+        feedback = found.message_map["assistant-0001"].feedback
+        assert feedback is not None
+        self.assertEqual(feedback.comment, "Bad")
+
+    def test_compressed_size_exceeds_threshold(self):
+        conversation = create_test_conversation(turns=3)
+        store_conversation(
+            "user", conversation, threshold=100, storage_mode="message_map"
+        )
+
+        item = self.table.items[("user", "user#CONV#1")]
+        self.assertTrue(item["IsLargeMessage"])
+        # Stored per message
+        self.assertEqual(self.s3.calls["put_object"], len(conversation.message_map))
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map, conversation.message_map)
+
+
+class TestMessageMapEncodingBenchmark(unittest.TestCase):
+    """Compare size and time of plain JSON and the compressed encoding."""
+
+    ROUNDS = 5
+
+    def _measure(self, func) -> float:
+        start = time.perf_counter()
+        for _ in range(self.ROUNDS):
+            func()
+        return (time.perf_counter() - start) / self.ROUNDS * 1000
+
+    def test_benchmark(self):
+        cases = {
+            "20 turns": create_test_conversation(turns=20),
+            "100 turns": create_test_conversation(turns=100),
+            "20 turns with thinking log": create_test_conversation(
+                turns=20, tool_calls=2
+            ),
+            "60 turns with thinking log": create_test_conversation(
+                turns=60, tool_calls=2
+            ),
+        }
+
+        for name, conversation in cases.items():
+            message_map = {
+                k: v.model_dump(by_alias=True)
+                for k, v in conversation.message_map.items()
+            }
+            plain = json.dumps(message_map)
+            message_map_json = _serialize_message_map(conversation.message_map)
+            encoded = _encode_message_map(message_map_json)
+
+            logger.info(
+                f"{name}: "
+                f"json {len(plain.encode('utf-8')) / 1024:.1f}KB "
+                f"(encode {self._measure(lambda: json.dumps(message_map)):.2f}ms, "
+                f"decode {self._measure(lambda: json.loads(plain)):.2f}ms), "
+                f"compressed {len(encoded) / 1024:.1f}KB "
+                f"(encode {self._measure(lambda: _encode_message_map(message_map_json)):.2f}ms, "
+                f"decode {self._measure(lambda: _decode_message_map(encoded)):.2f}ms)"
+            )
+            self.assertLess(len(encoded), len(plain.encode("utf-8")) / 2)
+
+
+class TestMessageMapSerializationBenchmark(unittest.TestCase):
+    """Compare dumping each message to dict then `json.dumps` twice (for size check and storing),
+    with serializing the whole message map to bytes once.
+    """
+
+    ROUNDS = 5
+
+    def _measure(self, func) -> float:
+        start = time.perf_counter()
+        for _ in range(self.ROUNDS):
+            func()
+        return (time.perf_counter() - start) / self.ROUNDS * 1000
+
+    def test_benchmark(self):
+        cases = {
+            "20 turns with thinking log": create_test_conversation(
+                turns=20, tool_calls=2
+            ),
+            "10 turns with 200KB images": create_test_conversation(
+                turns=10, image_size=200 * 1024
+            ),
+        }
+
+        for name, conversation in cases.items():
+
+            def dump_twice():
+                message_map = {
+                    k: v.model_dump(by_alias=True)
+                    for k, v in conversation.message_map.items()
+                }
+                len(json.dumps(message_map).encode("utf-8"))
+                json.dumps(message_map)
+
+            def serialize_once():
+                len(_serialize_message_map(conversation.message_map))
+
+            dump_twice_time = self._measure(dump_twice)
+            serialize_once_time = self._measure(serialize_once)
+            logger.info(
+                f"{name}: model_dump + json.dumps x2 {dump_twice_time:.2f}ms, "
+                f"single pass {serialize_once_time:.2f}ms"
+            )
+            self.assertEqual(
+                json.loads(_serialize_message_map(conversation.message_map)),
+                {
+                    k: v.model_dump(by_alias=True)
+                    for k, v in conversation.message_map.items()
+                },
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Compare latency of a strongly consistent `get_item` with a `SKIndex` GSI query.
+Requires a local DynamoDB, e.g.:
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+    DDB_ENDPOINT_URL=http://localhost:8000 python -m pytest --log-cli-level=INFO tests/test_repositories/test_point_read_latency.py
+"""
+
+import logging
+import os
+import statistics
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+from app.repositories.common import _get_aws_resource, compose_conv_id
+from boto3.dynamodb.conditions import Key
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "PointReadLatencyTest"
+ROUNDS = 200
+
+
+@unittest.skipUnless(os.environ.get("DDB_ENDPOINT_URL"), "DDB_ENDPOINT_URL is not set")
+class TestPointReadLatency(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = _get_aws_resource("dynamodb")
+        self.table = self.dynamodb.create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": "SKIndex",
+                    "KeySchema": [{"AttributeName": "SK", "KeyType": "HASH"}],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.table.wait_until_exists()
+
+        for index in range(100):
+            self.table.put_item(
+                Item={
+                    "PK": "user",
+                    "SK": compose_conv_id("user", f"{index:03}"),
+                    "Title": "Test Conversation",
+                    "MessageMap": "x" * 10 * 1024,
+                }
+            )
+
+    def tearDown(self):
+        self.table.delete()
+
+    def _measure(self, func) -> list[float]:
+        # Warm up the connection
+        func()
+
+        latencies = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            func()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        return latencies
+
+    def test_latency(self):
+        sort_key = compose_conv_id("user", "050")
+
+        def get_item():
+            response = self.table.get_item(
+                Key={"PK": "user", "SK": sort_key}, ConsistentRead=True
+            )
+            assert "Item" in response
+
+        def query_gsi():
+            response = self.table.query(
+                IndexName="SKIndex",
+                KeyConditionExpression=Key("SK").eq(sort_key),
+            )
+            assert len(response["Items"]) == 1
+
+        for name, func in [("get_item", get_item), ("SKIndex query", query_gsi)]:
+            latencies = sorted(self._measure(func))
+            logger.info(
+                f"{name}: p50 {statistics.median(latencies):.2f}ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,424 @@
+import json
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+sys.path.append(".")
+
+from app.repositories.common import (
+    RecordNotFoundError,
+    ScopedResourceCache,
+    VersionedCache,
+    _get_aws_resource,
+    _get_table_client,
+    _get_table_public_client,
+)
+from app.repositories.conversation import (
+    append_conversation_messages,
+    change_conversation_title,
+    delete_conversation_by_id,
+    find_conversation_by_id,
+    prefetch_conversation_by_id,
+    store_conversation,
+    update_feedback,
+)
+from app.repositories.custom_bot import (
+    find_private_bot_by_id,
+    store_bot,
+    update_bot_last_used_time,
+    update_bot_pin_status,
+)
+from app.repositories.models.conversation import FeedbackModel, MessageModel
+from app.repositories.result_cache import ResultCache, SharedResultCacheTable
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.in_memory_aws import InMemoryDynamoDBResource
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+
+class TestVersionedCache(unittest.TestCase):
+    def test_lru(self):
+        cache: VersionedCache[str] = VersionedCache("Test", max_entries=2, ttl=60)
+        cache.put("a", 1, "A")
+        cache.put("b", 1, "B")
+        # `a` is used more recently than `b`
+        self.assertEqual(cache.get("a"), (1, "A"))
+        cache.put("c", 1, "C")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), (1, "A"))
+        self.assertEqual(cache.get("c"), (1, "C"))
+
+    def test_ttl(self):
+        cache: VersionedCache[str] = VersionedCache("Test", max_entries=2, ttl=0.01)
+        cache.put("a", 1, "A")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_disabled(self):
+        cache: VersionedCache[str] = VersionedCache("Test", enabled=False)
+        cache.put("a", 1, "A")
+        self.assertIsNone(cache.get("a"))
+
+
+class _DictTableClient:
+    """Stand-in for the DynamoDB client on the shared result cache table."""
+
+    def __init__(self):
+        self.items: dict[str, dict] = {}
+        self.failing = False
+
+    def get_item(self, TableName: str, Key: dict):
+        if self.failing:
+            raise Exception("Service unavailable")
+        item = self.items.get(Key["CacheKey"]["S"])
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, TableName: str, Item: dict):
+        if self.failing:
+            raise Exception("Service unavailable")
+        self.items[Item["CacheKey"]["S"]] = Item
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.table = _DictTableClient()
+        self.shared = SharedResultCacheTable("ResultCacheTable", client=self.table)
+
+    def test_local(self):
+        cache: ResultCache[list] = ResultCache("Test", ttl=60, max_entries=2)
+        cache.shared = None
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", ["A"])
+        cache.put("b", ["B"])
+        self.assertEqual(cache.get("a"), ["A"])
+        cache.put("c", ["C"])
+
+        # `b` is evicted as the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_ttl(self):
+        cache: ResultCache[list] = ResultCache(
+            "Test", ttl=0.01, max_entries=2, shared=self.shared
+        )
+        cache.put("a", ["A"])
+        time.sleep(0.02)
+        self.assertIsNone(cache._get_local("a"))
+        # Expired in the shared table in the next second
+        self.table.items["Test#a"]["expire"] = {"N": str(int(time.time()) - 1)}
+        self.assertIsNone(cache.get("a"))
+
+    def test_shared(self):
+        writer: ResultCache[list] = ResultCache(
+            "Test", ttl=60, max_entries=2, shared=self.shared
+        )
+        writer.put("a", ["A"], cost=0.5)
+        self.assertEqual(json.loads(self.table.items["Test#a"]["Value"]["S"]), ["A"])
+
+        # Cached by another container
+        reader: ResultCache[list] = ResultCache(
+            "Test", ttl=60, max_entries=2, shared=self.shared
+        )
+        self.assertEqual(reader.get("a"), ["A"])
+        self.table.items.clear()
+        self.assertEqual(reader.get("a"), ["A"])
+        # Saved the time taken by the writer, less the time to find it
+        self.assertEqual(reader.stats()["hits"], 2)
+        self.assertAlmostEqual(reader.stats()["saved_seconds"], 1.0, delta=0.01)
+
+    def test_shared_failure(self):
+        cache: ResultCache[list] = ResultCache(
+            "Test", ttl=60, max_entries=2, shared=self.shared
+        )
+        self.table.failing = True
+        cache.put("a", ["A"])
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+
+    def test_disabled(self):
+        cache: ResultCache[list] = ResultCache(
+            "Test", ttl=60, max_entries=2, shared=self.shared, enabled=False
+        )
+        cache.put("a", ["A"])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(self.table.items, {})
+
+
+class TestConversationCache(InMemoryRepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = self.conversation_cache
+        self.conversation = create_test_conversation(turns=20, tool_calls=1)
+        store_conversation("user", self.conversation, storage_mode="message_map")
+        self.cache.clear()
+
+    def test_hit(self):
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+        self.table.reset_metrics()
+        cached = find_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(cached.message_map, found.message_map)
+        self.assertEqual(self.table.calls, {"get_item": 1})
+
+        # Returned conversations are copies
+        cached.message_map["user-0000"].content = []
+        self.assertEqual(
+            find_conversation_by_id("user", "1").message_map,
+            self.conversation.message_map,
+        )
+
+    def test_written_by_this_container(self):
+        conversation = find_conversation_by_id("user", "1")
+        conversation.message_map["assistant-0019"].children.append("user-0020")
+        conversation.message_map["user-0020"] = MessageModel(
+            role="user",
+            content=conversation.message_map["user-0019"].content,
+            model="claude-v3.5-sonnet",
+            children=[],
+            parent="assistant-0019",
+            create_time=1627984879.9 + 1000,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+        conversation.last_message_id = "user-0020"
+        for storage_mode in ("message_map", "message_item"):
+            append_conversation_messages(
+                "user",
+                conversation,
+                message_ids=["user-0020"],
+                storage_mode=storage_mode,  # type: ignore[arg-type]
+            )
+
+            # The stored conversation is cached
+            found = find_conversation_by_id("user", "1")
+            self.assertEqual(found.last_message_id, "user-0020")
+            self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_updated_by_others(self):
+        find_conversation_by_id("user", "1")
+
+        # Written by another container
+        self.table.items[("user", "user#CONV#1")]["Version"] += 1
+        find_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+        update_feedback(
+            "user",
+            "1",
+            "assistant-0000",
+            FeedbackModel(thumbs_up=True, category="", comment=""),
+        )
+        found = find_conversation_by_id("user", "1")
+        self.assertIsNotNone(found.message_map["assistant-0000"].feedback)
+
+        change_conversation_title("user", "1", "New title")
+        self.assertEqual(find_conversation_by_id("user", "1").title, "New title")
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    def test_deleted(self):
+        find_conversation_by_id("user", "1")
+        # Deleted by another container
+        del self.table.items[("user", "user#CONV#1")]
+        with self.assertRaises(RecordNotFoundError):
+            find_conversation_by_id("user", "1")
+
+        store_conversation("user", self.conversation, storage_mode="message_map")
+        delete_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_written_by_two_containers(self):
+        conversation = find_conversation_by_id("user", "1")
+        # Loaded by another container at the same version
+        other_cache: VersionedCache = VersionedCache("Conversation")
+        with patch("app.repositories.conversation._conversation_cache", other_cache):
+            other = find_conversation_by_id("user", "1")
+
+        conversation.total_price = 1
+        store_conversation("user", conversation, storage_mode="message_map")
+        update_feedback(
+            "user",
+            "1",
+            "assistant-0000",
+            FeedbackModel(thumbs_up=True, category="", comment=""),
+        )
+        other.total_price = 2
+        with patch("app.repositories.conversation._conversation_cache", other_cache):
+            store_conversation("user", other, storage_mode="message_map")
+
+        # Stored on the version written by this container, not on the same version
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.total_price, 2)
+        self.assertIsNotNone(found.message_map["assistant-0000"].feedback)
+        with patch("app.repositories.conversation._conversation_cache", other_cache):
+            self.assertEqual(find_conversation_by_id("user", "1"), found)
+            self.assertEqual(other_cache.stats()["hits"], 1)
+
+    def test_large_conversation_is_not_cached(self):
+        store_conversation(
+            "user", self.conversation, threshold=1024, storage_mode="message_map"
+        )
+        find_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_prefetch(self):
+        prefetch_conversation_by_id("user", "1")
+        self.table.reset_metrics()
+        find_conversation_by_id("user", "1")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.table.calls, {"get_item": 1})
+
+    def test_large_conversation_is_not_prefetched(self):
+        store_conversation(
+            "user", self.conversation, threshold=1024, storage_mode="message_map"
+        )
+        self.s3.reset_metrics()
+        prefetch_conversation_by_id("user", "1")
+        # Messages in S3 are read by the chat
+        self.assertEqual(self.s3.calls, {})
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+class TestBotCache(InMemoryRepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = self.bot_cache
+        store_bot("user", create_test_private_bot("bot", False, "user"))
+
+    def test_hit(self):
+        bot = find_private_bot_by_id("user", "bot")
+        self.assertEqual(find_private_bot_by_id("user", "bot"), bot)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        # Used on every chat, and the cached bot is kept current
+        update_bot_last_used_time("user", "bot")
+        found = find_private_bot_by_id("user", "bot")
+        self.assertGreater(found.last_used_time, bot.last_used_time)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    def test_updated(self):
+        find_private_bot_by_id("user", "bot")
+        update_bot_pin_status("user", "bot", True)
+        self.assertTrue(find_private_bot_by_id("user", "bot").is_pinned)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_stored_again(self):
+        find_private_bot_by_id("user", "bot")
+        # Deleted and stored again with the same id by another container
+        del self.table.items[("user", "user#BOT#bot")]
+        bot = create_test_private_bot("bot", False, "user")
+        bot.title = "New title"
+        with patch("app.repositories.custom_bot._bot_cache", VersionedCache("Bot")):
+            store_bot("user", bot)
+
+        self.assertEqual(find_private_bot_by_id("user", "bot").title, "New title")
+
+
+class TestScopedResourceCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ScopedResourceCache(max_entries=2)
+        self.boto3 = MagicMock()
+        self.sts = MagicMock()
+        self.expires_in = timedelta(hours=1)
+        self.sts_latency = 0.0
+
+        def assume_role(**kwargs):
+            time.sleep(self.sts_latency)
+            return {
+                "Credentials": {
+                    "AccessKeyId": "key",
+                    "SecretAccessKey": "secret",
+                    "SessionToken": kwargs["Policy"],
+                    "Expiration": datetime.now(timezone.utc) + self.expires_in,
+                }
+            }
+
+        self.sts.assume_role.side_effect = assume_role
+        # A new client for each session
+        self.boto3.Session.side_effect = lambda **kwargs: MagicMock(
+            resource=MagicMock(
+                return_value=InMemoryDynamoDBResource(
+                    MagicMock(name=kwargs["aws_session_token"])
+                )
+            )
+        )
+        self.patchers = [
+            patch.dict(os.environ, {"AWS_EXECUTION_ENV": "AWS_Lambda_python3.11"}),
+            patch("app.repositories.common.boto3", self.boto3),
+            patch("app.repositories.common.get_client", return_value=self.sts),
+            patch("app.repositories.common._scoped_resource_cache", self.cache),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _leading_keys(self, call) -> list[str] | None:
+        statement = json.loads(call.kwargs["Policy"])["Statement"][0]
+        if "Condition" not in statement:
+            return None
+        return statement["Condition"]["ForAllValues:StringLike"]["dynamodb:LeadingKeys"]
+
+    def test_reused_per_user(self):
+        table = _get_table_client("user1")
+        self.assertIs(_get_table_client("user1"), table)
+        self.assertIsNot(_get_table_client("user2"), table)
+        self.assertIsNot(_get_table_public_client(), table)
+
+        # Row-level access control is not shared between users
+        calls = self.sts.assume_role.call_args_list
+        self.assertEqual(
+            [self._leading_keys(call) for call in calls],
+            [["user1*"], ["user2*"], None],
+        )
+        self.assertEqual(self.cache.stats()["sts_calls"], 3)
+        self.assertEqual(self.cache.stats()["sts_calls_avoided"], 1)
+
+    def test_concurrent_misses(self):
+        self.sts_latency = 0.05
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            tables = list(executor.map(_get_table_client, ["user1"] * 8))
+
+        # The role is assumed once, and the others wait for it
+        self.assertEqual(self.sts.assume_role.call_count, 1)
+        self.assertTrue(all(table is tables[0] for table in tables))
+
+    def test_resource_per_call(self):
+        resource = _get_aws_resource("dynamodb", "user1")
+        other = _get_aws_resource("dynamodb", "user1")
+        # Resources are not thread-safe, but low-level clients are
+        self.assertIsNot(other, resource)
+        self.assertIs(other.meta.client, resource.meta.client)
+
+    def test_refresh_before_expiration(self):
+        self.expires_in = timedelta(seconds=self.cache.refresh_margin - 1)
+        _get_table_client("user1")
+        _get_table_client("user1")
+        self.assertEqual(self.sts.assume_role.call_count, 2)
+
+    def test_bounded(self):
+        for user_id in ("user1", "user2", "user3"):
+            _get_table_client(user_id)
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+        # The least recently used one is evicted
+        _get_table_client("user3")
+        _get_table_client("user1")
+        self.assertEqual(self.sts.assume_role.call_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
 import base64
+import logging
 import sys
 
 sys.path.append(".")
 
+import json
+import time
 import unittest
+from unittest.mock import patch
 
 import boto3
 from app.repositories.models.conversation import (
@@ -14,11 +18,18 @@ from app.repositories.models.conversation import (
 )
 from app.repositories.models.custom_bot import GenerationParamsModel
 from app.repositories.models.custom_bot_guardrails import BedrockGuardrailsModel
-from app.stream import ConverseApiStreamHandler, OnStopInput
+from app.stream import ConverseApiStreamHandler, OnStopInput, ToolInputParser
+from tests.utils.bedrock_simulator import (
+    SimulatedBedrockRuntimeClient,
+    SimulatedResponse,
+    create_converse_stream_events,
+)
 from get_aws_logo import get_aws_logo, get_cdk_logo
 from get_pdf import get_aws_overview, get_test_markdown
 from ulid import ULID
 
+logger = logging.getLogger(__name__)
+
 
 def on_stream(x: str) -> None:
     print(x)
@@ -250,5 +261,107 @@ class TestConverseApiStreamHandlerGuardrail(unittest.TestCase):
         self._run(message, guardrail=guardrail)
 
 
+def _split(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def _replay(events: list[dict], **kwargs) -> OnStopInput:
+    client = SimulatedBedrockRuntimeClient(responses=[events])
+    with patch("app.stream.get_bedrock_runtime_client", return_value=client):
+        return ConverseApiStreamHandler(model="claude-v3.5-sonnet", **kwargs).run(
+            messages=[
+                MessageModel(
+                    role="user",
+                    content=[TextContentModel(content_type="text", body="Hello")],
+                    model="claude-v3.5-sonnet",
+                    children=[],
+                    parent=None,
+                    create_time=0,
+                    feedback=None,
+                    used_chunks=None,
+                    thinking_log=None,
+                )
+            ],
+        )
+
+
+class TestToolInputParser(unittest.TestCase):
+    def test_partial(self):
+        tool_input = {
+            "query": 'a, "b" {c}',
+            "filters": {"year": [2023, 2024]},
+            "limit": 5,
+        }
+        for delta_size in (1, 3, 100):
+            parser = ToolInputParser()
+            partials = []
+            for delta in _split(json.dumps(tool_input), delta_size):
+                parser.feed(delta)
+                partial = parser.parse_partial()
+                if partial is not None:
+                    partials.append(partial)
+
+            # Each member is notified once completed, except the last one
+            expected = [
+                {"query": tool_input["query"]},
+                {k: tool_input[k] for k in ("query", "filters")},
+            ]
+            self.assertEqual(partials, expected if delta_size < 10 else expected[1:])
+            self.assertEqual(parser.parse(), tool_input)
+
+    def test_empty(self):
+        self.assertEqual(ToolInputParser().parse(), {})
+
+
+class TestConverseApiStreamHandlerReplay(unittest.TestCase):
+    def test_text_and_tool_use(self):
+        text = "Let me search. " * 100
+        tool_input = {"query": "aws", "limit": 5}
+        tokens: list[str] = []
+        thinkings: list[dict] = []
+        result = _replay(
+            create_converse_stream_events(
+                SimulatedResponse(text, tool_uses=[("search", tool_input)])
+            ),
+            on_stream=tokens.append,
+            on_thinking=thinkings.append,
+        )
+
+        self.assertEqual("".join(tokens), text)
+        content = result["message"].content
+        self.assertEqual(content[0].body, text.rstrip())
+        self.assertEqual(content[1].body.input, tool_input)
+        self.assertEqual(
+            [thinking["input"] for thinking in thinkings],
+            [{"query": "aws"}, tool_input],
+        )
+        self.assertEqual(result["stop_reason"], "tool_use")
+
+
+class TestConverseApiStreamHandlerBenchmark(unittest.TestCase):
+    """Replay streams of increasing length. The throughput stays the same if the time is linear in the length."""
+
+    SIZES = (10_000, 40_000, 160_000)
+
+    def test_benchmark(self):
+        for size in self.SIZES:
+            text = "word " * (size // 5 * 4)
+            tool_input = {f"arg{i}": "value " * 100 for i in range(size // 1000)}
+            events = create_converse_stream_events(
+                SimulatedResponse(text, tool_uses=[("search", tool_input)])
+            )
+
+            start = time.perf_counter()
+            result = _replay(events, on_stream=lambda token: None)
+            elapsed = time.perf_counter() - start
+
+            logger.info(
+                f"{len(events)} events: {len(events) / elapsed:.0f} events/s, "
+                f"{elapsed * 1000:.0f}ms"
+            )
+            self.assertEqual(result["message"].content[0].body, text.rstrip())
+            self.assertEqual(result["message"].content[1].body.input, tool_input)
+
+
 if __name__ == "__main__":
     unittest.main()
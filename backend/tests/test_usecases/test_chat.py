@@ -1,8 +1,10 @@
+import logging
 import sys
 
 from ulid import ULID
 
 sys.path.insert(0, ".")
+import time
 import unittest
 from pprint import pprint
 
@@ -24,7 +26,10 @@ from app.repositories.custom_bot import (
 from app.repositories.models.conversation import (
     ConversationModel,
     MessageModel,
+    SimpleMessageModel,
     TextContentModel,
+    ToolResultContentModel,
+    ToolUseContentModel,
 )
 from app.repositories.models.custom_bot_guardrails import BedrockGuardrailsModel
 from app.routes.schemas.conversation import (
@@ -37,6 +42,7 @@ from app.routes.schemas.conversation import (
 )
 from app.stream import OnStopInput, OnThinking
 from app.usecases.chat import (
+    ConversationTree,
     chat,
     chat_output_from_message,
     fetch_conversation,
@@ -45,6 +51,9 @@ from app.usecases.chat import (
 )
 from app.vector_search import SearchResult
 from tests.test_stream.get_aws_logo import get_aws_logo
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
 from tests.test_stream.get_pdf import get_aws_overview
 from tests.test_usecases.utils.bot_factory import (
     create_test_instruction_template,
@@ -52,6 +61,8 @@ from tests.test_usecases.utils.bot_factory import (
     create_test_public_bot,
 )
 
+logger = logging.getLogger(__name__)
+
 MODEL: type_model_name = "claude-v3-haiku"
 MISTRAL_MODEL: type_model_name = "mistral-7b-instruct"
 
@@ -173,6 +184,119 @@ class TestTraceToRoot(unittest.TestCase):
         self.assertEqual(messages[4].content[0].body, "user_3b")
 
 
+def _trace_to_root_by_walk(
+    node_id: str, message_map: dict[str, MessageModel]
+) -> list[SimpleMessageModel]:
+    """`trace_to_root` before `ConversationTree`, for reference."""
+    result: list[SimpleMessageModel] = []
+    current_node = message_map.get(node_id)
+    while current_node:
+        result.append(SimpleMessageModel.from_message_model(message=current_node))
+        if current_node.thinking_log:
+            result.extend(
+                log
+                for log in reversed(current_node.thinking_log)
+                if any(
+                    isinstance(content, ToolUseContentModel)
+                    or isinstance(content, ToolResultContentModel)
+                    for content in log.content
+                )
+            )
+
+        parent_id = current_node.parent
+        if parent_id is None:
+            break
+        current_node = message_map.get(parent_id)
+
+    return result[::-1]
+
+
+def _create_branched_message_map(
+    turns: int, regenerations: int, edits: int
+) -> dict[str, MessageModel]:
+    """Conversation in which every answer is regenerated and every question is edited."""
+    message_map = create_test_conversation(
+        turns=turns, question_words=20, answer_words=50, tool_calls=1
+    ).message_map
+    for index in range(turns):
+        user_msg_id = f"user-{index:04}"
+        assistant = message_map[f"assistant-{index:04}"]
+        for regeneration in range(regenerations):
+            regenerated_id = f"assistant-{index:04}-regenerated-{regeneration}"
+            message_map[regenerated_id] = assistant.model_copy(update={"children": []})
+            message_map[user_msg_id].children.append(regenerated_id)
+
+        user = message_map[user_msg_id]
+        for edit in range(edits):
+            edited_id = f"user-{index:04}-edited-{edit}"
+            answer_id = f"assistant-{index:04}-edited-{edit}"
+            message_map[edited_id] = user.model_copy(update={"children": [answer_id]})
+            message_map[answer_id] = assistant.model_copy(
+                update={"children": [], "parent": edited_id}
+            )
+            message_map[user.parent].children.append(edited_id)  # type: ignore
+
+    return message_map
+
+
+class TestConversationTree(unittest.TestCase):
+    def setUp(self):
+        self.message_map = _create_branched_message_map(
+            turns=10, regenerations=2, edits=2
+        )
+
+    def test_same_as_walk(self):
+        tree = ConversationTree(self.message_map)
+        # Trace the deepest leaf first, so that the other leaves reuse the memoized path
+        for node_id in sorted(self.message_map.keys(), reverse=True):
+            self.assertEqual(
+                tree.trace_to_root(node_id),
+                _trace_to_root_by_walk(node_id, self.message_map),
+            )
+
+        # Tool use and result in the thinking log are included
+        self.assertEqual(len(tree.trace_to_root("assistant-0009")), 41)
+
+    def test_returns_copy(self):
+        tree = ConversationTree(self.message_map)
+        tree.trace_to_root("assistant-0005").append(
+            SimpleMessageModel(role="user", content=[])
+        )
+        self.assertEqual(
+            tree.trace_to_root("assistant-0005"),
+            _trace_to_root_by_walk("assistant-0005", self.message_map),
+        )
+
+
+class TestConversationTreeBenchmark(unittest.TestCase):
+    """Compare tracing every branch of deep conversations with many regenerations and edits."""
+
+    def test_benchmark(self):
+        for turns, regenerations, edits in ((50, 2, 1), (100, 3, 2), (200, 3, 3)):
+            message_map = _create_branched_message_map(turns, regenerations, edits)
+            leaves = [
+                node_id
+                for node_id, message in message_map.items()
+                if len(message.children) == 0
+            ]
+
+            start = time.perf_counter()
+            expected = [_trace_to_root_by_walk(leaf, message_map) for leaf in leaves]
+            walk_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            tree = ConversationTree(message_map)
+            # From the latest turn, as the branch to continue is usually the latest one
+            traced = [tree.trace_to_root(leaf) for leaf in reversed(leaves)][::-1]
+            tree_elapsed = time.perf_counter() - start
+
+            logger.info(
+                f"{len(message_map)} messages, {len(leaves)} leaves: "
+                f"walk {walk_elapsed * 1000:.1f}ms, tree {tree_elapsed * 1000:.1f}ms"
+            )
+            self.assertEqual(traced, expected)
+
+
 class TestStartChat(unittest.TestCase):
     def test_chat(self):
         chat_input = ChatInput(
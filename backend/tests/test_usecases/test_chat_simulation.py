@@ -0,0 +1,591 @@
+import logging
+import sys
+
+sys.path.insert(0, ".")
+
+import statistics
+import time
+import unittest
+from functools import partial
+from unittest.mock import patch
+
+from app.agents.tools.agent_tool import AgentTool, ToolRunResult
+from app.repositories.conversation import (
+    append_conversation_messages,
+    find_conversation_by_id,
+    find_related_documents_by_conversation_id,
+    store_conversation,
+    store_related_documents,
+)
+from app.repositories.custom_bot import (
+    find_alias_by_id,
+    find_private_bot_by_id,
+    store_bot,
+)
+from app.routes.schemas.conversation import ChatInput, MessageInput, TextContent
+from app.repositories.models.conversation import (
+    ToolUseContentModel,
+    ToolUseContentModelBody,
+)
+from app.usecases import chat as chat_usecase
+from app.usecases.chat import ChatTimings, KnowledgeRetrieval, chat, run_tools
+from app.vector_search import SearchResult
+from pydantic import BaseModel
+from tests.utils.bedrock_simulator import (
+    SimulatedBedrockRuntimeClient,
+    SimulatedResponse,
+    create_converse_stream_events,
+)
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+logger = logging.getLogger(__name__)
+
+MODEL = "claude-v3.5-sonnet"
+ANSWER = "Amazon Bedrock is a fully managed service. " * 40
+
+
+class _ToolInput(BaseModel):
+    query: str
+    # Overrides the latency of the tool
+    latency: float | None = None
+
+
+def _create_tool(name: str, latency: float = 0) -> AgentTool:
+    def search(arg: _ToolInput, bot, model) -> str:
+        time.sleep(arg.latency if arg.latency is not None else latency)
+        return f"Result of {arg.query}"
+
+    return AgentTool(
+        name=name,
+        description=f"{name} description",
+        args_schema=_ToolInput,
+        function=search,
+    )
+
+
+class _ChatSimulationTestCase(InMemoryRepositoryTestCase):
+    """Run `chat` with the in-memory DynamoDB table and S3, and the simulated Bedrock.
+    `_chat` returns the metrics of the turn.
+    """
+
+    user_id = "user"
+    bot_id = "bot"
+    # Bot with the knowledge, not using agent mode
+    rag_bot_id = "rag-bot"
+    first_token_latency = 0.0
+    token_interval = 0.0
+    tool_latency = 0.0
+    table_latency = 0.0
+    retrieval_latency = 0.0
+    notification_latency = 0.0
+
+    def setUp(self):
+        super().setUp()
+        self.bedrock = SimulatedBedrockRuntimeClient(
+            default_response=SimulatedResponse(ANSWER),
+            first_token_latency=self.first_token_latency,
+            token_interval=self.token_interval,
+        )
+        self.tools = {
+            name: _create_tool(name, self.tool_latency) for name in ("tool1", "tool2")
+        }
+        self.start_patchers(
+            patch("app.stream.get_bedrock_runtime_client", return_value=self.bedrock),
+            patch("app.usecases.chat.get_tool_by_name", self.tools.__getitem__),
+            patch("app.usecases.chat.search_related_docs", self._search_related_docs),
+        )
+
+        store_bot(self.user_id, create_test_private_bot(self.bot_id, False, "user"))
+        rag_bot = create_test_private_bot(self.rag_bot_id, False, "user")
+        rag_bot.agent.tools = []
+        store_bot(self.user_id, rag_bot)
+        self.queries: list[str] = []
+
+    def _search_related_docs(self, bot, query: str) -> list[SearchResult]:
+        self.queries.append(query)
+        time.sleep(self.retrieval_latency)
+        return [
+            SearchResult(
+                bot_id=bot.id,
+                content=f"Document about {query}",
+                source_name="doc.txt",
+                source_link="s3://bucket/doc.txt",
+                rank=0,
+            )
+        ]
+
+    def _chat_input(
+        self, conversation_id: str, bot_id: str | None = None, body: str = "Hello"
+    ) -> ChatInput:
+        return ChatInput(
+            conversation_id=conversation_id,
+            message=MessageInput(
+                role="user",
+                content=[TextContent(content_type="text", body=body)],
+                model=MODEL,
+                parent_message_id=None,
+                message_id=None,
+            ),
+            bot_id=bot_id,
+            continue_generate=False,
+        )
+
+    def _chat(self, chat_input: ChatInput) -> dict:
+        self.table.reset_metrics()
+        self.s3.reset_metrics()
+        self.bedrock.reset_metrics()
+        self.tool_results: list[ToolRunResult] = []
+        self.timings = ChatTimings()
+        token_at: list[float] = []
+        stopped_at: list[float] = []
+
+        def on_stop(arg):
+            stopped_at.append(time.perf_counter())
+            # Sending the end of the stream to the client
+            time.sleep(self.notification_latency)
+
+        start = time.perf_counter()
+        chat(
+            user_id=self.user_id,
+            chat_input=chat_input,
+            on_stream=lambda token: token_at.append(time.perf_counter()),
+            on_stop=on_stop,
+            on_tool_result=self.tool_results.append,
+            timings=self.timings,
+        )
+        elapsed = time.perf_counter() - start
+
+        return {
+            "time_to_first_token": (token_at[0] - start if token_at else float("nan")),
+            # From the last token to the end of the stream notified
+            "end_of_stream": (
+                stopped_at[0] - token_at[-1] if token_at else float("nan")
+            ),
+            "latency": elapsed,
+            "table_calls": sum(self.table.calls.values()),
+            "s3_calls": sum(self.s3.calls.values()),
+            "bedrock_calls": sum(self.bedrock.calls.values()),
+            "written_bytes": self.table.written_bytes + self.s3.written_bytes,
+        }
+
+
+class TestChatSimulation(_ChatSimulationTestCase):
+    def test_conversation(self):
+        for _ in range(3):
+            metrics = self._chat(self._chat_input("conversation"))
+            self.assertEqual(metrics["bedrock_calls"], 1)
+
+        conversation = find_conversation_by_id(self.user_id, "conversation")
+        # system, and a question and an answer for each turn
+        self.assertEqual(len(conversation.message_map), 7)
+        last_message = conversation.message_map[conversation.last_message_id]
+        self.assertEqual(last_message.content[0].body, ANSWER.rstrip())
+        # The history is sent to the model
+        self.assertEqual(len(self.bedrock.requests[0]["messages"]), 5)
+
+    def test_tool_use(self):
+        self.bedrock.responses = [
+            SimulatedResponse(
+                "Let me search.",
+                tool_uses=[("tool1", {"query": "a"}), ("tool2", {"query": "b"})],
+            ),
+        ]
+        metrics = self._chat(self._chat_input("conversation", bot_id=self.bot_id))
+
+        self.assertEqual(metrics["bedrock_calls"], 2)
+        self.assertEqual(
+            [result["status"] for result in self.tool_results], ["success", "success"]
+        )
+        conversation = find_conversation_by_id(self.user_id, "conversation")
+        thinking_log = conversation.message_map[
+            conversation.last_message_id
+        ].thinking_log
+        # The tool uses and the results
+        self.assertEqual(len(thinking_log), 2)
+
+    def test_replay(self):
+        events = create_converse_stream_events(SimulatedResponse("Recorded answer"))
+        self.bedrock.responses = [events]
+        self._chat(self._chat_input("conversation"))
+
+        conversation = find_conversation_by_id(self.user_id, "conversation")
+        last_message = conversation.message_map[conversation.last_message_id]
+        self.assertEqual(last_message.content[0].body, "Recorded answer")
+
+    def test_throttled(self):
+        self.bedrock.throttled_calls = 1
+        with self.assertRaises(self.bedrock.exceptions.ThrottlingException):
+            self._chat(self._chat_input("conversation"))
+
+        # Not stored on failure
+        self.assertEqual(self.table.written_bytes, 0)
+
+
+class TestKnowledgeRetrieval(_ChatSimulationTestCase):
+    table_latency = 0.01
+    retrieval_latency = 0.05
+
+    def test_overlapped(self):
+        def find_conversation_branch_by_id(*args):
+            # Takes longer than fetching the bot, as a long conversation does
+            time.sleep(self.retrieval_latency)
+            return find_conversation_branch_by_id_(*args)
+
+        find_conversation_branch_by_id_ = chat_usecase.find_conversation_branch_by_id
+        with patch(
+            "app.usecases.chat.find_conversation_branch_by_id",
+            find_conversation_branch_by_id,
+        ):
+            self._chat(self._chat_input("conversation", bot_id=self.rag_bot_id))
+
+        self.assertEqual(self.queries, ["Hello"])
+        # Retrieved while loading the conversation
+        retrieval_start, _ = self.timings.phases["retrieval"]
+        _, prepared_at = self.timings.phases["prepare_conversation"]
+        self.assertLess(retrieval_start, prepared_at)
+        # The documents are given to the model
+        self.assertIn("Document about Hello", str(self.bedrock.requests[0]["system"]))
+
+    def test_agent(self):
+        self._chat(self._chat_input("conversation", bot_id=self.bot_id))
+        self.assertEqual(self.queries, [])
+        self.assertNotIn("retrieval", self.timings.phases)
+
+    def test_continue_generate(self):
+        self._chat(self._chat_input("conversation", bot_id=self.rag_bot_id))
+        conversation = find_conversation_by_id(self.user_id, "conversation")
+        chat_input = self._chat_input("conversation", bot_id=self.rag_bot_id)
+        chat_input.continue_generate = True
+        chat_input.message.parent_message_id = conversation.message_map[
+            conversation.last_message_id
+        ].parent
+        self._chat(chat_input)
+        # Retrieved after loading the conversation, with the last message
+        self.assertEqual(self.queries, ["Hello", "Hello"])
+        retrieval_start, _ = self.timings.phases["retrieval"]
+        _, prepared_at = self.timings.phases["prepare_conversation"]
+        self.assertGreater(retrieval_start, prepared_at)
+
+
+class TestSharedBot(_ChatSimulationTestCase):
+    """Chat with the bot shared by another user, for which an alias is created on the first chat."""
+
+    table_latency = 0.01
+
+    def setUp(self):
+        super().setUp()
+        shared_bot = create_test_private_bot("shared-bot", False, "other")
+        shared_bot.public_bot_id = "shared-bot"
+        self.start_patchers(
+            patch(
+                "app.usecases.bot.find_public_bot_by_id",
+                lambda bot_id: shared_bot.model_copy(deep=True),
+            )
+        )
+
+    def test_alias(self):
+        self._chat(self._chat_input("conversation", bot_id="shared-bot"))
+
+        alias = find_alias_by_id(self.user_id, "shared-bot")
+        self.assertEqual(alias.original_bot_id, "shared-bot")
+        # Created while calling the model
+        alias_start, _ = self.timings.phases["deferred"]
+        _, prepared_at = self.timings.phases["prepare_conversation"]
+        self.assertGreaterEqual(alias_start, prepared_at)
+        self.assertGreater(alias.last_used_time, alias.create_time)
+
+        # Not created again
+        self._chat(self._chat_input("conversation", bot_id="shared-bot"))
+        self.assertNotIn("deferred", self.timings.phases)
+
+
+class TestStoreChat(_ChatSimulationTestCase):
+    table_latency = 0.01
+    notification_latency = 0.02
+
+    def test_end_of_stream(self):
+        last_used_time = find_private_bot_by_id(
+            self.user_id, self.rag_bot_id
+        ).last_used_time
+        metrics = self._chat(self._chat_input("conversation", bot_id=self.rag_bot_id))
+
+        # Stored before the end of the stream
+        conversation = find_conversation_by_id(self.user_id, "conversation")
+        # system, instruction, and a question and an answer
+        self.assertEqual(len(conversation.message_map), 4)
+        related_documents = find_related_documents_by_conversation_id(
+            self.user_id, "conversation"
+        )
+        self.assertEqual(
+            [document.content.text for document in related_documents],
+            ["Document about Hello"],
+        )
+        _, stored_at = self.timings.phases["store"]
+        self.assertLess(metrics["end_of_stream"], stored_at)
+
+        # Updated while notifying the end of the stream, and before returning
+        updating_at, _ = self.timings.phases["last_used_time"]
+        self.assertGreaterEqual(updating_at, stored_at)
+        self.assertLess(updating_at, stored_at + self.notification_latency)
+        self.assertGreater(
+            find_private_bot_by_id(self.user_id, self.rag_bot_id).last_used_time,
+            last_used_time,
+        )
+
+    def test_without_bot(self):
+        self._chat(self._chat_input("conversation"))
+        self.assertIn("store", self.timings.phases)
+        self.assertNotIn("last_used_time", self.timings.phases)
+
+
+class TestRunTools(unittest.TestCase):
+    def setUp(self):
+        self.tool = _create_tool("tool1")
+        self.tool_results: list[ToolRunResult] = []
+
+    def _run(self, latencies: list[float], **kwargs) -> list[ToolRunResult]:
+        return run_tools(
+            tool_use_contents=[
+                ToolUseContentModel(
+                    content_type="toolUse",
+                    body=ToolUseContentModelBody(
+                        tool_use_id=f"tool-{index}",
+                        name="tool1",
+                        input={"query": str(index), "latency": latency},
+                    ),
+                )
+                for index, latency in enumerate(latencies)
+            ],
+            tools={"tool1": self.tool},
+            model=MODEL,
+            bot=None,
+            on_tool_result=self.tool_results.append,
+            **kwargs,
+        )
+
+    def test_concurrent(self):
+        start = time.perf_counter()
+        results = self._run([0.2, 0.1, 0.0], max_workers=3)
+        self.assertLess(time.perf_counter() - start, 0.3)
+
+        # Notified as finished, and returned in order
+        self.assertEqual(
+            [result["tool_use_id"] for result in self.tool_results],
+            ["tool-2", "tool-1", "tool-0"],
+        )
+        self.assertEqual(
+            [result["tool_use_id"] for result in results],
+            ["tool-0", "tool-1", "tool-2"],
+        )
+        self.assertTrue(all(result["status"] == "success" for result in results))
+
+    def test_timeout(self):
+        start = time.perf_counter()
+        results = self._run([1.0, 0.0], timeout=0.1)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual([result["status"] for result in results], ["error", "success"])
+        self.assertEqual(
+            results[0]["related_documents"][0].content.text, "The tool timed out."
+        )
+
+    def test_deadline(self):
+        # The second tool waits for the thread, and is not started until the deadline
+        start = time.perf_counter()
+        results = self._run([1.0, 0.0], max_workers=1, deadline=0.1)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual([result["status"] for result in results], ["error", "error"])
+        self.assertEqual(len(self.tool_results), 2)
+
+
+class TestChatBenchmark(_ChatSimulationTestCase):
+    """Report time to first token, total latency, calls and bytes written per turn,
+    for conversations of different shapes, with the latencies of Bedrock and the tools as on AWS.
+    """
+
+    first_token_latency = 0.05
+    token_interval = 0.0002
+    tool_latency = 0.05
+    TURNS = 5
+
+    def _report(self, name: str, metrics: list[dict]):
+        logger.info(
+            f"{name}: "
+            f"time to first token {statistics.median(m['time_to_first_token'] for m in metrics) * 1000:.0f}ms, "
+            f"latency {statistics.median(m['latency'] for m in metrics) * 1000:.0f}ms, "
+            f"table calls {statistics.mean(m['table_calls'] for m in metrics):.1f}, "
+            f"S3 calls {statistics.mean(m['s3_calls'] for m in metrics):.1f}, "
+            f"Bedrock calls {statistics.mean(m['bedrock_calls'] for m in metrics):.1f}, "
+            f"written {statistics.mean(m['written_bytes'] for m in metrics) / 1024:.1f}KB per turn"
+        )
+
+    def test_benchmark(self):
+
+        metrics = [self._chat(self._chat_input("new")) for _ in range(self.TURNS)]
+        self._report("new conversation", metrics)
+
+        store_conversation(
+            self.user_id, create_test_conversation(id="long", turns=200, tool_calls=1)
+        )
+        metrics = [self._chat(self._chat_input("long")) for _ in range(self.TURNS)]
+        self._report("long conversation (200 turns)", metrics)
+
+        metrics = []
+        for _ in range(self.TURNS):
+            self.bedrock.responses = [
+                SimulatedResponse(
+                    "Let me search.",
+                    tool_uses=[("tool1", {"query": "a"}), ("tool2", {"query": "b"})],
+                ),
+            ]
+            metrics.append(self._chat(self._chat_input("agent", bot_id=self.bot_id)))
+        self._report("agent (2 tool uses)", metrics)
+
+        self.assertEqual(metrics[-1]["bedrock_calls"], 2)
+
+
+class TestRunToolsBenchmark(_ChatSimulationTestCase):
+    """Compare the latency of an agent turn using several slow tools, run one by one and concurrently."""
+
+    first_token_latency = 0.01
+    tool_latency = 0.1
+    TOOL_USES = 4
+
+    def test_benchmark(self):
+        latencies = {}
+        for max_workers in (1, 4):
+            self.bedrock.responses = [
+                SimulatedResponse(
+                    "Let me search.",
+                    tool_uses=[
+                        (f"tool{index % 2 + 1}", {"query": str(index)})
+                        for index in range(self.TOOL_USES)
+                    ],
+                ),
+            ]
+            with patch(
+                "app.usecases.chat.run_tools",
+                partial(run_tools, max_workers=max_workers),
+            ):
+                metrics = self._chat(
+                    self._chat_input(f"agent-{max_workers}", bot_id=self.bot_id)
+                )
+
+            logger.info(
+                f"{max_workers} workers: {self.TOOL_USES} tools of "
+                f"{self.tool_latency * 1000:.0f}ms in a turn of "
+                f"{metrics['latency'] * 1000:.0f}ms"
+            )
+            self.assertEqual(len(self.tool_results), self.TOOL_USES)
+            latencies[max_workers] = metrics["latency"]
+
+        # 4 tools one after another take 3 tool latencies more than at the same time
+        self.assertLess(latencies[4], latencies[1] - self.tool_latency)
+
+
+class TestKnowledgeRetrievalBenchmark(_ChatSimulationTestCase):
+    """Compare the time to first token of a bot with knowledge, with the retrieval started
+    before and after loading the conversation.
+    """
+
+    first_token_latency = 0.05
+    table_latency = 0.01
+    retrieval_latency = 0.1
+    TURNS = 3
+
+    def test_benchmark(self):
+        store_conversation(
+            self.user_id, create_test_conversation(id="long", turns=200, tool_calls=1)
+        )
+        for speculative in (False, True):
+            metrics = []
+            for _ in range(self.TURNS):
+                with patch(
+                    "app.usecases.chat.KnowledgeRetrieval",
+                    side_effect=None if speculative else lambda *args: None,
+                ) as retrieval:
+                    if speculative:
+                        retrieval.side_effect = KnowledgeRetrieval
+                    metrics.append(
+                        self._chat(self._chat_input("long", bot_id=self.rag_bot_id))
+                    )
+
+            logger.info(
+                f"{'speculative' if speculative else 'sequential'} retrieval: "
+                f"time to first token "
+                f"{statistics.median(m['time_to_first_token'] for m in metrics) * 1000:.0f}ms "
+                f"({self.timings})"
+            )
+
+
+class TestPrepareConversationBenchmark(TestSharedBot):
+    """Report the time of each step until the model is called, on the first chat with a shared bot."""
+
+    first_token_latency = 0.05
+
+    def test_alias(self):
+        pass
+
+    def test_benchmark(self):
+        store_conversation(self.user_id, create_test_conversation(id="long", turns=50))
+        for name, conversation_id in (("new", "new"), ("existing", "long")):
+            metrics = self._chat(self._chat_input(conversation_id, bot_id="shared-bot"))
+            logger.info(
+                f"{name} conversation: time to first token "
+                f"{metrics['time_to_first_token'] * 1000:.0f}ms ({self.timings})"
+            )
+
+
+def _store_chat_sequentially(
+    user_id, conversation, message_ids, deleted_message_ids, related_documents
+):
+    append_conversation_messages(
+        user_id,
+        conversation,
+        message_ids=message_ids,
+        deleted_message_ids=deleted_message_ids,
+    )
+    store_related_documents(
+        user_id=user_id,
+        conversation_id=conversation.id,
+        related_documents=related_documents,
+    )
+
+
+class TestStoreChatBenchmark(_ChatSimulationTestCase):
+    """Compare the latency from the last token to the end of the stream notified, with the conversation
+    and the related documents stored one by one and concurrently.
+    """
+
+    table_latency = 0.02
+    notification_latency = 0.02
+    TURNS = 3
+
+    def test_benchmark(self):
+        store_conversation(
+            self.user_id, create_test_conversation(id="long", turns=200, tool_calls=1)
+        )
+        for concurrent in (False, True):
+            metrics = []
+            for _ in range(self.TURNS):
+                with patch(
+                    "app.usecases.chat.store_chat",
+                    chat_usecase.store_chat if concurrent else _store_chat_sequentially,
+                ):
+                    metrics.append(
+                        self._chat(self._chat_input("long", bot_id=self.rag_bot_id))
+                    )
+
+            logger.info(
+                f"{'concurrent' if concurrent else 'sequential'} store: end of stream "
+                f"{statistics.median(m['end_of_stream'] for m in metrics) * 1000:.0f}ms, "
+                f"latency {statistics.median(m['latency'] for m in metrics) * 1000:.0f}ms "
+                f"({self.timings})"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
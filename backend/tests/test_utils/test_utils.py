@@ -1,7 +1,12 @@
 import logging
 import sys
+import threading
+import time
 import unittest
 
+import boto3
+from botocore.client import Config
+
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
@@ -40,5 +45,87 @@ class TestUtils(unittest.TestCase):
         assert reg == "us-west-2"
 
 
+class TestGetClient(unittest.TestCase):
+    def test_reused(self):
+        from app.utils import get_bedrock_runtime_client, get_client
+
+        client = get_bedrock_runtime_client()
+        self.assertIs(get_bedrock_runtime_client(), client)
+        self.assertIsNot(get_bedrock_runtime_client("us-west-2"), client)
+
+        config = client.meta.config
+        self.assertEqual(config.max_pool_connections, 50)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries["mode"], "standard")
+
+        # Clients with different config are not shared
+        presign_client = get_client(
+            "s3", region_name="us-east-1", signature_version="v4"
+        )
+        self.assertIsNot(get_client("s3", region_name="us-east-1"), presign_client)
+        self.assertIs(
+            get_client("s3", region_name="us-east-1", signature_version="v4"),
+            presign_client,
+        )
+        self.assertEqual(presign_client.meta.config.signature_version, "v4")
+
+    def test_concurrent_creation(self):
+        from app.utils import get_client
+
+        clients = []
+
+        def create():
+            clients.append(get_client("sqs", region_name="eu-west-1"))
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(map(id, clients))), 1)
+
+
+class TestGetClientBenchmark(unittest.TestCase):
+    """Compare the cost of getting the clients used by a chat turn, creating them (cold) or reusing them (warm)."""
+
+    ROUNDS = 20
+
+    def test_benchmark(self):
+        from app.utils import get_client
+
+        services = [
+            ("bedrock-runtime", {}),
+            ("s3", {"signature_version": "v4", "s3": {"addressing_style": "path"}}),
+            ("apigatewaymanagementapi", {}),
+        ]
+
+        def create_clients():
+            for service_name, config in services:
+                boto3.client(
+                    service_name,  # type: ignore[call-overload]
+                    region_name="us-east-1",
+                    config=Config(**config),
+                )
+
+        def get_clients():
+            for service_name, config in services:
+                get_client(service_name, region_name="us-east-1", **config)
+
+        elapsed = {}
+        for name, func in (("cold", create_clients), ("warm", get_clients)):
+            # The first call loads the service models from the disk
+            func()
+            start = time.perf_counter()
+            for _ in range(self.ROUNDS):
+                func()
+            elapsed[name] = (time.perf_counter() - start) / self.ROUNDS
+            LOGGER.info(
+                f"{name}: {elapsed[name] * 1000:.2f}ms per turn for {len(services)} clients"
+            )
+
+        self.assertLess(elapsed["warm"], elapsed["cold"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,185 @@
+import logging
+import sys
+
+sys.path.append(".")
+
+import importlib
+import time
+import unittest
+from unittest.mock import patch
+
+from app.repositories.custom_bot import find_private_bot_by_id, store_bot
+from app.repositories.models.custom_bot_kb import (
+    BedrockKnowledgeBaseModel,
+    FixedSizeParamsModel,
+    OpenSearchParamsModel,
+    SearchParamsModel,
+)
+from app.repositories.result_cache import ResultCache
+from app.vector_search import search_related_docs
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+from tests.utils.repository_test_case import InMemoryRepositoryTestCase
+
+# NOTE: Imported by name, because mypy checks the lambda handlers of the state machine as top-level modules
+update_bot_status = importlib.import_module(
+    "embedding_statemachine.bedrock_knowledge_base.update_bot_status"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _AgentClient:
+    """Stand-in for the `bedrock-agent-runtime` client, taking `latency` seconds for each retrieval."""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.requests: list[dict] = []
+
+    def retrieve(self, **kwargs) -> dict:
+        self.requests.append(kwargs)
+        time.sleep(self.latency)
+        query = kwargs["retrievalQuery"]["text"]
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": f"Document {i} about {query}"},
+                    "location": {
+                        "type": "S3",
+                        "s3Location": {"uri": f"s3://bucket/doc{i}.txt"},
+                    },
+                }
+                for i in range(2)
+            ]
+        }
+
+
+def _create_bot(
+    id: str,
+    sync_last_exec_id: str = "exec-1",
+    max_results: int = 20,
+    exist_knowledge_base_id: str | None = None,
+):
+    bot = create_test_private_bot(
+        id,
+        False,
+        "user",
+        sync_status="SUCCEEDED",
+        bedrock_knowledge_base=BedrockKnowledgeBaseModel(
+            embeddings_model="titan_v2",
+            open_search=OpenSearchParamsModel(analyzer=None),
+            search_params=SearchParamsModel(
+                max_results=max_results,
+                search_type="hybrid",
+            ),
+            chunking_configuration=FixedSizeParamsModel(
+                chunking_strategy="fixed_size",
+            ),
+            knowledge_base_id=f"kb-{id}",
+            exist_knowledge_base_id=exist_knowledge_base_id,
+        ),
+    )
+    bot.sync_last_exec_id = sync_last_exec_id
+    return bot
+
+
+class _RetrievalCacheTestCase(InMemoryRepositoryTestCase):
+    retrieval_latency = 0.0
+
+    def setUp(self):
+        super().setUp()
+        self.agent_client = _AgentClient(self.retrieval_latency)
+        self.cache: ResultCache = ResultCache("Retrieval", ttl=60, max_entries=16)
+        self.cache.shared = None
+        self.start_patchers(
+            patch("app.vector_search.agent_client", self.agent_client),
+            patch("app.vector_search._retrieval_cache", self.cache),
+            patch.object(
+                update_bot_status, "_get_table_client", return_value=self.table
+            ),
+        )
+
+    def _update_sync_status(self, sync_status: str, execution_id: str):
+        """Invoke the handler with the payload of `createUpdateSyncStatusTask` of the embedding state machine."""
+        response = update_bot_status.handler(
+            {
+                "pk": "user",
+                "sk": "user#BOT#bot",
+                "sync_status": sync_status,
+                "sync_status_reason": "",
+                "last_exec_id": execution_id,
+            },
+            None,
+        )
+        self.assertEqual(response["statusCode"], 200)
+
+
+class TestRetrievalCache(_RetrievalCacheTestCase):
+    def test_hit(self):
+        bot = _create_bot("bot")
+        results = search_related_docs(bot, "What is Amazon Bedrock?")
+        # The same question with different whitespace
+        self.assertEqual(search_related_docs(bot, " What is  Amazon Bedrock?"), results)
+        self.assertEqual(len(self.agent_client.requests), 1)
+        self.assertEqual(self.cache.stats()["hit_rate"], 0.5)
+
+    def test_synced(self):
+        store_bot("user", _create_bot("bot"))
+        for execution_id in ("execution-1", "execution-2"):
+            self._update_sync_status("RUNNING", execution_id)
+            # Not cached while the documents are ingested
+            for _ in range(2):
+                search_related_docs(
+                    find_private_bot_by_id("user", "bot"), "What is Amazon Bedrock?"
+                )
+            self._update_sync_status("SUCCEEDED", execution_id)
+            for _ in range(2):
+                search_related_docs(
+                    find_private_bot_by_id("user", "bot"), "What is Amazon Bedrock?"
+                )
+
+        # 2 while running and 1 after synced, for each sync
+        self.assertEqual(len(self.agent_client.requests), 6)
+
+    def test_search_params(self):
+        search_related_docs(_create_bot("bot"), "What is Amazon Bedrock?")
+        search_related_docs(
+            _create_bot("bot", max_results=5), "What is Amazon Bedrock?"
+        )
+        self.assertEqual(len(self.agent_client.requests), 2)
+
+    def test_shared_knowledge_base(self):
+        search_related_docs(
+            _create_bot("bot1", exist_knowledge_base_id="kb"), "What is Amazon Bedrock?"
+        )
+        results = search_related_docs(
+            _create_bot("bot2", exist_knowledge_base_id="kb"), "What is Amazon Bedrock?"
+        )
+        self.assertEqual(len(self.agent_client.requests), 1)
+        self.assertEqual([result["bot_id"] for result in results], ["bot2", "bot2"])
+
+
+class TestRetrievalCacheBenchmark(_RetrievalCacheTestCase):
+    """Report the hit rate and the latency saved on questions repeated as the quick starters of a bot."""
+
+    retrieval_latency = 0.02
+    QUESTIONS = ["What is Amazon Bedrock?", "How much does it cost?", "Which models?"]
+    REQUESTS = 30
+
+    def test_benchmark(self):
+        bot = _create_bot("bot")
+        start = time.perf_counter()
+        for i in range(self.REQUESTS):
+            search_related_docs(bot, self.QUESTIONS[i % len(self.QUESTIONS)])
+        elapsed = time.perf_counter() - start
+
+        stats = self.cache.stats()
+        logger.info(
+            f"{self.REQUESTS} retrievals of {len(self.QUESTIONS)} questions in "
+            f"{elapsed * 1000:.0f}ms: hit rate {stats['hit_rate']:.0%}, "
+            f"saved {stats['saved_seconds'] * 1000:.0f}ms"
+        )
+        self.assertEqual(len(self.agent_client.requests), len(self.QUESTIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,625 @@
+import logging
+import os
+import sys
+
+sys.path.append(".")
+os.environ.setdefault("WEBSOCKET_SESSION_TABLE_NAME", "WebsocketSessionTable")
+
+import json
+import random
+import threading
+import time
+import unittest
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+from app.repositories.common import ScopedResourceCache, VersionedCache
+from app.repositories.conversation import store_conversation
+from app.repositories.custom_bot import store_bot
+from app.routes.schemas.conversation import ChatInput, MessageInput, TextContent
+from app.usecases.chat import prepare_conversation
+from app.websocket import NotificationSender, handler
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+from tests.utils.conversation_factory import (
+    create_test_conversation,
+)
+from tests.utils.in_memory_aws import (
+    InMemoryDynamoDBResource,
+    InMemoryS3Client,
+    SlowTable,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _GoneException(Exception):
+    pass
+
+
+class _ForbiddenException(Exception):
+    pass
+
+
+class FakeGatewayApi:
+    """Stand-in for `post_to_connection` of `apigatewaymanagementapi` client.
+    Takes `latency` seconds for each frame, with random `jitter`, as on AWS.
+    """
+
+    class exceptions:
+        GoneException = _GoneException
+        ForbiddenException = _ForbiddenException
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        gone_after: int | None = None,
+        failures: dict[int, int] | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.gone_after = gone_after
+        # Number of failures of each frame by `seq`
+        self.failures = failures or {}
+        self.attempts: dict[int, int] = {}
+        self.frames: list[dict] = []
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId: str, Data: bytes):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        frame = json.loads(Data)
+        assert len(Data) <= 32 * 1024
+        with self.lock:
+            if self.gone_after is not None and len(self.frames) >= self.gone_after:
+                raise _GoneException("Gone")
+
+            attempt = self.attempts.get(frame["seq"], 0)
+            self.attempts[frame["seq"]] = attempt + 1
+            if attempt < self.failures.get(frame["seq"], 0):
+                raise Exception("Internal server error")
+
+            self.frames.append(frame)
+
+    def ordered_frames(self) -> list[dict]:
+        """Frames in the order the client handles them."""
+        return sorted(self.frames, key=lambda frame: frame["seq"])
+
+
+def _run_sender(sender: NotificationSender, produce) -> threading.Thread:
+    thread = threading.Thread(target=sender.run, daemon=True)
+    thread.start()
+    produce()
+    sender.finish()
+    thread.join(timeout=10)
+    return thread
+
+
+class _NotificationSenderTestCase(unittest.TestCase):
+    workers = 1
+
+    def _create_sender(self, gatewayapi: FakeGatewayApi, **kwargs):
+        patcher = patch("app.websocket.get_client", return_value=gatewayapi)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return NotificationSender(
+            "https://example.com", "connection", workers=self.workers, **kwargs
+        )
+
+    def _produce(self, sender: NotificationSender, tokens: list[str]):
+        sender.notify({"status": "AGENT_THINKING"})
+        for index, token in enumerate(tokens):
+            sender.on_stream(token)
+            if index == len(tokens) // 2:
+                sender.notify({"status": "AGENT_TOOL_RESULT"})
+        sender.on_stop({"stop_reason": "end_turn"})  # type: ignore[typeddict-item]
+
+    def _assert_order(self, frames: list[dict], tokens: list[str]):
+        statuses = [frame["status"] for frame in frames]
+        self.assertEqual(statuses[0], "AGENT_THINKING")
+        self.assertEqual(statuses[-1], "STREAMING_END")
+        # The tool result is between the first and second halves of the deltas
+        tool_result = statuses.index("AGENT_TOOL_RESULT")
+        completions = [frame.get("completion", "") for frame in frames]
+        self.assertEqual("".join(completions[:tool_result]), "".join(tokens[:101]))
+        self.assertEqual("".join(completions[tool_result:]), "".join(tokens[101:]))
+
+
+class TestNotificationSender(_NotificationSenderTestCase):
+    def test_order_preserved(self):
+        gatewayapi = FakeGatewayApi(latency=0.002)
+        sender = self._create_sender(gatewayapi)
+        tokens = [f"token{i} " for i in range(200)]
+        _run_sender(sender, lambda: self._produce(sender, tokens))
+
+        self._assert_order(gatewayapi.frames, tokens)
+        self.assertEqual(
+            [frame["seq"] for frame in gatewayapi.frames],
+            list(range(len(gatewayapi.frames))),
+        )
+
+        stats = sender.stats()
+        self.assertEqual(stats["tokens_received"], 200)
+        self.assertLess(stats["stream_frames_sent"], 100)
+        self.assertEqual(stats["frames_sent"], len(gatewayapi.frames))
+
+    def test_frame_size(self):
+        gatewayapi = FakeGatewayApi()
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=1000)
+        # Escaped in JSON, so that the encoded size is larger than the text
+        tokens = ['"\\' * 500 for _ in range(100)]
+        _run_sender(sender, lambda: [sender.on_stream(token) for token in tokens])
+
+        self.assertGreater(len(gatewayapi.frames), 3)
+        self.assertEqual(
+            "".join(frame["completion"] for frame in gatewayapi.frames),
+            "".join(tokens),
+        )
+
+    def test_disabled(self):
+        gatewayapi = FakeGatewayApi(latency=0.001)
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0)
+        _run_sender(sender, lambda: [sender.on_stream("token") for _ in range(20)])
+        self.assertEqual(len(gatewayapi.frames), 20)
+
+    def test_bounded_queue(self):
+        gatewayapi = FakeGatewayApi(latency=0.001, gone_after=3)
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0, queue_size=4)
+        # Producers do not block after the connection is gone
+        thread = _run_sender(
+            sender,
+            lambda: [sender.notify({"status": "STREAMING"}) for _ in range(100)],
+        )
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(gatewayapi.frames), 3)
+        self.assertLessEqual(sender.commands.qsize(), 4)
+
+    def test_failed(self):
+        gatewayapi = FakeGatewayApi()
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0, queue_size=4)
+        thread = threading.Thread(target=sender.run, daemon=True)
+        with patch.object(sender, "_encode", side_effect=Exception("Failed")):
+            thread.start()
+            # Producers do not block after the sender failed
+            producer = threading.Thread(
+                target=lambda: [
+                    sender.notify({"status": "STREAMING"}) for _ in range(100)
+                ],
+                daemon=True,
+            )
+            producer.start()
+            producer.join(timeout=10)
+            thread.join(timeout=10)
+
+        self.assertFalse(producer.is_alive())
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(sender.closed)
+        self.assertEqual(len(gatewayapi.frames), 0)
+
+
+class TestNotificationSenderPool(_NotificationSenderTestCase):
+    workers = 4
+
+    def test_reordered_by_seq(self):
+        gatewayapi = FakeGatewayApi(latency=0.001, jitter=0.005)
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0)
+        tokens = [f"token{i} " for i in range(200)]
+        _run_sender(sender, lambda: self._produce(sender, tokens))
+
+        # Posted out of order
+        seqs = [frame["seq"] for frame in gatewayapi.frames]
+        self.assertNotEqual(seqs, sorted(seqs))
+        self._assert_order(gatewayapi.ordered_frames(), tokens)
+
+        # Other frames are posted after all preceding frames
+        for index, frame in enumerate(gatewayapi.frames):
+            if frame["status"] != "STREAMING":
+                self.assertEqual(
+                    {f["seq"] for f in gatewayapi.frames[:index]},
+                    set(range(frame["seq"])),
+                )
+
+    def test_retry_failed_frames(self):
+        gatewayapi = FakeGatewayApi(failures={3: 1, 5: 2, 7: 3})
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0)
+        _run_sender(sender, lambda: [sender.on_stream(f"{i} ") for i in range(10)])
+
+        # Only the failed frames are retried. The frame failed more than retries is dropped.
+        self.assertEqual(
+            gatewayapi.attempts, {i: {3: 2, 5: 3, 7: 3}.get(i, 1) for i in range(10)}
+        )
+        self.assertEqual(
+            [frame["seq"] for frame in gatewayapi.ordered_frames()],
+            [i for i in range(10) if i != 7],
+        )
+        self.assertEqual(sender.stats()["retries"], 5)
+
+    def test_gone(self):
+        gatewayapi = FakeGatewayApi(latency=0.001, gone_after=10)
+        sender = self._create_sender(gatewayapi, coalesce_window_ms=0, queue_size=4)
+        thread = _run_sender(
+            sender, lambda: [sender.on_stream(f"{i} ") for i in range(100)]
+        )
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(sender.gone)
+        self.assertEqual(len(gatewayapi.frames), 10)
+
+
+class _HandlerTestCase(unittest.TestCase):
+    """Invoke the handler with the session table stored in memory."""
+
+    def setUp(self):
+        self.session: dict[str, dict] = {}
+        self.table = MagicMock()
+        self.table.put_item.side_effect = lambda Item: self.session.update(
+            {str(Item["MessagePartId"]): Item}
+        )
+        # The session is queried with `FilterExpression`, and the parts without
+        self.table.query.side_effect = lambda **kwargs: {
+            "Items": sorted(
+                (
+                    item
+                    for item in self.session.values()
+                    if ("FilterExpression" in kwargs) == ("UserId" in item)
+                ),
+                key=lambda item: item["MessagePartId"],
+            )
+        }
+        self._start_patchers(
+            patch("app.websocket.table", self.table),
+            patch("app.websocket.verify_token", return_value={"sub": "user"}),
+        )
+
+    def _start_patchers(self, *patchers):
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _invoke(self, body: dict) -> dict:
+        return handler(
+            {
+                "requestContext": {
+                    "routeKey": "$default",
+                    "connectionId": "connection",
+                    "domainName": "example.com",
+                    "stage": "dev",
+                },
+                "body": json.dumps(body),
+            },
+            None,
+        )
+
+    def _send_parts(self, body: str):
+        parts = [body[i : i + 32 * 1024] for i in range(0, len(body), 32 * 1024)]
+        for index, part in enumerate(parts):
+            self._invoke({"step": "BODY", "index": index, "part": part})
+
+
+class TestChatInputUpload(_HandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.s3 = InMemoryS3Client()
+        self.process_chat_input = MagicMock(return_value={"statusCode": 200})
+        self._start_patchers(
+            patch("app.websocket.get_client", return_value=self.s3),
+            patch("app.websocket.process_chat_input", self.process_chat_input),
+            patch("app.websocket.LARGE_PAYLOAD_SUPPORT_BUCKET", "payload-bucket"),
+            patch(
+                "app.websocket.generate_presigned_url",
+                lambda bucket, key, **kwargs: f"https://{bucket}/{key}?signed",
+            ),
+        )
+
+        self.chat_input = ChatInput(
+            conversation_id="conversation",
+            message=MessageInput(
+                role="user",
+                content=[TextContent(content_type="text", body="x" * 100 * 1024)],
+                model="claude-v3.5-sonnet",
+                parent_message_id=None,
+                message_id=None,
+            ),
+            bot_id=None,
+            continue_generate=False,
+        )
+        # As sent by the frontend
+        self.body = self.chat_input.model_dump_json(by_alias=True)
+
+    def test_upload(self):
+        response = self._invoke({"step": "START", "token": "token", "upload": True})
+        upload = json.loads(response["body"])
+        self.assertEqual(upload["status"], "UPLOAD")
+        self.assertEqual(upload["objectKey"], "user/chat_inputs/connection.json")
+
+        # Uploaded by the client
+        self.s3.put_object(
+            Bucket="payload-bucket", Key=upload["objectKey"], Body=self.body
+        )
+        self._invoke({"step": "END", "objectKey": upload["objectKey"]})
+
+        self.assertEqual(
+            self.process_chat_input.call_args.kwargs["chat_input"], self.chat_input
+        )
+        self.assertEqual(self.process_chat_input.call_args.kwargs["user_id"], "user")
+        self.assertEqual(len(self.s3.objects), 0)
+        # Only the session is written to the table
+        self.assertEqual(self.table.put_item.call_count, 1)
+
+    def test_other_key(self):
+        self._invoke({"step": "START", "token": "token", "upload": True})
+        self.s3.put_object(
+            Bucket="payload-bucket", Key="other/chat_inputs/x.json", Body=self.body
+        )
+        response = self._invoke(
+            {"step": "END", "objectKey": "other/chat_inputs/x.json"}
+        )
+        self.assertEqual(response["statusCode"], 403)
+        self.process_chat_input.assert_not_called()
+
+    def test_parts(self):
+        # Fallback when the client does not or fails to upload
+        for upload in (False, True):
+            self.session.clear()
+            response = self._invoke(
+                {"step": "START", "token": "token", "upload": upload}
+            )
+            if not upload:
+                self.assertEqual(response["body"], "Session started.")
+
+            self._send_parts(self.body)
+            self._invoke({"step": "END"})
+
+            self.assertEqual(
+                self.process_chat_input.call_args.kwargs["chat_input"],
+                self.chat_input,
+            )
+
+
+class _ChatPrefetchTestCase(_HandlerTestCase):
+    """Chat through the handler, with the conversation and the bot read from the table
+    with the credentials scoped to the user, as on Lambda.
+    """
+
+    STS_LATENCY = 0.0
+    TABLE_LATENCY = 0.0
+    # Seconds taken by the client to send the message after `START` returns
+    SEND_LATENCY = 0.0
+
+    def setUp(self):
+        super().setUp()
+        self.data_table = SlowTable(self.TABLE_LATENCY)
+        self.boto3 = MagicMock()
+        self.sts = MagicMock()
+
+        def assume_role(**kwargs):
+            time.sleep(self.STS_LATENCY)
+            return {
+                "Credentials": {
+                    "AccessKeyId": "key",
+                    "SecretAccessKey": "secret",
+                    "SessionToken": "token",
+                    "Expiration": datetime.now(timezone.utc) + timedelta(hours=1),
+                }
+            }
+
+        self.sts.assume_role.side_effect = assume_role
+        self.boto3.Session.return_value.resource.return_value = (
+            InMemoryDynamoDBResource(self.data_table)
+        )
+        self.conversation_cache: VersionedCache = VersionedCache("Conversation")
+        self.bot_cache: VersionedCache = VersionedCache("Bot")
+        self.gatewayapi = FakeGatewayApi()
+        self.first_token_at: list[float] = []
+        self._start_patchers(
+            patch.dict(os.environ, {"AWS_EXECUTION_ENV": "AWS_Lambda_python3.11"}),
+            patch("app.repositories.common.boto3", self.boto3),
+            patch("app.repositories.common.get_client", return_value=self.sts),
+            patch(
+                "app.repositories.common._scoped_resource_cache",
+                ScopedResourceCache(),
+            ),
+            patch(
+                "app.repositories.conversation._conversation_cache",
+                self.conversation_cache,
+            ),
+            patch("app.repositories.custom_bot._bot_cache", self.bot_cache),
+            patch("app.websocket._prefetched_connections", OrderedDict()),
+            patch("app.websocket.get_client", return_value=self.gatewayapi),
+            patch("app.websocket.chat", self._chat),
+        )
+
+        store_bot("user", create_test_private_bot("bot", False, "user"))
+        store_conversation(
+            "user", create_test_conversation(turns=20), storage_mode="message_map"
+        )
+        # Written by another container
+        self.conversation_cache.clear()
+        self.bot_cache.clear()
+        self._start_patchers(
+            patch(
+                "app.repositories.common._scoped_resource_cache",
+                ScopedResourceCache(),
+            )
+        )
+        self.sts.assume_role.reset_mock()
+
+        self.chat_input = ChatInput(
+            conversation_id="1",
+            message=MessageInput(
+                role="user",
+                content=[TextContent(content_type="text", body="Hello")],
+                model="claude-v3.5-sonnet",
+                parent_message_id=None,
+                message_id=None,
+            ),
+            bot_id="bot",
+            continue_generate=False,
+        )
+
+    def _chat(self, user_id: str, chat_input: ChatInput, on_stream, **kwargs):
+        # Reads before calling the model
+        prepare_conversation(user_id, chat_input)
+        self.first_token_at.append(time.perf_counter())
+        on_stream("Hello")
+
+    def _send(self, hints: bool) -> float:
+        """Chat as the frontend does, and return the time to first token after `START`."""
+        start_body = {"step": "START", "token": "token"}
+        if hints:
+            start_body.update(conversationId="1", botId="bot")
+
+        start = time.perf_counter()
+        self._invoke(start_body)
+        time.sleep(self.SEND_LATENCY)
+        self._send_parts(self.chat_input.model_dump_json(by_alias=True))
+        response = self._invoke({"step": "END"})
+        self.assertEqual(response["statusCode"], 200)
+        return self.first_token_at[-1] - start
+
+
+class TestChatPrefetch(_ChatPrefetchTestCase):
+    def test_prefetched(self):
+        self._send(hints=True)
+        # Read with the credentials and the items cached on `START`
+        self.assertEqual(self.sts.assume_role.call_count, 1)
+        self.assertEqual(self.conversation_cache.stats()["hits"], 1)
+        self.assertEqual(self.bot_cache.stats()["hits"], 1)
+        self.assertEqual(
+            [frame["completion"] for frame in self.gatewayapi.ordered_frames()],
+            ["Hello"],
+        )
+
+    def test_without_hints(self):
+        self._send(hints=False)
+        self.assertEqual(self.conversation_cache.stats()["hits"], 0)
+        self.assertEqual(self.bot_cache.stats()["hits"], 0)
+
+    def test_new_conversation(self):
+        self.chat_input.conversation_id = "new"
+        self._send(hints=True)
+        self.assertEqual(self.bot_cache.stats()["hits"], 1)
+
+    def test_waited(self):
+        self._invoke(
+            {"step": "START", "token": "token", "conversationId": "1", "botId": "bot"}
+        )
+        # Prefetched before returning, not to be frozen by Lambda
+        self.assertEqual(self.conversation_cache.stats()["entries"], 1)
+        self.assertEqual(self.bot_cache.stats()["entries"], 1)
+
+    def test_timeout(self):
+        self.STS_LATENCY = 0.2
+        start = time.perf_counter()
+        with patch("app.websocket.CHAT_PREFETCH_TIMEOUT_SECONDS", 0.01):
+            self._invoke(
+                {
+                    "step": "START",
+                    "token": "token",
+                    "conversationId": "1",
+                    "botId": "bot",
+                }
+            )
+        # Returned while assuming the role
+        self.assertLess(time.perf_counter() - start, self.STS_LATENCY)
+
+        self._send_parts(self.chat_input.model_dump_json(by_alias=True))
+        self._invoke({"step": "END"})
+        # The chat waits for the role assumed by the prefetch
+        self.assertEqual(self.sts.assume_role.call_count, 1)
+
+    def test_failed(self):
+        # The prefetch does not fail `START`, and is retried on `END`
+        with patch(
+            "app.websocket.prefetch_conversation", side_effect=Exception("Failed")
+        ):
+            response = self._invoke(
+                {
+                    "step": "START",
+                    "token": "token",
+                    "conversationId": "1",
+                    "botId": "bot",
+                }
+            )
+        self.assertEqual(response["statusCode"], 200)
+        self.assertEqual(self.conversation_cache.stats()["entries"], 0)
+
+
+class TestNotificationSenderBenchmark(unittest.TestCase):
+    """Compare frames sent for a model streaming faster than `post_to_connection` returns."""
+
+    LATENCY = 0.01
+    TOKENS = 200
+    # Interval of the deltas from the model
+    TOKEN_INTERVAL = 0.001
+
+    def test_benchmark(self):
+        frames = {}
+        for window, workers in ((0, 1), (0, 4), (40, 1), (40, 4)):
+            gatewayapi = FakeGatewayApi(latency=self.LATENCY, jitter=self.LATENCY / 2)
+            with patch("app.websocket.get_client", return_value=gatewayapi):
+                sender = NotificationSender(
+                    "https://example.com",
+                    "connection",
+                    coalesce_window_ms=window,
+                    workers=workers,
+                )
+
+                def produce():
+                    for index in range(self.TOKENS):
+                        sender.on_stream(f"{index} ")
+                        time.sleep(self.TOKEN_INTERVAL)
+
+                start = time.perf_counter()
+                _run_sender(sender, produce)
+                elapsed = time.perf_counter() - start
+
+            stats = sender.stats()
+            logger.info(
+                f"window {window}ms, {workers} workers: "
+                f"{stats['stream_frames_sent']} frames for "
+                f"{stats['tokens_received']} deltas "
+                f"(ratio {stats['coalescing_ratio']:.1f}), "
+                f"delivered in {elapsed * 1000:.0f}ms"
+            )
+            self.assertEqual(
+                "".join(frame["completion"] for frame in gatewayapi.ordered_frames()),
+                "".join(f"{index} " for index in range(self.TOKENS)),
+            )
+            frames[window, workers] = stats["stream_frames_sent"]
+
+        # The deltas arriving within the window are sent in a frame
+        self.assertLess(frames[40, 1], frames[0, 1])
+        self.assertLess(frames[40, 4], frames[0, 4])
+
+
+class TestChatPrefetchBenchmark(_ChatPrefetchTestCase):
+    """Compare the time to first token after `START` with and without the hints on it,
+    with the latencies of STS and DynamoDB, and the time to send the message as on AWS.
+    """
+
+    STS_LATENCY = 0.05
+    TABLE_LATENCY = 0.01
+    SEND_LATENCY = 0.1
+
+    def test_benchmark(self):
+        for hints in (False, True):
+            # A new container for each
+            self.conversation_cache.clear()
+            self.bot_cache.clear()
+            self._start_patchers(
+                patch(
+                    "app.repositories.common._scoped_resource_cache",
+                    ScopedResourceCache(),
+                )
+            )
+            elapsed = self._send(hints=hints)
+            logger.info(
+                f"{'prefetched' if hints else 'not prefetched'}: "
+                f"time to first token {elapsed * 1000:.0f}ms"
+            )
+
+        self.assertEqual(self.conversation_cache.stats()["hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
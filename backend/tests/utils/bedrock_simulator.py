@@ -0,0 +1,255 @@
+"""Stand-in for the `bedrock-runtime` client, to run `chat` without AWS.
+Responses are generated from the given text and tool uses, or replayed from the events recorded from `converse_stream`.
+Latency of the model and throttling can be simulated, and the requests are counted as the in-memory stand-ins do.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Iterator
+
+from botocore.exceptions import ClientError
+
+
+class _ModelStreamErrorException(ClientError):
+    pass
+
+
+class _ThrottlingException(ClientError):
+    pass
+
+
+class _InternalServerException(ClientError):
+    pass
+
+
+class _ServiceUnavailableException(ClientError):
+    pass
+
+
+class _ValidationException(ClientError):
+    pass
+
+
+class SimulatedResponse:
+    """Response of the model: the text, followed by the tool uses of (name, input)."""
+
+    def __init__(
+        self,
+        text: str = "",
+        tool_uses: list[tuple[str, dict]] = [],
+        input_tokens: int = 100,
+    ):
+        self.text = text
+        self.tool_uses = tool_uses
+        self.input_tokens = input_tokens
+
+
+def _split(text: str, size: int) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def create_converse_stream_events(
+    response: SimulatedResponse, delta_size: int = 4
+) -> list[dict]:
+    """Create the events of `converse_stream`, with the text and tool inputs split into deltas of `delta_size` characters.
+    Models send about 4 characters per token.
+    """
+    events: list[dict] = [{"messageStart": {"role": "assistant"}}]
+    index = 0
+    if response.text:
+        events += [
+            {
+                "contentBlockDelta": {
+                    "contentBlockIndex": index,
+                    "delta": {"text": delta},
+                }
+            }
+            for delta in _split(response.text, delta_size)
+        ]
+        events.append({"contentBlockStop": {"contentBlockIndex": index}})
+        index += 1
+
+    for name, input in response.tool_uses:
+        events.append(
+            {
+                "contentBlockStart": {
+                    "contentBlockIndex": index,
+                    "start": {
+                        "toolUse": {"toolUseId": f"tooluse-{index}", "name": name}
+                    },
+                }
+            }
+        )
+        events += [
+            {
+                "contentBlockDelta": {
+                    "contentBlockIndex": index,
+                    "delta": {"toolUse": {"input": delta}},
+                }
+            }
+            for delta in _split(json.dumps(input), delta_size)
+        ]
+        events.append({"contentBlockStop": {"contentBlockIndex": index}})
+        index += 1
+
+    output_characters = len(response.text) + sum(
+        len(json.dumps(input)) for _, input in response.tool_uses
+    )
+    events.append(
+        {
+            "messageStop": {
+                "stopReason": "tool_use" if response.tool_uses else "end_turn"
+            }
+        }
+    )
+    events.append(
+        {
+            "metadata": {
+                "usage": {
+                    "inputTokens": response.input_tokens,
+                    "outputTokens": output_characters // 4 + 1,
+                    "totalTokens": response.input_tokens + output_characters // 4 + 1,
+                },
+                "metrics": {"latencyMs": 0},
+            }
+        }
+    )
+    return events
+
+
+class SimulatedBedrockRuntimeClient:
+    """Stand-in for `boto3.client("bedrock-runtime")`, returning `responses` in order and then `default_response`.
+    Each of `responses` is a `SimulatedResponse` or a list of events recorded from `converse_stream`.
+    The first event is delayed by `first_token_latency` seconds, and each delta by `token_interval` seconds.
+    The first `throttled_calls` streams end with `throttlingException`, as Bedrock does when throttled.
+    """
+
+    class exceptions:
+        ModelStreamErrorException = _ModelStreamErrorException
+        ThrottlingException = _ThrottlingException
+        InternalServerException = _InternalServerException
+        ServiceUnavailableException = _ServiceUnavailableException
+        ValidationException = _ValidationException
+
+    def __init__(
+        self,
+        responses: list[SimulatedResponse | list[dict]] = [],
+        default_response: SimulatedResponse = SimulatedResponse(
+            "Hello! How can I help you today?"
+        ),
+        first_token_latency: float = 0,
+        token_interval: float = 0,
+        throttled_calls: int = 0,
+        delta_size: int = 4,
+    ):
+        self.responses = list(responses)
+        self.default_response = default_response
+        self.first_token_latency = first_token_latency
+        self.token_interval = token_interval
+        self.throttled_calls = throttled_calls
+        self.delta_size = delta_size
+        self.calls: Counter[str] = Counter()
+        self.requests: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def reset_metrics(self):
+        with self.lock:
+            self.calls = Counter()
+            self.requests = []
+
+    def _next_events(
+        self, operation_name: str, request: dict
+    ) -> tuple[list[dict], bool]:
+        with self.lock:
+            self.calls[operation_name] += 1
+            self.requests.append(request)
+            throttled = self.throttled_calls > 0
+            if throttled:
+                self.throttled_calls -= 1
+            response = (
+                self.responses.pop(0) if self.responses else self.default_response
+            )
+
+        if isinstance(response, SimulatedResponse):
+            return create_converse_stream_events(response, self.delta_size), throttled
+
+        return response, throttled
+
+    def _stream(self, events: list[dict], throttled: bool) -> Iterator[dict]:
+        time.sleep(self.first_token_latency)
+        if throttled:
+            yield {
+                "throttlingException": {
+                    "message": "Too many requests, please wait before trying again."
+                }
+            }
+            return
+
+        for event in events:
+            if "contentBlockDelta" in event and self.token_interval > 0:
+                time.sleep(self.token_interval)
+            yield event
+
+    def converse_stream(self, **kwargs) -> dict:
+        events, throttled = self._next_events("converse_stream", kwargs)
+        return {"stream": self._stream(events, throttled)}
+
+    def converse(self, **kwargs) -> dict:
+        events, throttled = self._next_events("converse", kwargs)
+        time.sleep(self.first_token_latency)
+        if throttled:
+            raise _ThrottlingException(
+                error_response={
+                    "Error": {"Code": "ThrottlingException", "Message": "Throttled"}
+                },
+                operation_name="Converse",
+            )
+
+        # Assemble the message from the events, as `converse` returns at once
+        contents: dict[int, dict] = {}
+        tool_inputs: dict[int, list[str]] = {}
+        stop_reason = "end_turn"
+        usage: dict = {}
+        for event in events:
+            if "contentBlockStart" in event:
+                start = event["contentBlockStart"]
+                tool_use = start["start"]["toolUse"]
+                contents[start["contentBlockIndex"]] = {
+                    "toolUse": {
+                        "toolUseId": tool_use["toolUseId"],
+                        "name": tool_use["name"],
+                    }
+                }
+                tool_inputs[start["contentBlockIndex"]] = []
+
+            elif "contentBlockDelta" in event:
+                delta = event["contentBlockDelta"]
+                index = delta["contentBlockIndex"]
+                if "text" in delta["delta"]:
+                    content = contents.setdefault(index, {"text": ""})
+                    content["text"] += delta["delta"]["text"]
+                else:
+                    tool_inputs[index].append(delta["delta"]["toolUse"]["input"])
+
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"]["stopReason"]
+
+            elif "metadata" in event:
+                usage = event["metadata"]["usage"]
+
+        for index, deltas in tool_inputs.items():
+            contents[index]["toolUse"]["input"] = json.loads("".join(deltas) or "{}")
+
+        return {
+            "output": {
+                "message": {
+                    "role": "assistant",
+                    "content": [content for _, content in sorted(contents.items())],
+                }
+            },
+            "stopReason": stop_reason,
+            "usage": usage,
+            "metrics": {"latencyMs": 0},
+        }
@@ -0,0 +1,208 @@
+import random
+import sys
+
+sys.path.append(".")
+
+
+from app.repositories.models.conversation import (
+    ChunkModel,
+    ConversationModel,
+    ImageContentModel,
+    JsonToolResultModel,
+    MessageModel,
+    SimpleMessageModel,
+    TextContentModel,
+    TextToolResultModel,
+    ToolResultContentModel,
+    ToolResultContentModelBody,
+    ToolUseContentModel,
+    ToolUseContentModelBody,
+)
+
+WORDS = (
+    "the of and to in is that for it as with was on be by this are or from at an "
+    "which have not but all can has were more one their will also its been other "
+    "model data system function value request response user service cloud lambda "
+    "table query index stream token document search result source chunk vector "
+    "embedding retrieval latency throughput cost region account bucket object key "
+    "partition sort capacity read write cache memory thread process error retry"
+).split()
+
+
+def create_text(rand: random.Random, words: int) -> str:
+    """Generate text which compresses similarly to natural language."""
+    sentences = []
+    while words > 0:
+        length = min(words, rand.randint(6, 20))
+        sentence = " ".join(rand.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+
+    return " ".join(sentences)
+
+
+def _create_thinking_log(
+    rand: random.Random, index: int, tool_calls: int
+) -> list[SimpleMessageModel]:
+    thinking_log = []
+    for call in range(tool_calls):
+        tool_use_id = f"tooluse_{index:04}_{call}_{rand.getrandbits(64):016x}"
+        thinking_log.append(
+            SimpleMessageModel(
+                role="assistant",
+                content=[
+                    TextContentModel(
+                        content_type="text",
+                        body=create_text(rand, 30),
+                    ),
+                    ToolUseContentModel(
+                        content_type="toolUse",
+                        body=ToolUseContentModelBody(
+                            tool_use_id=tool_use_id,
+                            name="internet_search",
+                            input={
+                                "query": create_text(rand, 6),
+                                "country": "us-en",
+                                "time_limit": "m",
+                            },
+                        ),
+                    ),
+                ],
+            )
+        )
+        thinking_log.append(
+            SimpleMessageModel(
+                role="user",
+                content=[
+                    ToolResultContentModel(
+                        content_type="toolResult",
+                        body=ToolResultContentModelBody(
+                            tool_use_id=tool_use_id,
+                            content=[
+                                JsonToolResultModel(
+                                    json={
+                                        "content": create_text(rand, 120),
+                                        "source_name": create_text(rand, 5),
+                                        "source_link": f"https://example.com/{rand.getrandbits(32):08x}",
+                                    }
+                                )
+                                for _ in range(4)
+                            ]
+                            + [TextToolResultModel(text=create_text(rand, 80))],
+                            status="success",
+                        ),
+                    )
+                ],
+            )
+        )
+
+    return thinking_log
+
+
+def create_test_conversation(
+    id: str = "1",
+    turns: int = 10,
+    question_words: int = 60,
+    answer_words: int = 400,
+    tool_calls: int = 0,
+    image_size: int = 0,
+    model: str = "claude-v3.5-sonnet",
+    seed: int = 0,
+) -> ConversationModel:
+    """Create a linear conversation which looks like the one stored by `chat`.
+    If `tool_calls` is given, each answer has a thinking log with the tool uses and results.
+    If `image_size` is given, each question has an image of the size in bytes.
+    """
+    rand = random.Random(seed)
+    create_time = 1627984879.9
+
+    message_map = {
+        "system": MessageModel(
+            role="system",
+            content=[TextContentModel(content_type="text", body="")],
+            model=model,
+            children=[],
+            parent=None,
+            create_time=create_time,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+    }
+    last_message_id = "system"
+    for index in range(turns):
+        user_msg_id = f"user-{index:04}"
+        assistant_msg_id = f"assistant-{index:04}"
+        create_time += 10
+
+        message_map[user_msg_id] = MessageModel(
+            role="user",
+            content=[
+                TextContentModel(
+                    content_type="text", body=create_text(rand, question_words)
+                )
+            ]
+            + (
+                [
+                    ImageContentModel(
+                        content_type="image",
+                        media_type="image/png",
+                        body=rand.randbytes(image_size),
+                    )
+                ]
+                if image_size > 0
+                else []
+            ),
+            model=model,
+            children=[assistant_msg_id],
+            parent=last_message_id,
+            create_time=create_time,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+        message_map[last_message_id].children.append(user_msg_id)
+
+        message_map[assistant_msg_id] = MessageModel(
+            role="assistant",
+            content=[
+                TextContentModel(
+                    content_type="text", body=create_text(rand, answer_words)
+                )
+            ],
+            model=model,
+            children=[],
+            parent=user_msg_id,
+            create_time=create_time + 5,
+            feedback=None,
+            used_chunks=(
+                [
+                    ChunkModel(
+                        content=create_text(rand, 50),
+                        content_type="url",
+                        source=f"https://example.com/{rand.getrandbits(32):08x}",
+                        rank=rank,
+                    )
+                    for rank in range(3)
+                ]
+                if tool_calls > 0
+                else None
+            ),
+            thinking_log=(
+                _create_thinking_log(rand, index, tool_calls)
+                if tool_calls > 0
+                else None
+            ),
+        )
+        last_message_id = assistant_msg_id
+
+    return ConversationModel(
+        id=id,
+        create_time=1627984879.9,
+        title="Test Conversation",
+        total_price=0.5,
+        message_map=message_map,
+        last_message_id=last_message_id,
+        bot_id=None,
+        should_continue=False,
+    )
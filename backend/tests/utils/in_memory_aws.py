@@ -0,0 +1,604 @@
+"""In-memory stand-ins for the DynamoDB table resource and the S3 client.
+Only the subset of the API used by the repositories is implemented.
+They also count requests and written bytes so that tests can measure I/O per operation.
+"""
+
+import copy
+import json
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any
+
+from boto3.dynamodb.conditions import ConditionBase
+from botocore.exceptions import ClientError
+
+
+def _client_error(code: str, operation_name: str) -> ClientError:
+    return ClientError(
+        error_response={"Error": {"Code": code, "Message": code}},
+        operation_name=operation_name,
+    )
+
+
+def item_size(item: dict) -> int:
+    """Approximate size of the item in bytes."""
+    size = 0
+    for key, value in item.items():
+        size += len(key.encode("utf-8"))
+        if isinstance(value, (bytes, bytearray)):
+            size += len(value)
+
+        elif isinstance(value, str):
+            size += len(value.encode("utf-8"))
+
+        else:
+            size += len(json.dumps(value, default=str).encode("utf-8"))
+
+    return size
+
+
+def _get_path(item: dict, path: list[str]) -> Any:
+    value: Any = item
+    for name in path:
+        if not isinstance(value, dict) or name not in value:
+            raise KeyError(name)
+
+        value = value[name]
+
+    return value
+
+
+def _set_path(item: dict, path: list[str], value: Any):
+    target = item
+    for name in path[:-1]:
+        if name not in target or not isinstance(target[name], dict):
+            raise _client_error("ValidationException", "UpdateItem")
+
+        target = target[name]
+
+    target[path[-1]] = value
+
+
+def _remove_path(item: dict, path: list[str]):
+    target = item
+    for name in path[:-1]:
+        target = target.get(name, {})
+
+    target.pop(path[-1], None)
+
+
+def _evaluate_condition(condition: ConditionBase, item: dict) -> bool:
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+
+    if operator == "AND":
+        return all(_evaluate_condition(v, item) for v in values)
+    if operator == "OR":
+        return any(_evaluate_condition(v, item) for v in values)
+    if operator == "NOT":
+        return not _evaluate_condition(values[0], item)
+
+    name = values[0].name
+    exists = name in item
+    if operator == "attribute_exists":
+        return exists
+    if operator == "attribute_not_exists":
+        return not exists
+    if not exists:
+        return False
+
+    value = item[name]
+    if operator == "=":
+        return value == values[1]
+    if operator == "<>":
+        return value != values[1]
+    if operator == "<":
+        return value < values[1]
+    if operator == "<=":
+        return value <= values[1]
+    if operator == ">":
+        return value > values[1]
+    if operator == ">=":
+        return value >= values[1]
+    if operator == "begins_with":
+        return isinstance(value, str) and value.startswith(values[1])
+    if operator == "BETWEEN":
+        return values[1] <= value <= values[2]
+
+    raise NotImplementedError(f"Unsupported operator: {operator}")
+
+
+class _Expression:
+    """Tiny evaluator for the string expressions used by the repositories."""
+
+    def __init__(
+        self,
+        names: dict[str, str] | None,
+        values: dict[str, Any] | None,
+    ):
+        self.names = names or {}
+        self.values = values or {}
+
+    def path(self, text: str) -> list[str]:
+        return [self.names.get(name, name) for name in text.strip().split(".")]
+
+    def operand(self, text: str, item: dict) -> Any:
+        text = text.strip()
+        if text.startswith(":"):
+            return self.values[text]
+
+        match = re.fullmatch(r"if_not_exists\((.+),\s*(:\w+)\)", text)
+        if match is not None:
+            try:
+                return _get_path(item, self.path(match.group(1)))
+            except KeyError:
+                return self.values[match.group(2)]
+
+        match = re.fullmatch(r"(.+?)\s*\+\s*(:\w+)", text)
+        if match is not None:
+            return self.operand(match.group(1), item) + self.values[match.group(2)]
+
+        return _get_path(item, self.path(text))
+
+    def condition(self, text: str, item: dict) -> bool:
+        for clause in re.split(r"\s+AND\s+", text.strip()):
+            clause = clause.strip()
+            if clause.startswith("(") and clause.endswith(")"):
+                clause = clause[1:-1].strip()
+            match = re.fullmatch(r"attribute_(not_)?exists\((.+)\)", clause)
+            if match is not None:
+                try:
+                    _get_path(item, self.path(match.group(2)))
+                    exists = True
+                except KeyError:
+                    exists = False
+
+                if exists == bool(match.group(1)):
+                    return False
+
+                continue
+
+            match = re.fullmatch(r"(.+?)\s*(=|<>|<=|>=|<|>)\s*(.+)", clause)
+            if match is None:
+                raise NotImplementedError(f"Unsupported condition: {clause}")
+
+            try:
+                left = self.operand(match.group(1), item)
+            except KeyError:
+                return False
+
+            right = self.operand(match.group(3), item)
+            operator = match.group(2)
+            if not {
+                "=": lambda: left == right,
+                "<>": lambda: left != right,
+                "<": lambda: left < right,
+                "<=": lambda: left <= right,
+                ">": lambda: left > right,
+                ">=": lambda: left >= right,
+            }[operator]():
+                return False
+
+        return True
+
+    def update(self, text: str, item: dict):
+        sections = re.split(r"\b(SET|REMOVE|ADD)\b", text.strip(), flags=re.IGNORECASE)
+        for keyword, body in zip(sections[1::2], sections[2::2]):
+            actions = [action for action in self._split(body) if action.strip()]
+            keyword = keyword.upper()
+            for action in actions:
+                if keyword == "SET":
+                    target, value = action.split("=", 1)
+                    _set_path(item, self.path(target), self.operand(value, item))
+
+                elif keyword == "REMOVE":
+                    _remove_path(item, self.path(action))
+
+                else:
+                    target, value = action.strip().split(None, 1)
+                    path = self.path(target)
+                    try:
+                        current = _get_path(item, path)
+                    except KeyError:
+                        current = 0
+
+                    _set_path(item, path, current + self.values[value.strip()])
+
+    @staticmethod
+    def _split(body: str) -> list[str]:
+        # Split by commas which are not enclosed in parentheses
+        parts, depth, current = [], 0, ""
+        for char in body:
+            if char == "(":
+                depth += 1
+
+            elif char == ")":
+                depth -= 1
+
+            if char == "," and depth == 0:
+                parts.append(current)
+                current = ""
+
+            else:
+                current += char
+
+        parts.append(current)
+        return parts
+
+
+def _project(item: dict, projection: str | None, names: dict | None) -> dict:
+    if projection is None:
+        return copy.deepcopy(item)
+
+    names = names or {}
+    projected: dict = {}
+    for attribute in projection.split(","):
+        path = [names.get(name, name) for name in attribute.strip().split(".")]
+        try:
+            value = _get_path(item, path)
+        except KeyError:
+            continue
+
+        target = projected
+        for name in path[:-1]:
+            target = target.setdefault(name, {})
+        target[path[-1]] = copy.deepcopy(value)
+
+    return projected
+
+
+class _BatchWriter:
+    def __init__(self, table: "InMemoryTable"):
+        self.table = table
+        self.requests: list[tuple[str, dict]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def put_item(self, Item: dict):
+        self.requests.append(("put", Item))
+        if len(self.requests) >= 25:
+            self.flush()
+
+    def delete_item(self, Key: dict):
+        self.requests.append(("delete", Key))
+        if len(self.requests) >= 25:
+            self.flush()
+
+    def flush(self):
+        if len(self.requests) == 0:
+            return
+
+        with self.table.lock:
+            self.table.calls["batch_write_item"] += 1
+            for kind, value in self.requests:
+                if kind == "put":
+                    self.table._put(value, "BatchWriteItem")
+
+                else:
+                    self.table.items.pop((value["PK"], value["SK"]), None)
+
+        self.requests = []
+
+
+class InMemoryTable:
+    """Stand-in for `boto3.resource("dynamodb").Table(...)` with PK / SK keys and the `SKIndex` GSI.
+    Batch writers can be used from worker threads.
+    """
+
+    PAGE_SIZE = 1024 * 1024
+    MAX_ITEM_SIZE = 400 * 1024
+
+    def __init__(self):
+        self.items: dict[tuple[str, str], dict] = {}
+        self.calls: Counter[str] = Counter()
+        # Requests with `ConsistentRead=True`. Reads are always consistent in memory.
+        self.consistent_calls: Counter[str] = Counter()
+        self.written_bytes = 0
+        self.lock = threading.Lock()
+
+    def reset_metrics(self):
+        self.calls = Counter()
+        self.consistent_calls = Counter()
+        self.written_bytes = 0
+
+    def _put(self, item: dict, operation_name: str):
+        item = copy.deepcopy(item)
+        for key, value in item.items():
+            if isinstance(value, float):
+                raise TypeError(
+                    "Float types are not supported. Use Decimal types instead."
+                )
+
+        size = item_size(item)
+        if size > self.MAX_ITEM_SIZE:
+            raise _client_error("ValidationException", operation_name)
+
+        self.written_bytes += size
+        self.items[(item["PK"], item["SK"])] = item
+
+    def batch_writer(self):
+        return _BatchWriter(self)
+
+    def put_item(
+        self,
+        Item: dict,
+        ConditionExpression: str | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        ExpressionAttributeValues: dict | None = None,
+        ReturnValues: str | None = None,
+    ):
+        self.calls["put_item"] += 1
+        old = self.items.get((Item["PK"], Item["SK"]))
+        if ConditionExpression is not None:
+            expression = _Expression(
+                ExpressionAttributeNames, ExpressionAttributeValues
+            )
+            if not expression.condition(ConditionExpression, old or {}):
+                raise _client_error("ConditionalCheckFailedException", "PutItem")
+
+        self._put(Item, "PutItem")
+        response: dict = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        if ReturnValues == "ALL_OLD" and old is not None:
+            response["Attributes"] = copy.deepcopy(old)
+
+        return response
+
+    def get_item(
+        self,
+        Key: dict,
+        ProjectionExpression: str | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        ConsistentRead: bool = False,
+    ):
+        self.calls["get_item"] += 1
+        if ConsistentRead:
+            self.consistent_calls["get_item"] += 1
+        item = self.items.get((Key["PK"], Key["SK"]))
+        if item is None:
+            return {}
+
+        return {"Item": _project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def update_item(
+        self,
+        Key: dict,
+        UpdateExpression: str,
+        ExpressionAttributeValues: dict | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        ConditionExpression: str | None = None,
+        ReturnValues: str | None = None,
+    ):
+        self.calls["update_item"] += 1
+        key = (Key["PK"], Key["SK"])
+        old = self.items.get(key)
+        expression = _Expression(ExpressionAttributeNames, ExpressionAttributeValues)
+        if ConditionExpression is not None and not expression.condition(
+            ConditionExpression, old or {}
+        ):
+            raise _client_error("ConditionalCheckFailedException", "UpdateItem")
+
+        item = copy.deepcopy(old) if old is not None else dict(Key)
+        expression.update(UpdateExpression, item)
+        if item_size(item) > self.MAX_ITEM_SIZE:
+            raise _client_error("ValidationException", "UpdateItem")
+
+        written = item_size(
+            {k: v for k, v in item.items() if old is None or old.get(k) != v}
+        )
+        self.items[key] = item
+        self.written_bytes += written
+
+        response: dict = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        if ReturnValues in ("ALL_NEW", "UPDATED_NEW"):
+            response["Attributes"] = copy.deepcopy(item)
+
+        return response
+
+    def delete_item(
+        self,
+        Key: dict,
+        ConditionExpression: str | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        ExpressionAttributeValues: dict | None = None,
+    ):
+        self.calls["delete_item"] += 1
+        key = (Key["PK"], Key["SK"])
+        if ConditionExpression is not None:
+            expression = _Expression(
+                ExpressionAttributeNames, ExpressionAttributeValues
+            )
+            if not expression.condition(ConditionExpression, self.items.get(key, {})):
+                raise _client_error("ConditionalCheckFailedException", "DeleteItem")
+
+        self.items.pop(key, None)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def query(
+        self,
+        KeyConditionExpression: ConditionBase,
+        IndexName: str | None = None,
+        ProjectionExpression: str | None = None,
+        ExpressionAttributeNames: dict | None = None,
+        FilterExpression: ConditionBase | None = None,
+        ScanIndexForward: bool = True,
+        ExclusiveStartKey: dict | None = None,
+        Limit: int | None = None,
+        ConsistentRead: bool = False,
+    ):
+        self.calls["query"] += 1
+        if ConsistentRead:
+            if IndexName is not None:
+                raise _client_error("ValidationException", "Query")
+            self.consistent_calls["query"] += 1
+        if IndexName not in (None, "SKIndex"):
+            raise NotImplementedError(f"Unsupported index: {IndexName}")
+
+        matched = sorted(
+            (
+                item
+                for item in self.items.values()
+                if _evaluate_condition(KeyConditionExpression, item)
+            ),
+            key=lambda item: (item["PK"], item["SK"]),
+            reverse=not ScanIndexForward,
+        )
+        if ExclusiveStartKey is not None:
+            start = (ExclusiveStartKey["PK"], ExclusiveStartKey["SK"])
+            matched = [
+                item
+                for item in matched
+                if (
+                    (item["PK"], item["SK"]) > start
+                    if ScanIndexForward
+                    else (item["PK"], item["SK"]) < start
+                )
+            ]
+
+        items, read_bytes, evaluated = [], 0, 0
+        last_evaluated_key = None
+        for item in matched:
+            if (
+                Limit is not None and evaluated >= Limit
+            ) or read_bytes >= self.PAGE_SIZE:
+                last_evaluated_key = last_key
+                break
+
+            evaluated += 1
+            read_bytes += item_size(item)
+            last_key = {"PK": item["PK"], "SK": item["SK"]}
+            if FilterExpression is None or _evaluate_condition(FilterExpression, item):
+                items.append(
+                    _project(item, ProjectionExpression, ExpressionAttributeNames)
+                )
+
+        response: dict = {"Items": items, "Count": len(items)}
+        if last_evaluated_key is not None:
+            response["LastEvaluatedKey"] = last_evaluated_key
+
+        return response
+
+
+class InMemoryDynamoDBResource:
+    """Stand-in for `boto3.resource("dynamodb")`, whose tables are all `client`.
+    Resources built with the same client share the table, as the ones sharing a low-level client do.
+    """
+
+    def __init__(self, client: Any):
+        self.meta = SimpleNamespace(client=client)
+
+    def Table(self, name: str) -> Any:
+        return self.meta.client
+
+
+class _SlowBatchWriter(_BatchWriter):
+    def flush(self):
+        if len(self.requests) > 0:
+            time.sleep(self.table.latency)
+        super().flush()
+
+
+class SlowTable(InMemoryTable):
+    """`InMemoryTable` taking `latency` seconds for each request, as on AWS."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def batch_writer(self):
+        return _SlowBatchWriter(self)
+
+    def put_item(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().put_item(*args, **kwargs)
+
+    def get_item(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().get_item(*args, **kwargs)
+
+    def update_item(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().update_item(*args, **kwargs)
+
+    def delete_item(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().delete_item(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().query(*args, **kwargs)
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+
+class InMemoryS3Client:
+    """Stand-in for `boto3.client("s3")`. Thread-safe as the client is shared by worker threads."""
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.calls: Counter[str] = Counter()
+        self.written_bytes = 0
+        self.read_bytes = 0
+        self.lock = threading.Lock()
+
+    def reset_metrics(self):
+        with self.lock:
+            self.calls = Counter()
+            self.written_bytes = 0
+            self.read_bytes = 0
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes | str, **kwargs):
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self.lock:
+            self.calls["put_object"] += 1
+            self.written_bytes += len(data)
+            self.objects[(Bucket, Key)] = data
+
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def get_object(self, Bucket: str, Key: str, Range: str | None = None):
+        with self.lock:
+            self.calls["get_object"] += 1
+            if (Bucket, Key) not in self.objects:
+                raise _client_error("NoSuchKey", "GetObject")
+
+            data = self.objects[(Bucket, Key)]
+            if Range is not None:
+                match = re.fullmatch(r"bytes=(\d+)-(\d+)", Range)
+                assert match is not None
+                data = data[int(match.group(1)) : int(match.group(2)) + 1]
+
+            self.read_bytes += len(data)
+
+        return {"Body": _Body(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket: str, Key: str):
+        with self.lock:
+            self.calls["delete_object"] += 1
+            self.objects.pop((Bucket, Key), None)
+
+        return {"ResponseMetadata": {"HTTPStatusCode": 204}}
+
+    def delete_objects(self, Bucket: str, Delete: dict):
+        if len(Delete["Objects"]) > 1000:
+            raise _client_error("MalformedXML", "DeleteObjects")
+
+        with self.lock:
+            self.calls["delete_objects"] += 1
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+
+        return {"Deleted": [{"Key": obj["Key"]} for obj in Delete["Objects"]]}
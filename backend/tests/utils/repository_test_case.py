@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import patch
+
+from app.repositories.common import VersionedCache
+from tests.utils.in_memory_aws import InMemoryS3Client, InMemoryTable, SlowTable
+
+LARGE_MESSAGE_BUCKET = "test-bucket"
+
+
+class InMemoryRepositoryTestCase(unittest.TestCase):
+    """Run the conversation and bot repositories on `InMemoryTable` and `InMemoryS3Client`,
+    with the caches of the repositories empty for each test.
+    Set `table_latency` to run on `SlowTable`, taking the time of each request as on AWS.
+    """
+
+    table_latency = 0.0
+
+    def setUp(self):
+        self.table: InMemoryTable = (
+            SlowTable(self.table_latency) if self.table_latency > 0 else InMemoryTable()
+        )
+        self.s3 = InMemoryS3Client()
+        self.conversation_cache: VersionedCache = VersionedCache("Conversation")
+        self.bot_cache: VersionedCache = VersionedCache("Bot")
+        self.start_patchers(
+            patch(
+                "app.repositories.conversation._get_table_client",
+                return_value=self.table,
+            ),
+            patch("app.repositories.conversation.s3_client", self.s3),
+            patch(
+                "app.repositories.conversation.LARGE_MESSAGE_BUCKET",
+                LARGE_MESSAGE_BUCKET,
+            ),
+            patch(
+                "app.repositories.conversation._conversation_cache",
+                self.conversation_cache,
+            ),
+            patch(
+                "app.repositories.custom_bot._get_table_client",
+                return_value=self.table,
+            ),
+            patch("app.repositories.custom_bot._bot_cache", self.bot_cache),
+        )
+
+    def start_patchers(self, *patchers):
+        """Start the patchers, stopped after the test."""
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
@@ -260,15 +260,19 @@ export class Embedding extends Construct {
       }
     );
 
+    // The execution id changes on every sync, so that the API invalidates the retrievals cached before it
     const updateSyncStatusRunning = this.createUpdateSyncStatusTask(
       "UpdateSyncStatusRunning",
-      "RUNNING"
+      "RUNNING",
+      undefined,
+      "$$.Execution.Id"
     );
 
     const updateSyncStatusSucceeded = this.createUpdateSyncStatusTask(
       "UpdateSyncStatusSuccess",
       "SUCCEEDED",
-      "Knowledge base sync succeeded"
+      "Knowledge base sync succeeded",
+      "$$.Execution.Id"
     );
 
     const updateSyncStatusFailed = new tasks.LambdaInvoke(
@@ -56,6 +56,21 @@ export class WebSocket extends Construct {
         autoDeleteObjects: true,
         serverAccessLogsBucket: props.accessLogBucket,
         serverAccessLogsPrefix: "LargePayloadSupportBucket",
+        // Large chat inputs are uploaded by the frontend with presigned URLs.
+        // They are deleted once read, and the ones never sent are expired.
+        cors: [
+          {
+            allowedMethods: [s3.HttpMethods.PUT],
+            allowedOrigins: ["*"],
+            allowedHeaders: ["*"],
+            maxAge: 3000,
+          },
+        ],
+        lifecycleRules: [
+          {
+            expiration: Duration.days(1),
+          },
+        ],
       }
     );
 
@@ -80,7 +95,7 @@ export class WebSocket extends Construct {
         resources: ["*"],
       })
     );
-    largePayloadSupportBucket.grantRead(handlerRole);
+    largePayloadSupportBucket.grantReadWrite(handlerRole);
     props.websocketSessionTable.grantReadWriteData(handlerRole);
     props.largeMessageBucket.grantReadWrite(handlerRole);
     props.documentBucket.grantRead(handlerRole);
@@ -0,0 +1,58 @@
+import json
+import zlib
+
+import boto3
+
+# Backfill `Model` attribute of the conversation items stored before it was introduced.
+# The conversation list (`GET /conversations`) reads only metadata attributes,
+# and reads `MessageMap` of the conversations without `Model` one by one, storing `Model` on the first list.
+# NOTE: Backfill is optional. It avoids the reads on the first list of each user.
+
+# Open the backend API Lambda function in the AWS Management Console and copy the value from its environment variables.
+# Key: TABLE_NAME
+TABLE_NAME = "BedrockChatStack-DatabaseConversationTableXXXXX"
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(TABLE_NAME)
+
+
+def decode_message_map(value) -> dict:
+    if isinstance(value, str):
+        return json.loads(value)
+
+    # Versioned binary: 1 = zlib compressed JSON
+    data = bytes(value)
+    if data[0] != 1:
+        raise ValueError(f"Unknown message map encoding: {data[0]}")
+
+    return json.loads(zlib.decompress(data[1:]))
+
+
+scan_kwargs = {
+    "FilterExpression": "contains(SK, :substring) AND attribute_not_exists(Model) AND attribute_exists(MessageMap)",
+    "ExpressionAttributeValues": {":substring": "#CONV#"},
+    "ProjectionExpression": "PK, SK, MessageMap",
+}
+
+backfilled = 0
+while True:
+    response = table.scan(**scan_kwargs)
+
+    for item in response["Items"]:
+        # NOTE: all message has the same model. `system` is stored in DynamoDB even for large messages.
+        model = decode_message_map(item["MessageMap"]).get("system", {}).get("model", "")
+        print(f"  - {item['SK']}: {model}")
+        table.update_item(
+            Key={"PK": item["PK"], "SK": item["SK"]},
+            UpdateExpression="SET Model = :m",
+            ExpressionAttributeValues={":m": model},
+            ConditionExpression="attribute_exists(PK) AND attribute_not_exists(Model)",
+        )
+        backfilled += 1
+
+    if "LastEvaluatedKey" not in response:
+        break
+
+    scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+print(f"Backfilled {backfilled} conversations.")
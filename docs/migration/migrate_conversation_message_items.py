@@ -0,0 +1,215 @@
+import json
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Migrate conversations stored on `message_map` layout (whole message tree in `MessageMap` attribute)
+# to `message_item` layout (one item per message), which is enabled by `CONVERSATION_STORAGE_MODE=message_item`.
+# NOTE: Migration is optional. The backend migrates a conversation lazily when a message is appended to it.
+
+# Open the backend API Lambda function in the AWS Management Console and copy the values from its environment variables.
+# Key: TABLE_NAME
+TABLE_NAME = "BedrockChatStack-DatabaseConversationTableXXXXX"
+# Key: LARGE_MESSAGE_BUCKET
+LARGE_MESSAGE_BUCKET = "bedrockchatstack-largemessagebucketxxxxx"
+
+# Messages larger than this are stored in S3, since a DynamoDB item is limited to 400KB.
+# Same as `THRESHOLD_LARGE_MESSAGE` of the backend.
+THRESHOLD_LARGE_MESSAGE = 300 * 1024
+# Attempts to migrate a conversation being changed by the backend
+MAX_ATTEMPTS = 3
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(TABLE_NAME)
+s3 = boto3.client("s3")
+
+
+def decode_message_map(value) -> dict:
+    if isinstance(value, str):
+        return json.loads(value)
+
+    # Versioned binary: 1 = zlib compressed JSON
+    data = bytes(value)
+    if data[0] != 1:
+        raise ValueError(f"Unknown message map encoding: {data[0]}")
+
+    return json.loads(zlib.decompress(data[1:]))
+
+
+def load_message_map(item: dict) -> dict:
+    if item.get("LargeMessageLayout") == "SEGMENTED":
+        # One object per message, indexed by `MessageIndex`
+        message_map = {}
+        for message_id in item["MessageIndex"].keys():
+            response = s3.get_object(
+                Bucket=LARGE_MESSAGE_BUCKET,
+                Key=f"{item['LargeMessagePath']}{message_id}.json",
+            )
+            message_map[message_id] = json.loads(response["Body"].read())
+        return message_map
+
+    if item.get("IsLargeMessage", False):
+        response = s3.get_object(
+            Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
+        )
+        return json.loads(response["Body"].read().decode("utf-8"))
+
+    return decode_message_map(item["MessageMap"])
+
+
+def delete_large_messages(item: dict):
+    if item.get("LargeMessageLayout") == "SEGMENTED":
+        keys = [
+            f"{item['LargeMessagePath']}{message_id}.json"
+            for message_id in item["MessageIndex"].keys()
+        ]
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(
+                Bucket=LARGE_MESSAGE_BUCKET,
+                Delete={"Objects": [{"Key": key} for key in keys[i : i + 1000]]},
+            )
+
+    elif item.get("IsLargeMessage", False):
+        s3.delete_object(Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"])
+
+
+def compose_message_item_key(user_id: str, conversation_id: str, message_id: str):
+    return {
+        "PK": user_id,
+        "SK": f"{user_id}#CONV_MESSAGE#{conversation_id}#{message_id}",
+    }
+
+
+def compose_message_item_path(user_id: str, conversation_id: str, message_id: str):
+    # NOTE: Not under `LargeMessagePath` of the conversation, which is deleted after the migration
+    return f"{user_id}/{conversation_id}/message_items/{message_id}.json"
+
+
+def write_message_items(user_id: str, conversation_id: str, message_map: dict):
+    with table.batch_writer() as writer:
+        for message_id, message in message_map.items():
+            # `children` is restored from `parent` by the backend
+            message.pop("children", None)
+            message_item = compose_message_item_key(
+                user_id, conversation_id, message_id
+            )
+            message_json = json.dumps(message)
+            if len(message_json.encode("utf-8")) > THRESHOLD_LARGE_MESSAGE:
+                key = compose_message_item_path(user_id, conversation_id, message_id)
+                s3.put_object(Bucket=LARGE_MESSAGE_BUCKET, Key=key, Body=message_json)
+                message_item["IsLargeMessage"] = True
+                message_item["LargeMessagePath"] = key
+            else:
+                message_item["Message"] = message_json
+
+            writer.put_item(Item=message_item)
+
+
+def delete_message_items(user_id: str, conversation_id: str, message_ids: set):
+    with table.batch_writer() as writer:
+        for message_id in message_ids:
+            writer.delete_item(
+                Key=compose_message_item_key(user_id, conversation_id, message_id)
+            )
+
+    # Keys of the messages stored in the table are not found, which is not an error
+    keys = [
+        compose_message_item_path(user_id, conversation_id, message_id)
+        for message_id in message_ids
+    ]
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys[i : i + 1000]]},
+        )
+
+
+def migrate_conversation(item: dict) -> bool:
+    """Migrate the conversation, unless it is changed by the backend during the migration
+    more than `MAX_ATTEMPTS` times. Return whether migrated.
+    """
+    user_id = item["PK"]
+    conversation_id = item["SK"].split("#")[-1]
+    # Message items written by the previous attempts
+    written: set = set()
+
+    for _ in range(MAX_ATTEMPTS):
+        message_map = load_message_map(item)
+        write_message_items(user_id, conversation_id, message_map)
+        # Messages deleted since the previous attempt, e.g. by regenerating a response
+        delete_message_items(user_id, conversation_id, written - message_map.keys())
+        written = set(message_map.keys())
+
+        # NOTE: Fails if a chat turn is stored after the item is read, so that the turn is never lost
+        if "Version" in item:
+            condition = (
+                "attribute_not_exists(MessageStorage) AND #version = :loaded_version"
+            )
+            version_values = {":loaded_version": item["Version"]}
+        else:
+            condition = "attribute_not_exists(MessageStorage) AND attribute_not_exists(#version)"
+            version_values = {}
+
+        try:
+            table.update_item(
+                Key={"PK": item["PK"], "SK": item["SK"]},
+                UpdateExpression="SET MessageStorage = :s, Model = :m REMOVE MessageMap, IsLargeMessage, LargeMessagePath, LargeMessageLayout, MessageIndex ADD #version :one",
+                ExpressionAttributeNames={"#version": "Version"},
+                ExpressionAttributeValues={
+                    ":s": "ITEM",
+                    ":m": message_map.get("system", {}).get("model", ""),
+                    ":one": 1,
+                    **version_values,
+                },
+                ConditionExpression=condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+            item = table.get_item(
+                Key={"PK": item["PK"], "SK": item["SK"]}, ConsistentRead=True
+            ).get("Item")
+            if item is None:
+                # Deleted during the migration
+                delete_message_items(user_id, conversation_id, written)
+                return False
+            if "MessageStorage" in item:
+                # Migrated by the backend, which owns the message items from now on
+                return False
+
+            print("    Changed during the migration. Retrying.")
+            continue
+
+        delete_large_messages(item)
+        return True
+
+    delete_message_items(user_id, conversation_id, written)
+    print(f"    Changed during the migration {MAX_ATTEMPTS} times. Skipped.")
+    return False
+
+
+scan_kwargs = {
+    "FilterExpression": "contains(SK, :substring) AND attribute_not_exists(MessageStorage)",
+    "ExpressionAttributeValues": {":substring": "#CONV#"},
+}
+
+migrated = 0
+skipped = 0
+while True:
+    response = table.scan(**scan_kwargs)
+
+    for item in response["Items"]:
+        print(f"  - Migrating {item['SK']}")
+        if migrate_conversation(item):
+            migrated += 1
+        else:
+            skipped += 1
+
+    if "LastEvaluatedKey" not in response:
+        break
+
+    scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+print(f"Migrated {migrated} conversations. Skipped {skipped} conversations.")
@@ -79,6 +79,7 @@ export type Direction =
 
 export const PostStreamingStatus = {
   START: 'START',
+  UPLOAD: 'UPLOAD',
   BODY: 'BODY',
   STREAMING: 'STREAMING',
   STREAMING_END: 'STREAMING_END',
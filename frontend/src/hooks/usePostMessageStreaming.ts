@@ -35,6 +35,9 @@ const usePostMessageStreaming = create<{
         chunkedPayloads.push(payloadString.substring(start, end));
       }
 
+      // Upload the payload to S3 at once, instead of sending it in parts
+      const upload = chunkCount > 1;
+
       let receivedCount = 0;
       return new Promise<string>((resolve, reject) => {
         let completion = '';
@@ -45,10 +48,156 @@ const usePostMessageStreaming = create<{
             JSON.stringify({
               step: PostStreamingStatus.START,
               token: token,
+              upload,
+              // Hints to prefetch the conversation while sending the payload
+              conversationId: input.conversationId,
+              botId: input.botId,
             })
           );
         };
 
+        const sendParts = () => {
+          chunkedPayloads.forEach((chunk, index) => {
+            ws.send(
+              JSON.stringify({
+                step: PostStreamingStatus.BODY,
+                index,
+                part: chunk,
+              })
+            );
+          });
+        };
+
+        const uploadPayload = (url: string, objectKey: string) => {
+          fetch(url, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(input),
+          })
+            .then((response) => {
+              if (!response.ok) {
+                throw new Error(`Failed to upload: ${response.status}`);
+              }
+              ws.send(
+                JSON.stringify({
+                  step: PostStreamingStatus.END,
+                  objectKey,
+                })
+              );
+            })
+            .catch((e) => {
+              // Fall back to sending the payload in parts
+              console.warn(e);
+              sendParts();
+            });
+        };
+
+        // eslint-disable-next-line @typescript-eslint/no-explicit-any
+        const handleData = (data: any) => {
+          if (data.status) {
+            switch (data.status) {
+              case PostStreamingStatus.AGENT_THINKING:
+                if (completion.length > 0) {
+                  dispatch('');
+                  thinkingDispatch({
+                    type: 'thought',
+                    thought: completion,
+                  });
+                  completion = '';
+                }
+                Object.entries(data.log).forEach(([toolUseId, toolInfo]) => {
+                  const typedToolInfo = toolInfo as {
+                    name: string;
+                    input: { [key: string]: any }; // eslint-disable-line @typescript-eslint/no-explicit-any
+                  };
+                  thinkingDispatch({
+                    type: 'go-on',
+                    toolUseId: toolUseId,
+                    name: typedToolInfo.name,
+                    input: typedToolInfo.input,
+                  });
+                });
+                break;
+              case PostStreamingStatus.AGENT_TOOL_RESULT:
+                thinkingDispatch({
+                  type: 'tool-result',
+                  toolUseId: data.result.toolUseId,
+                  status: data.result.status,
+                });
+                break;
+              case PostStreamingStatus.AGENT_RELATED_DOCUMENT:
+                thinkingDispatch({
+                  type: 'related-document',
+                  toolUseId: data.result.toolUseId,
+                  relatedDocument: data.result.relatedDocument,
+                });
+                break;
+              case PostStreamingStatus.STREAMING:
+                if (data.completion || data.completion === '') {
+                  completion += data.completion;
+                  dispatch(completion);
+                }
+                break;
+              case PostStreamingStatus.STREAMING_END:
+                thinkingDispatch({
+                  type: 'goodbye',
+                });
+                ws.close();
+                break;
+              case PostStreamingStatus.ERROR:
+                ws.close();
+                console.error(data);
+                set({
+                  errorDetail:
+                    data.reason || i18next.t('error.predict.invalidResponse'),
+                });
+                throw new Error(
+                  data.reason || i18next.t('error.predict.invalidResponse')
+                );
+              default:
+                dispatch('');
+                break;
+            }
+          } else {
+            ws.close();
+            console.error(data);
+            throw new Error(i18next.t('error.predict.invalidResponse'));
+          }
+        };
+
+        // Streaming frames may arrive out of order when the backend posts them concurrently,
+        // so frames with `seq` are handled in the order of `seq`.
+        let nextSeq = 0;
+        // eslint-disable-next-line @typescript-eslint/no-explicit-any
+        const pendingFrames = new Map<number, any>();
+        // eslint-disable-next-line @typescript-eslint/no-explicit-any
+        const reorder = (data: any) => {
+          if (typeof data.seq !== 'number') {
+            return [data];
+          }
+          pendingFrames.set(data.seq, data);
+
+          const frames = [];
+          if (data.status !== PostStreamingStatus.STREAMING) {
+            // Other than streaming frames are sent after all preceding frames are done,
+            // so do not wait for the frames which failed to be sent.
+            [...pendingFrames.keys()]
+              .filter((seq) => seq <= data.seq)
+              .sort((a, b) => a - b)
+              .forEach((seq) => {
+                frames.push(pendingFrames.get(seq));
+                pendingFrames.delete(seq);
+              });
+            nextSeq = data.seq + 1;
+          }
+          while (pendingFrames.has(nextSeq)) {
+            frames.push(pendingFrames.get(nextSeq));
+            pendingFrames.delete(nextSeq);
+            nextSeq++;
+          }
+          return frames;
+        };
+
         ws.onmessage = (message) => {
           try {
             if (
@@ -61,15 +210,7 @@ const usePostMessageStreaming = create<{
             ) {
               return;
             } else if (message.data === 'Session started.') {
-              chunkedPayloads.forEach((chunk, index) => {
-                ws.send(
-                  JSON.stringify({
-                    step: PostStreamingStatus.BODY,
-                    index,
-                    part: chunk,
-                  })
-                );
-              });
+              sendParts();
               return;
             } else if (message.data === 'Message part received.') {
               receivedCount++;
@@ -84,76 +225,11 @@ const usePostMessageStreaming = create<{
             }
 
             const data = JSON.parse(message.data);
-
-            if (data.status) {
-              switch (data.status) {
-                case PostStreamingStatus.AGENT_THINKING:
-                  if (completion.length > 0) {
-                    dispatch('');
-                    thinkingDispatch({
-                      type: 'thought',
-                      thought: completion,
-                    });
-                    completion = '';
-                  }
-                  Object.entries(data.log).forEach(([toolUseId, toolInfo]) => {
-                    const typedToolInfo = toolInfo as {
-                      name: string;
-                      input: { [key: string]: any }; // eslint-disable-line @typescript-eslint/no-explicit-any
-                    };
-                    thinkingDispatch({
-                      type: 'go-on',
-                      toolUseId: toolUseId,
-                      name: typedToolInfo.name,
-                      input: typedToolInfo.input,
-                    });
-                  });
-                  break;
-                case PostStreamingStatus.AGENT_TOOL_RESULT:
-                  thinkingDispatch({
-                    type: 'tool-result',
-                    toolUseId: data.result.toolUseId,
-                    status: data.result.status,
-                  });
-                  break;
-                case PostStreamingStatus.AGENT_RELATED_DOCUMENT:
-                  thinkingDispatch({
-                    type: 'related-document',
-                    toolUseId: data.result.toolUseId,
-                    relatedDocument: data.result.relatedDocument,
-                  });
-                  break;
-                case PostStreamingStatus.STREAMING:
-                  if (data.completion || data.completion === '') {
-                    completion += data.completion;
-                    dispatch(completion);
-                  }
-                  break;
-                case PostStreamingStatus.STREAMING_END:
-                  thinkingDispatch({
-                    type: 'goodbye',
-                  });
-                  ws.close();
-                  break;
-                case PostStreamingStatus.ERROR:
-                  ws.close();
-                  console.error(data);
-                  set({
-                    errorDetail:
-                      data.reason || i18next.t('error.predict.invalidResponse'),
-                  });
-                  throw new Error(
-                    data.reason || i18next.t('error.predict.invalidResponse')
-                  );
-                default:
-                  dispatch('');
-                  break;
-              }
-            } else {
-              ws.close();
-              console.error(data);
-              throw new Error(i18next.t('error.predict.invalidResponse'));
+            if (data.status === PostStreamingStatus.UPLOAD) {
+              uploadPayload(data.url, data.objectKey);
+              return;
             }
+            reorder(data).forEach(handleData);
           } catch (e) {
             console.error(e);
             reject(i18next.t('error.predict.general'));